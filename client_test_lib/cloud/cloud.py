@@ -25,12 +25,14 @@ class PelionCloud:
     Pelion Cloud class to provide handles for all rest api libraries
     :param api_gw: api gateway url
     :param api_key: api-key
+    :param pool_options: Connection pool options for RestAPI, e.g.
+                         pool_maxsize, max_retries, keep_alive
     """
 
-    def __init__(self, api_gw, api_key):
+    def __init__(self, api_gw, api_key, **pool_options):
         self._api_gw = api_gw
         self._api_key = api_key
-        self._rest_api = RestAPI(api_gw, api_key)
+        self._rest_api = RestAPI(api_gw, api_key, **pool_options)
         self._account = AccountManagementAPI(self._rest_api)
         self._connect = ConnectAPI(self._rest_api)
         self._device_directory = DeviceDirectoryAPI(self._rest_api)
@@ -86,3 +88,9 @@ class PelionCloud:
         Returns Update API class
         """
         return self._update
+
+    def close(self):
+        """
+        Close the shared REST API session
+        """
+        self._rest_api.close()
@@ -41,6 +41,22 @@ class AccountManagementAPI:
         )
         return r
 
+    def get_api_keys(
+        self, query_params=None, headers=None, expected_status_code=None
+    ):
+        """
+        Get API keys
+        :param query_params: e.g.{'limit': '1000', 'after': '<api key id>'}
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: GET /api-keys response
+        """
+        api_url = "/{}/api-keys".format(self.api_version)
+        r = self.cloud_api.get(
+            api_url, headers, expected_status_code, params=query_params
+        )
+        return r
+
     def delete_api_key(
         self, api_key_id, headers=None, expected_status_code=None
     ):
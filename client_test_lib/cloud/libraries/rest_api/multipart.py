@@ -0,0 +1,176 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+import logging
+import os
+from time import monotonic
+import uuid
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+_FILE = object()
+
+
+class MultipartFileEncoder:
+    """
+    Streaming multipart/form-data request body with one file field.
+    The file is read in chunks while the request is sent, so memory usage
+    does not depend on the file size. Use as the request data with
+    content_type as the Content-type header, e.g.
+        with MultipartFileEncoder("datafile", path) as body:
+            rest_api.post(url, body, {"Content-type": body.content_type})
+    :param field_name: Form field name of the file
+    :param file_path: Path to the uploaded file
+    :param fields: dict of other form field name -> string value
+    :param file_content_type: Content type of the file part
+    :param chunk_size: Maximum number of bytes read from the file at once
+    :param progress: Function (bytes_sent, total_bytes) called per chunk
+    """
+
+    def __init__(
+        self,
+        field_name,
+        file_path,
+        fields=None,
+        file_content_type="application/octet-stream",
+        chunk_size=CHUNK_SIZE,
+        progress=None,
+    ):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.progress = progress
+        boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={}".format(boundary)
+        preamble = b""
+        for name, value in (fields or {}).items():
+            preamble += (
+                '--{}\r\nContent-Disposition: form-data; name="{}"'
+                "\r\n\r\n{}\r\n".format(boundary, name, value).encode()
+            )
+        preamble += (
+            '--{}\r\nContent-Disposition: form-data; name="{}"; '
+            'filename="{}"\r\nContent-Type: {}\r\n\r\n'.format(
+                boundary,
+                field_name,
+                os.path.basename(file_path),
+                file_content_type,
+            ).encode()
+        )
+        self._preamble = preamble
+        self._epilogue = "\r\n--{}--\r\n".format(boundary).encode()
+        self._length = (
+            len(preamble) + os.path.getsize(file_path) + len(self._epilogue)
+        )
+        self._file = None
+        self._parts = None
+        self.bytes_sent = 0
+        self.started = None
+        self.finished = None
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def tell(self):
+        """
+        :return: Number of bytes read so far
+        """
+        return self.bytes_sent
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Rewind the body for a retried request, only the start is supported
+        :param offset: Must be 0
+        :param whence: Must be os.SEEK_SET
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise OSError("Multipart body can only be rewound to the start")
+        self.close()
+        self._parts = deque([self._preamble, _FILE, self._epilogue])
+        self.bytes_sent = 0
+
+    def read(self, size=-1):
+        """
+        Read next bytes of the body
+        :param size: Maximum number of bytes, negative for one chunk
+        :return: bytes, empty at the end of the body
+        """
+        if size is None or size < 0:
+            size = self.chunk_size
+        if self.started is None:
+            self.started = monotonic()
+        data = []
+        remaining = size
+        while remaining > 0 and self._parts:
+            part = self._parts[0]
+            if part is _FILE:
+                if self._file is None:
+                    self._file = open(self.file_path, "rb")
+                chunk = self._file.read(min(remaining, self.chunk_size))
+                if not chunk:
+                    self.close()
+                    self._parts.popleft()
+                    continue
+            else:
+                chunk = part[:remaining]
+                if len(part) > remaining:
+                    self._parts[0] = part[remaining:]
+                else:
+                    self._parts.popleft()
+            data.append(chunk)
+            remaining -= len(chunk)
+        chunk = b"".join(data)
+        self.bytes_sent += len(chunk)
+        if self.progress and chunk:
+            self.progress(self.bytes_sent, self._length)
+        if not self._parts and self.finished is None:
+            self.finished = monotonic()
+        return chunk
+
+    def close(self):
+        """
+        Close the file
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        """
+        Upload statistics, the time is measured from the first to the last
+        read of the body by the HTTP connection
+        :return: dict with bytes, seconds and bytes_per_second
+        """
+        end = self.finished or monotonic()
+        seconds = end - self.started if self.started else 0
+        return {
+            "bytes": self.bytes_sent,
+            "seconds": seconds,
+            "bytes_per_second": self.bytes_sent / seconds if seconds else None,
+        }
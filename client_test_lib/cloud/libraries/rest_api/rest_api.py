@@ -18,6 +18,8 @@ import inspect
 import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from client_test_lib.tools.utils import assert_status
 
 log = logging.getLogger(__name__)
@@ -26,16 +28,53 @@ urllib3_logger = logging.getLogger("urllib3")
 urllib3_logger.setLevel(logging.WARNING)
 
 
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
 class RestAPI:
     """
-    Rest API connection class - uses requests
+    Rest API connection class - uses one pooled requests session
     :param api_gw: api gateway url
     :param api_key: api-key
+    :param pool_connections: Number of per-host connection pools to cache
+    :param pool_maxsize: Maximum number of kept-alive connections per host
+    :param pool_block: Block when per-host pool is exhausted instead of
+                       opening extra short-lived connections
+    :param max_retries: Retries for connection errors and gateway errors
+                        (502, 503, 504) on idempotent requests
+    :param keep_alive: Reuse connections between requests
     """
 
-    def __init__(self, api_gw, api_key):
+    def __init__(
+        self,
+        api_gw,
+        api_key,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=DEFAULT_MAX_RETRIES,
+        keep_alive=True,
+    ):
         self.api_gw = api_gw
         self._api_key = api_key
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            max_retries=Retry(
+                total=max_retries,
+                backoff_factor=DEFAULT_RETRY_BACKOFF,
+                status_forcelist=RETRY_STATUS_CODES,
+                raise_on_status=False,
+            ),
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
         user_agent = "client-e2e-test-library"
         default_content_type = "application/json"
 
@@ -44,6 +83,8 @@ class RestAPI:
             "Content-type": "{}".format(default_content_type),
             "Authorization": "Bearer {}".format(self._api_key),
         }
+        if not keep_alive:
+            self.headers["Connection"] = "close"
 
     def set_default_api_key(self, key):
         """
@@ -61,6 +102,44 @@ class RestAPI:
         """
         return self._api_key
 
+    def pool_stats(self):
+        """
+        Connection pool statistics of the shared session
+        :return: dict with request count, new and reused connection counts
+                 and per-host breakdown
+        """
+        stats = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "hosts": {},
+        }
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = {
+                "requests": pool.num_requests,
+                "new_connections": pool.num_connections,
+                "reused_connections": max(
+                    pool.num_requests - pool.num_connections, 0
+                ),
+            }
+            stats["hosts"][
+                "{}://{}".format(pool.scheme, pool.host)
+            ] = host_stats
+            for name in ("requests", "new_connections", "reused_connections"):
+                stats[name] += host_stats[name]
+        return stats
+
+    def close(self):
+        """
+        Close the session and all pooled connections
+        """
+        log.debug("Closing REST API session, {}".format(self.pool_stats()))
+        self.session.close()
+
     @staticmethod
     def _clean_request_body(req_body):
         """
@@ -127,7 +206,7 @@ class RestAPI:
         """
         url = self.api_gw + api_url
         request_headers = self._combine_headers(headers)
-        r = requests.get(url, headers=request_headers, **kwargs)
+        r = self.session.get(url, headers=request_headers, **kwargs)
         self._write_log_response("GET", api_url, r)
         if expected_status_code is not None:
             assert_status(r, inspect.stack()[1][3], expected_status_code)
@@ -154,7 +233,7 @@ class RestAPI:
         url = self.api_gw + api_url
         request_headers = self._combine_headers(headers)
         request_data = self._data_content(request_headers, data)
-        r = requests.put(
+        r = self.session.put(
             url, headers=request_headers, data=request_data, **kwargs
         )
         self._write_log_response("PUT", api_url, r)
@@ -185,7 +264,7 @@ class RestAPI:
         if "files" in kwargs:
             request_headers.pop("Content-type")
         request_data = self._data_content(request_headers, data)
-        r = requests.post(
+        r = self.session.post(
             url, headers=request_headers, data=request_data, **kwargs
         )
         self._write_log_response("POST", api_url, r)
@@ -207,7 +286,7 @@ class RestAPI:
         """
         url = self.api_gw + api_url
         request_headers = self._combine_headers(headers)
-        r = requests.delete(url, headers=request_headers, **kwargs)
+        r = self.session.delete(url, headers=request_headers, **kwargs)
         self._write_log_response("DELETE", api_url, r)
         if expected_status_code is not None:
             assert_status(r, inspect.stack()[1][3], expected_status_code)
@@ -13,6 +13,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import logging
+from client_test_lib.cloud.libraries.rest_api.multipart import (
+    MultipartFileEncoder,
+)
+
+log = logging.getLogger(__name__)
+
 
 class UpdateAPI:
     """
@@ -25,6 +32,41 @@ class UpdateAPI:
         self.api_version = "v3"
         self.cloud_api = rest_api
 
+    def _upload_file(
+        self, api_url, file_path, request_data, headers, expected_status_code
+    ):
+        """
+        Upload file as streamed multipart/form-data datafile field
+        :param api_url: API endpoint url
+        :param file_path: Path to the uploaded file
+        :param request_data: Other form fields (optional)
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: POST response
+        """
+        with MultipartFileEncoder(
+            "datafile", file_path, fields=request_data
+        ) as body:
+            _headers = {"Content-type": body.content_type}
+            if headers:
+                _headers.update(headers)
+            r = self.cloud_api.post(
+                api_url, body, _headers, expected_status_code
+            )
+        stats = body.stats()
+        log.info(
+            "Uploaded {} bytes in {:.2f} s{}".format(
+                stats["bytes"],
+                stats["seconds"],
+                (
+                    " ({:.2f} MB/s)".format(stats["bytes_per_second"] / 1e6)
+                    if stats["bytes_per_second"]
+                    else ""
+                ),
+            )
+        )
+        return r
+
     def create_update_campaign(
         self, request_data, headers=None, expected_status_code=None
     ):
@@ -58,19 +100,26 @@ class UpdateAPI:
         return r
 
     def get_update_campaign_metadata(
-        self, campaign_id, headers=None, expected_status_code=None
+        self,
+        campaign_id,
+        headers=None,
+        expected_status_code=None,
+        query_params=None,
     ):
         """
         Get update campaign device metadata
         :param campaign_id: Campaign id
         :param headers: Override default header fields
         :param expected_status_code: Asserts the result's status code
+        :param query_params: e.g.{'limit': '1000', 'after': '<metadata id>'}
         :return: GET /update-campaign/{campaign_id}/campaign-device-metadata response
         """
         api_url = "/{}/update-campaigns/{}/campaign-device-metadata".format(
             self.api_version, campaign_id
         )
-        r = self.cloud_api.get(api_url, headers, expected_status_code)
+        r = self.cloud_api.get(
+            api_url, headers, expected_status_code, params=query_params
+        )
         return r
 
     def get_update_campaigns(
@@ -159,17 +208,44 @@ class UpdateAPI:
         :return: POST /firmware-images response
         """
         api_url = "/{}/firmware-images".format(self.api_version)
-        _headers = {"Content-type": "multipart/form-data"}
-        if headers:
-            _headers.update(headers)
-        fw_image = {"datafile": open(firmware_binary_path, "rb")}
-        r = self.cloud_api.post(
+        return self._upload_file(
             api_url,
+            firmware_binary_path,
             request_data,
-            _headers,
+            headers,
             expected_status_code,
-            files=fw_image,
         )
+
+    def get_firmware_images(
+        self, query_params=None, headers=None, expected_status_code=None
+    ):
+        """
+        Get firmware images
+        :param query_params: e.g.{'limit': '1000', 'after': '<firmware id>'}
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: GET /firmware-images response
+        """
+        api_url = "/{}/firmware-images".format(self.api_version)
+        r = self.cloud_api.get(
+            api_url, headers, expected_status_code, params=query_params
+        )
+        return r
+
+    def get_firmware_image(
+        self, firmware_id, headers=None, expected_status_code=None
+    ):
+        """
+        Get firmware image
+        :param firmware_id: Firmware id
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: GET /firmware-images/{firmware_id} response
+        """
+        api_url = "/{}/firmware-images/{}".format(
+            self.api_version, firmware_id
+        )
+        r = self.cloud_api.get(api_url, headers, expected_status_code)
         return r
 
     def delete_firmware_image(
@@ -206,17 +282,44 @@ class UpdateAPI:
         :return: POST /firmware-manifests response
         """
         api_url = "/{}/firmware-manifests".format(self.api_version)
-        _headers = {"Content-type": "multipart/form-data"}
-        if headers:
-            _headers.update(headers)
-        manifest_file = {"datafile": open(manifest_file_path, "rb")}
-        r = self.cloud_api.post(
+        return self._upload_file(
             api_url,
+            manifest_file_path,
             request_data,
-            _headers,
+            headers,
             expected_status_code,
-            files=manifest_file,
         )
+
+    def get_firmware_manifests(
+        self, query_params=None, headers=None, expected_status_code=None
+    ):
+        """
+        Get firmware manifests
+        :param query_params: e.g.{'limit': '1000', 'after': '<manifest id>'}
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: GET /firmware-manifests response
+        """
+        api_url = "/{}/firmware-manifests".format(self.api_version)
+        r = self.cloud_api.get(
+            api_url, headers, expected_status_code, params=query_params
+        )
+        return r
+
+    def get_firmware_manifest(
+        self, manifest_id, headers=None, expected_status_code=None
+    ):
+        """
+        Get firmware manifest
+        :param manifest_id: Manifest id
+        :param headers: Override default header fields
+        :param expected_status_code: Asserts the result's status code
+        :return: GET /firmware-manifests/{manifest_id} response
+        """
+        api_url = "/{}/firmware-manifests/{}".format(
+            self.api_version, manifest_id
+        )
+        r = self.cloud_api.get(api_url, headers, expected_status_code)
         return r
 
     def delete_firmware_manifest(
@@ -19,6 +19,7 @@ from time import sleep
 import pytest
 from client_test_lib.tools.client_runner import Client
 from client_test_lib.tools.external_conn import ExternalConnection
+from client_test_lib.tools.fleet import ClientFleet
 from client_test_lib.tools.local_conn import LocalConnection
 from client_test_lib.tools.serial_conn import SerialConnection
 from client_test_lib.tools.utils import get_serial_port_for_mbed
@@ -78,3 +79,28 @@ def client(client_internal):
     """
     client_internal.clear_input()
     return client_internal
+
+
+@pytest.fixture(scope="module")
+def client_fleet(request, tmp_path_factory):
+    """
+    Starts --fleet_size local client binaries and waits for them to register.
+    :return: ClientFleet with registration statistics
+    """
+    local_binary = request.config.getoption("local_binary")
+    if not local_binary:
+        err_msg = "Client fleet requires --local_binary"
+        log.error(err_msg)
+        assert False, err_msg
+
+    fleet = ClientFleet(
+        local_binary,
+        request.config.getoption("fleet_size", 10),
+        str(tmp_path_factory.mktemp("client-fleet")),
+    )
+    fleet.start()
+    fleet.wait_for_registration(300, assert_errors=False)
+
+    yield fleet
+
+    fleet.close()
@@ -16,26 +16,32 @@ limitations under the License.
 
 import logging
 import os
-from time import sleep
 import pytest
 from client_test_lib.cloud.cloud import PelionCloud
-from client_test_lib.helpers.update_helper import wait_for_campaign_phase
+from client_test_lib.helpers.cleanup import (
+    CleanupRegistry,
+    e2e_name,
+    sweep_orphans,
+)
+from client_test_lib.helpers.connect_helper import wait_for_device_state
+from client_test_lib.helpers.event_store import RetentionPolicy
+from client_test_lib.helpers.firmware_cache import FirmwareCache
 import client_test_lib.helpers.websocket_handler as websocket_handler
+from client_test_lib.tools.delta_tool import DeltaCache
 import client_test_lib.tools.manifest_tool as manifest_tool
+from client_test_lib.tools.task_graph import TaskGraph
 from client_test_lib.tools.utils import build_random_string
 
 log = logging.getLogger(__name__)
 
+WEBSOCKET_OPEN_TIMEOUT = 60
 
-@pytest.fixture(scope="module")
-def cloud():
+
+def _cloud_from_env():
     """
-    Fixture for Pelion cloud
-    Initializes the rest api with the api key given in config
+    Initializes the rest api with the api key given in environment
     :return: Cloud API object
     """
-    log.debug("Initializing Cloud API fixture")
-
     api_gw = os.environ.get(
         "CLOUD_API_GW", "https://api.us-east-1.mbedcloud.com"
     )
@@ -57,83 +63,355 @@ def cloud():
             )
         )
 
-    cloud_api = PelionCloud(api_gw, api_key)
+    return PelionCloud(api_gw, api_key)
+
+
+@pytest.fixture(scope="module")
+def cloud():
+    """
+    Fixture for Pelion cloud
+    Initializes the rest api with the api key given in config
+    :return: Cloud API object
+    """
+    log.debug("Initializing Cloud API fixture")
+    cloud_api = _cloud_from_env()
 
     yield cloud_api
 
+    log.info(
+        "REST API connection pool stats: {}".format(
+            cloud_api.rest_api.pool_stats()
+        )
+    )
+    cloud_api.close()
 
-@pytest.fixture(scope="module")
-def api_key(cloud, request):
+
+@pytest.fixture(scope="session")
+def session_cloud():
     """
-    Create new temporary module level developer API key
+    Session wide Pelion cloud shared by the session fixtures
+    :return: Cloud API object
+    """
+    log.debug("Initializing session Cloud API fixture")
+    cloud_api = _cloud_from_env()
+
+    yield cloud_api
+
+    log.info(
+        "Session REST API connection pool stats: {}".format(
+            cloud_api.rest_api.pool_stats()
+        )
+    )
+    cloud_api.close()
+
+
+@pytest.fixture(scope="session")
+def session_api_key(session_cloud, request):
+    """
+    Create new temporary session level developer API key, the session
+    WebSocket channel belongs to it.
     When running testset with 'use_one_apikey' argument this does not
     create new one but returns current API key.
-    :param cloud: Cloud fixture
+    :param session_cloud: Session cloud fixture
+    :param request: Request fixture
     :return: API key
     """
-    use_current = request.config.getoption("use_one_apikey", False)
-    temp_key_id = None
+    cloud_api = session_cloud
+    cleanup = CleanupRegistry(cloud_api)
 
-    payload = {"name": "pelion_e2e_dynamic_api_key"}
-    if use_current:
+    payload = {"name": e2e_name("dynamic_api_key")}
+    if request.config.getoption("use_one_apikey", False):
         log.info("Using current API key, not creating temporary one")
-        key = cloud.rest_api.api_key
+        key = cloud_api.rest_api.api_key
     else:
         log.info("Creating new developer API key")
-        r = cloud.account.create_api_key(payload, expected_status_code=201)
+        r = cloud_api.account.create_api_key(payload, expected_status_code=201)
         resp = r.json()
         key = resp["key"]
-        temp_key_id = resp["id"]
+        cleanup.add_api_key(resp["id"])
         log.info(
             "Created new developer API key for the test run, ID: {}".format(
-                temp_key_id
+                resp["id"]
             )
         )
 
     yield key
 
-    if temp_key_id:
-        log.info(
-            "Cleaning out the generated test set developer "
-            "API key, ID: {}".format(temp_key_id)
-        )
-        cloud.account.delete_api_key(temp_key_id, expected_status_code=204)
+    cleanup.cleanup()
 
 
 @pytest.fixture(scope="module")
-def websocket(cloud, api_key):
+def api_key(session_api_key):
+    """
+    Developer API key of the test module. It is the session API key so
+    that async responses of the requests made with it are received by the
+    session WebSocket channel, no API key is created or deleted per module.
+    :param session_api_key: Session API key fixture
+    :return: API key
+    """
+    return session_api_key
+
+
+def _websocket_retention(request):
+    """
+    Build WebSocket event retention policies from startup arguments
+    :param request: Request fixture
+    :return: dict of notification type -> RetentionPolicy or None
+    """
+    max_events = request.config.getoption("ws_max_events", None)
+    max_age = request.config.getoption("ws_max_event_age", None)
+    if max_events is None and max_age is None:
+        return None
+    log.info(
+        "WebSocket event retention: max {} events, max age {} s".format(
+            max_events, max_age
+        )
+    )
+    retention = {
+        notification_type: RetentionPolicy(max_events, max_age)
+        for notification_type in websocket_handler.NOTIFICATION_TYPES
+    }
+    retention["async-responses"] = RetentionPolicy(
+        max_events, max_age, drop_after_consumed=True
+    )
+    return retention
+
+
+@pytest.fixture(scope="session")
+def websocket_channel(session_cloud, session_api_key, request):
+    """
+    Session wide WebSocket notification channel, tests use views of it
+    :param session_cloud: Session cloud fixture
+    :param session_api_key: Session API key fixture
+    :param request: Request fixture
+    :return: WebSocketHandler seeing all events of the channel
+    """
     log.info("Register and open WebSocket notification channel")
-    headers = {"Authorization": "Bearer {}".format(api_key)}
-    cloud.connect.register_websocket_channel(
+    cloud_api = session_cloud
+    headers = {"Authorization": "Bearer {}".format(session_api_key)}
+    cleanup = CleanupRegistry(cloud_api)
+    cloud_api.connect.register_websocket_channel(
         headers=headers, expected_status_code=[200, 201]
     )
-    sleep(5)
+    cleanup.add_websocket_channel(headers)
     # Get host part from api address
-    host = cloud.api_gw.split("//")[1]
+    host = cloud_api.api_gw.split("//")[1]
 
     log.info("Opening WebSocket handler")
     ws = websocket_handler.WebSocketRunner(
-        "wss://{}/v2/notification/websocket-connect".format(host), api_key
+        "wss://{}/v2/notification/websocket-connect".format(host),
+        session_api_key,
+        retention=_websocket_retention(request),
+        backfill=lambda device_id, resource_path: (
+            cloud_api.connect.get_device_resource_value(
+                device_id, resource_path, headers
+            )
+        ),
     )
-    handler = websocket_handler.WebSocketHandler(ws)
-    yield handler
+    if not ws.connected.wait(WEBSOCKET_OPEN_TIMEOUT):
+        ws.close()
+        cleanup.cleanup()
+        err_msg = "WebSocket channel did not open in {} s".format(
+            WEBSOCKET_OPEN_TIMEOUT
+        )
+        log.error(err_msg)
+        assert False, err_msg
+
+    yield websocket_handler.WebSocketHandler(ws)
 
+    log.debug("WebSocket evicted events: {}".format(ws.eviction_stats()))
+    log.info("WebSocket reconnects: {}".format(ws.reconnect_stats()))
     ws.close()
-    sleep(2)
     log.info("Deleting WebSocket channel")
-    cloud.connect.delete_websocket_channel(
-        headers=headers, expected_status_code=204
+    cleanup.cleanup()
+
+
+@pytest.fixture(scope="module")
+def websocket(websocket_channel):
+    """
+    View of the session WebSocket channel with the events received during
+    the test module
+    :param websocket_channel: Session WebSocket channel fixture
+    :return: WebSocketHandler
+    """
+    return websocket_channel.view()
+
+
+@pytest.fixture(scope="function")
+def websocket_view(websocket_channel):
+    """
+    View of the session WebSocket channel with the events received during
+    the test case
+    :param websocket_channel: Session WebSocket channel fixture
+    :return: WebSocketHandler
+    """
+    return websocket_channel.view()
+
+
+@pytest.fixture(scope="session")
+def firmware_cache(request):
+    """
+    Session wide cache of uploaded firmware images and manifests, enabled
+    with 'firmware_cache' argument. Released cached entries are deleted at
+    the end of the session unless 'no_cleanup' argument is given.
+    :param request: Request fixture
+    :return: FirmwareCache or None
+    """
+    if not request.config.getoption("firmware_cache", False):
+        yield None
+        return
+    log.info("Using firmware image and manifest cache")
+    cache = FirmwareCache(request.getfixturevalue("session_cloud"))
+
+    yield cache
+
+    if not request.config.getoption("no_cleanup", False):
+        cache.cleanup()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def orphan_sweeper(request):
+    """
+    Deletes test objects left behind by crashed or interrupted test runs
+    at the start of the session, enabled with 'sweep_orphans' argument.
+    :param request: Request fixture
+    """
+    if request.config.getoption("sweep_orphans", False):
+        log.info("Sweeping orphaned test objects")
+        sweep_orphans(request.getfixturevalue("session_cloud"))
+    yield
+
+
+def _upload_image(cloud, firmware_cache, cleanup, binary_path):
+    """
+    Upload firmware image
+    :param cloud: Cloud fixture
+    :param firmware_cache: FirmwareCache or None
+    :param cleanup: CleanupRegistry deleting or releasing the image
+    :param binary_path: Update image path
+    :return: Firmware image dict with id and datafile URL
+    """
+    if firmware_cache is not None:
+        fw_image = firmware_cache.firmware_image(binary_path)
+        cleanup.add_release(
+            "image",
+            fw_image["id"],
+            lambda fw_image_id: firmware_cache.release(
+                fw_image_id=fw_image_id
+            ),
+        )
+        return fw_image
+    fw_image = cloud.update.upload_firmware_image(
+        binary_path,
+        {"name": e2e_name(os.path.basename(binary_path))},
+        expected_status_code=201,
+    ).json()
+    cleanup.add_firmware_image(fw_image["id"])
+    log.info("Firmware image uploaded! Image ID: {}".format(fw_image["id"]))
+    return fw_image
+
+
+def _upload_manifest(
+    cloud, firmware_cache, cleanup, fw_image, binary_path, **manifest_options
+):
+    """
+    Create and upload manifest of the uploaded firmware image
+    :param cloud: Cloud fixture
+    :param firmware_cache: FirmwareCache or None
+    :param cleanup: CleanupRegistry deleting or releasing the manifest
+    :param fw_image: Firmware image dict
+    :param binary_path: Update image path
+    :param manifest_options: manifest_tool.create_manifest() arguments
+    :return: Manifest dict with id
+    """
+    if firmware_cache is not None:
+        manifest = firmware_cache.firmware_manifest(
+            fw_image, binary_path, **manifest_options
+        )
+        cleanup.add_release(
+            "manifest",
+            manifest["id"],
+            lambda manifest_id: firmware_cache.release(
+                manifest_id=manifest_id
+            ),
+        )
+        return manifest
+    manifest_file = manifest_tool.create_manifest(
+        firmware_url=fw_image["datafile"],
+        update_image_path=binary_path,
+        **manifest_options
+    )
+    assert manifest_file is not None, "Manifest file was not created"
+
+    try:
+        manifest = cloud.update.upload_firmware_manifest(
+            manifest_file,
+            {"name": e2e_name(os.path.basename(manifest_file))},
+            expected_status_code=201,
+        ).json()
+    finally:
+        # manifest files have unique names, don't leave them behind
+        os.remove(manifest_file)
+    cleanup.add_firmware_manifest(manifest["id"])
+    log.info(
+        "Firmware manifest uploaded! Manifest ID: {}".format(manifest["id"])
+    )
+    return manifest
+
+
+def _upload_firmware(
+    cloud, firmware_cache, cleanup, binary_path, **manifest_options
+):
+    """
+    Upload firmware image, create and upload its manifest
+    :param cloud: Cloud fixture
+    :param firmware_cache: FirmwareCache or None
+    :param cleanup: CleanupRegistry deleting or releasing the uploads
+    :param binary_path: Update image path
+    :param manifest_options: manifest_tool.create_manifest() arguments
+    :return: Tuple of firmware image id and manifest id
+    """
+    fw_image = _upload_image(cloud, firmware_cache, cleanup, binary_path)
+    manifest = _upload_manifest(
+        cloud,
+        firmware_cache,
+        cleanup,
+        fw_image,
+        binary_path,
+        **manifest_options
     )
+    return fw_image["id"], manifest["id"]
+
+
+def _update_image(request, binary_path):
+    """
+    Image to upload for the update, with --old_bin the delta image from the
+    old image to the update image is built or taken from the delta cache
+    :param request: Request fixture
+    :param binary_path: Update image path
+    :return: Tuple of image path and delta manifest input file or None
+    """
+    old_binary_path = request.config.getoption("old_bin", None)
+    if not old_binary_path:
+        return binary_path, request.config.getoption("delta_manifest", None)
+    delta_cache = DeltaCache(
+        request.config.getoption("delta_cache", "delta-cache")
+    )
+    delta = delta_cache.delta(old_binary_path, binary_path)
+    assert delta is not None, "Delta image was not created"
+    delta_cache.report()
+    return delta["delta"], delta["delta_manifest"]
 
 
 @pytest.fixture(scope="function")
-def update_device(cloud, client, request):
+def update_device(cloud, client, firmware_cache, request):
     """
     Fixture for updating device.
     This uploads firmware image, creates manifest, uploads manifest,
     and creates and starts the update campaign.
     :param cloud: Cloud fixture
     :param client: Client fixture
+    :param firmware_cache: Firmware cache fixture
     :param request: Requests fixture
     :return: Campaign ID
     """
@@ -141,7 +419,6 @@ def update_device(cloud, client, request):
     manifest_tool_path = request.config.getoption("manifest_tool")
     manifest_version = request.config.getoption("manifest_version", "v3")
     no_cleanup = request.config.getoption("no_cleanup", False)
-    delta_manifest = request.config.getoption("delta_manifest", None)
     local_bin = request.config.getoption("local_binary", None)
 
     log.info('Update image: "{}"'.format(binary_path))
@@ -157,93 +434,88 @@ def update_device(cloud, client, request):
         log.warning(skip_msg)
         pytest.skip(skip_msg)
 
-    sleep(5)
-    resp = cloud.device_directory.get_device(
-        client.endpoint_id(), expected_status_code=200
-    ).json()
-    assert resp["state"] == "registered"
-
-    fw_image = cloud.update.upload_firmware_image(
-        binary_path, expected_status_code=201
-    ).json()
-    fw_image_id = fw_image["id"]
-    log.info("Firmware image uploaded! Image ID: {}".format(fw_image_id))
-
     if not manifest_version:
         manifest_version = "v3"
-    manifest_file = manifest_tool.create_manifest(
-        path=manifest_tool_path,
-        firmware_url=fw_image["datafile"],
-        update_image_path=binary_path,
-        delta_manifest=delta_manifest,
-        manifest_version=manifest_version,
-    )
-    assert manifest_file is not None, "Manifest file was not created"
+    image_path, delta_manifest = _update_image(request, binary_path)
+    cleanup = CleanupRegistry(cloud)
 
-    manifest = cloud.update.upload_firmware_manifest(
-        manifest_file, expected_status_code=201
-    ).json()
-    manifest_id = manifest["id"]
-    log.info("Firmware manifest uploaded! Manifest ID: {}".format(manifest_id))
-
-    campaign_name = "pelion_e2e_update_test_{}".format(
-        build_random_string(8, True)
-    )
-    campaign_data = {
-        "name": campaign_name,
-        "device_filter": "id__eq={}".format(client.endpoint_id()),
-        "root_manifest_id": manifest["id"],
-    }
+    def create_campaign(manifest, _):
+        campaign_name = e2e_name(
+            "update_test_{}".format(build_random_string(8, True))
+        )
+        campaign_data = {
+            "name": campaign_name,
+            "device_filter": "id__eq={}".format(client.endpoint_id()),
+            "root_manifest_id": manifest["id"],
+        }
+        campaign = cloud.update.create_update_campaign(
+            campaign_data, expected_status_code=201
+        ).json()
+        cleanup.add_campaign(campaign["id"])
+        assert campaign["phase"] == "draft"
+        log.info(
+            "Update campaign created! Campaign ID: {}".format(campaign["id"])
+        )
+        return campaign["id"]
 
-    campaign = cloud.update.create_update_campaign(
-        campaign_data, expected_status_code=201
-    ).json()
-    campaign_id = campaign["id"]
-    assert campaign["phase"] == "draft"
-    log.info("Update campaign created! Campaign ID: {}".format(campaign_id))
+    def start_campaign(campaign_id):
+        cloud.update.start_update_campaign(
+            campaign_id, expected_status_code=202
+        )
+        log.info(
+            "Update campaign started! Campaign ID: {}".format(campaign_id)
+        )
 
-    cloud.update.start_update_campaign(
-        campaign["id"], expected_status_code=202
+    # device readiness check runs concurrently with the firmware upload
+    graph = TaskGraph()
+    graph.add(
+        "device_ready",
+        lambda: wait_for_device_state(cloud, client.endpoint_id()),
     )
-    log.info("Update campaign started! Campaign ID: {}".format(campaign_id))
-
-    yield campaign_id
+    graph.add(
+        "image_upload",
+        lambda: _upload_image(cloud, firmware_cache, cleanup, image_path),
+    )
+    graph.add(
+        "manifest",
+        lambda fw_image: _upload_manifest(
+            cloud,
+            firmware_cache,
+            cleanup,
+            fw_image,
+            image_path,
+            path=manifest_tool_path,
+            delta_manifest=delta_manifest,
+            manifest_version=manifest_version,
+        ),
+        "image_upload",
+    )
+    graph.add("campaign_create", create_campaign, "manifest", "device_ready")
+    graph.add("campaign_start", start_campaign, "campaign_create")
+    try:
+        graph.run()
+    except Exception:
+        # setup failed, clean up the steps that were done
+        if not no_cleanup:
+            cleanup.cleanup()
+        raise
+
+    yield graph.results["campaign_create"]
 
     if not no_cleanup:
-        if campaign_id:
-            cloud.update.stop_update_campaign(
-                campaign_id, expected_status_code=[202, 409]
-            )
-            wait_for_campaign_phase(
-                cloud, campaign_id, ["draft", "stopped", "archived"]
-            )
-            log.info("Deleting update campaign. ID: {}".format(campaign_id))
-            cloud.update.delete_update_campaign(
-                campaign_id, expected_status_code=204
-            )
-        if fw_image_id:
-            log.info("Deleting firmware image. ID: {}".format(fw_image_id))
-            cloud.update.delete_firmware_image(
-                fw_image_id, expected_status_code=204
-            )
-        if manifest_id:
-            log.info("Deleting firmware manifest. ID: {}".format(manifest_id))
-            cloud.update.delete_firmware_manifest(
-                manifest_id, expected_status_code=204
-            )
+        cleanup.cleanup()
 
 
 @pytest.fixture(scope="function")
-def update_campaign(cloud, request):
+def update_campaign(cloud, firmware_cache, request):
     """
     Fixture for running update campaign for multiple devices.
     :param cloud: Cloud fixture
+    :param firmware_cache: Firmware cache fixture
     :param request: Request fixture
     :return: Campaign ID
     """
-    campaign_id = None
-    fw_image_id = None
-    manifest_id = None
+    cleanup = CleanupRegistry(cloud)
 
     binary_path = request.config.getoption("update_bin", None)
     log.info('Update image: "{}"'.format(binary_path))
@@ -266,51 +538,35 @@ def update_campaign(cloud, request):
         pytest.skip(skip_msg)
 
     def create_campaign(device_filter):
-        nonlocal campaign_id
-        nonlocal fw_image_id
-        nonlocal manifest_id
-
-        fw_image = cloud.update.upload_firmware_image(
-            binary_path, expected_status_code=201
-        ).json()
-        fw_image_id = fw_image["id"]
-        log.info("Firmware image uploaded! Image ID: {}".format(fw_image_id))
-
         manifest_tool_path = request.config.getoption("manifest_tool")
         log.info(
             'Path for manifest-tool init: "{}"'.format(manifest_tool_path)
         )
 
-        delta_manifest = request.config.getoption("delta_manifest", None)
-        manifest_file = manifest_tool.create_manifest(
+        image_path, delta_manifest = _update_image(request, binary_path)
+        _, manifest_id = _upload_firmware(
+            cloud,
+            firmware_cache,
+            cleanup,
+            image_path,
             path=manifest_tool_path,
-            firmware_url=fw_image["datafile"],
-            update_image_path=binary_path,
             delta_manifest=delta_manifest,
         )
-        assert manifest_file is not None, "Manifest file was not created"
 
-        manifest = cloud.update.upload_firmware_manifest(
-            manifest_file, expected_status_code=201
-        ).json()
-        manifest_id = manifest["id"]
-        log.info(
-            "Firmware manifest uploaded! Manifest ID: {}".format(manifest_id)
-        )
-
-        campaign_name = "pelion_e2e_update_test_{}".format(
-            build_random_string(8, True)
+        campaign_name = e2e_name(
+            "update_test_{}".format(build_random_string(8, True))
         )
         campaign_data = {
             "name": campaign_name,
             "device_filter": device_filter,
-            "root_manifest_id": manifest["id"],
+            "root_manifest_id": manifest_id,
         }
 
         campaign = cloud.update.create_update_campaign(
             campaign_data, expected_status_code=201
         ).json()
         campaign_id = campaign["id"]
+        cleanup.add_campaign(campaign_id)
         assert campaign["phase"] == "draft"
         log.info(
             "Update campaign created! Campaign ID: {}".format(campaign_id)
@@ -328,24 +584,4 @@ def update_campaign(cloud, request):
     yield create_campaign
 
     if not request.config.getoption("no_cleanup", False):
-        if campaign_id:
-            cloud.update.stop_update_campaign(
-                campaign_id, expected_status_code=[202, 409]
-            )
-            wait_for_campaign_phase(
-                cloud, campaign_id, ["draft", "stopped", "archived"]
-            )
-            log.info("Deleting update campaign. ID: {}".format(campaign_id))
-            cloud.update.delete_update_campaign(
-                campaign_id, expected_status_code=204
-            )
-        if fw_image_id:
-            log.info("Deleting firmware image. ID: {}".format(fw_image_id))
-            cloud.update.delete_firmware_image(
-                fw_image_id, expected_status_code=204
-            )
-        if manifest_id:
-            log.info("Deleting firmware manifest. ID: {}".format(manifest_id))
-            cloud.update.delete_firmware_manifest(
-                manifest_id, expected_status_code=204
-            )
+        cleanup.cleanup()
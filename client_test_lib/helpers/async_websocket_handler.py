@@ -0,0 +1,335 @@
+# pylint: disable=invalid-overridden-method
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+asyncio WebSocket notification channel
+Prerequisites: websockets package has been installed
+
+"""
+
+import asyncio
+import logging
+from time import monotonic
+from client_test_lib.helpers.websocket_handler import (
+    BaseWebSocketRunner,
+    WebSocketChannelGap,
+    WebSocketHandler,
+)
+
+try:
+    import websockets
+    from websockets.exceptions import WebSocketException
+except ImportError:
+    websockets = None
+    WebSocketException = Exception
+
+log = logging.getLogger(__name__)
+
+
+class AsyncWebSocketRunner(BaseWebSocketRunner):
+    """
+    asyncio based WebSocket runner, many runners can share one event loop
+    :param api: string URL for WebSocket connection endpoint
+    :param api_key: string
+    :param retention: dict of notification type -> RetentionPolicy
+    :param backfill: Function (device_id, resource_path) -> REST response
+                     for reading resource values missed during a channel gap
+    """
+
+    def __init__(self, api, api_key, retention=None, backfill=None):
+        if websockets is None:
+            raise ImportError(
+                'AsyncWebSocketRunner requires "websockets" package, '
+                "install it with: pip install websockets"
+            )
+        super(AsyncWebSocketRunner, self).__init__(retention, backfill)
+        self.api = api
+        self._api_key = api_key
+        self.run = False
+        self.loop = None
+        self._task = None
+
+    async def start(self):
+        """
+        Start the WebSocket input task in the running event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.run = True
+        log.info("Starting WebSocket task")
+        self._task = self.loop.create_task(self._input_task())
+
+    async def close(self):
+        """
+        Close WebSocket input task
+        """
+        log.info("Closing WebSocket task")
+        self.run = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _input_task(self):
+        """
+        Runner's input task
+        """
+        while self.run:
+            try:
+                log.debug("Connecting WebSocket")
+                async with websockets.connect(
+                    self.api,
+                    subprotocols=["wss", "pelion_{}".format(self._api_key)],
+                ) as ws:
+                    log.info("WebSocket opened to {}".format(self.api))
+                    self._on_connected()
+                    async for message in ws:
+                        log.debug("WebSocket Received: {}".format(message))
+                        self._handle_text(message)
+                log.error("WebSocket handler exited")
+            except (WebSocketException, OSError, asyncio.TimeoutError) as e:
+                log.warning("WebSocket failed, retrying! {}".format(e))
+            self._on_disconnected()
+            if self.run:
+                await asyncio.sleep(self._next_reconnect_delay())
+        log.info("WebSocket input task was stopped.")
+
+    async def async_wait_for(self, keys, check, timeout):
+        """
+        Wait until check returns a result, waking up whenever an event
+        with one of the given keys is received
+        :param keys: List of event keys, see _event_key()
+        :param check: Function returning the wanted data or False/None
+        :param timeout: Timeout in seconds
+        :return: Result of check or False on timeout
+        """
+        started = monotonic()
+        deadline = started + timeout
+        waiter = asyncio.Event()
+        for key in keys:
+            self._waiters.setdefault(key, []).append(waiter)
+        try:
+            while True:
+                result = check()
+                if result:
+                    return result
+                now = monotonic()
+                remaining = deadline - now
+                gapped = self._gap_for(keys, started)
+                if gapped:
+                    if now >= gapped[1]:
+                        raise self._gap_error(keys, gapped[0])
+                    remaining = min(remaining, gapped[1] - now)
+                if now >= deadline:
+                    return False
+                try:
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                waiter.clear()
+        finally:
+            for key in keys:
+                key_waiters = self._waiters.get(key, [])
+                if waiter in key_waiters:
+                    key_waiters.remove(waiter)
+                if not key_waiters:
+                    self._waiters.pop(key, None)
+                    self._gapped.pop(key, None)
+
+    def wait_for(self, keys, check, timeout):
+        """
+        Blocking wait for the synchronous WebSocketHandler API, usable from
+        other threads than the one running the event loop
+        :param keys: List of event keys, see _event_key()
+        :param check: Function returning the wanted data or False/None
+        :param timeout: Timeout in seconds
+        :return: Result of check or False on timeout
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            raise RuntimeError(
+                "Blocking wait inside the event loop, "
+                "use AsyncWebSocketHandler instead"
+            )
+        return asyncio.run_coroutine_threadsafe(
+            self.async_wait_for(keys, check, timeout), self.loop
+        ).result()
+
+    def _call_in_runner(self, func, *args):
+        """
+        Call function in the event loop
+        """
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def _wake_waiters(self, key):
+        """
+        Wake up the waiters of given event key
+        :param key: Event key
+        """
+        for waiter in self._waiters.get(key, []):
+            waiter.set()
+
+
+class AsyncWebSocketHandler(WebSocketHandler):
+    """
+    Class to handle messages via asyncio WebSocket. Check and get methods
+    are the same as in WebSocketHandler, wait methods are coroutines.
+    :param ws: AsyncWebSocketRunner
+    """
+
+    async def _wait(self, keys, check, timeout, assert_errors=False):
+        """
+        Wait for the runner to have result for check
+        :param keys: List of event keys
+        :param check: Function returning the wanted data or False/None
+        :param timeout: int
+        :param assert_errors: Fail the test case on channel gap
+        :return: Result of check or False on timeout or on channel gap
+        """
+        try:
+            return await self.ws.async_wait_for(keys, check, timeout)
+        except WebSocketChannelGap as e:
+            log.error(str(e))
+            if assert_errors:
+                assert False, str(e)
+            return False
+
+    async def wait_for_multiple_notification(
+        self,
+        device_id,
+        expected_notifications,
+        timeout=30,
+        assert_errors=False,
+    ):
+        """
+        Wait for given device id + resource path(s) + expected value(s) to appear in WebSocket
+        :param device_id: string
+        :param expected_notifications: list of dicts of resource paths with expected values
+        :param timeout: int
+        :param assert_errors: boolean for user if to fail test case in case of expected notifications not received
+        :return: False / list of received notifications or fail the test case if confirm_resp=True
+        """
+        keys, check = self._multiple_notification_query(
+            device_id, expected_notifications
+        )
+        result = await self._wait(keys, check, timeout, assert_errors)
+        return self._multiple_notification_result(
+            device_id, expected_notifications, result, assert_errors
+        )
+
+    async def wait_for_notification(
+        self,
+        device_id,
+        resource_path,
+        expected_value,
+        timeout=30,
+        assert_errors=False,
+    ):
+        """
+        Wait for given device id + resource path + expected value to appear in WebSocket
+        :param device_id: string
+        :param resource_path: string
+        :param expected_value: string
+        :param timeout: int
+        :param assert_errors: boolean for user if to fail test case in case of expected notification not received
+        :return: dict or fail the test case if confirm_resp=True
+        """
+        keys, check = self._notification_query(
+            device_id, resource_path, expected_value
+        )
+        item = await self._wait(keys, check, timeout, assert_errors)
+        return self._notification_result(expected_value, item, assert_errors)
+
+    async def wait_for_async_response(
+        self, async_response_id, timeout=30, assert_errors=False
+    ):
+        """
+        Wait for given async-response to appear in WebSocket data
+        :param async_response_id: string
+        :param timeout: int
+        :param assert_errors: boolean for user if to fail test case in case of expected response not received
+        :return: dict or fail the test case if confirm_resp=True
+        """
+        keys, check = self._async_response_query(async_response_id)
+        async_response = await self._wait(keys, check, timeout, assert_errors)
+        return self._async_response_result(
+            async_response_id, async_response, assert_errors
+        )
+
+    async def wait_for_async_responses(self, async_response_ids, timeout=30):
+        """
+        Wait for many async-responses at once
+        :param async_response_ids: List of async-ids
+        :param timeout: Timeout in seconds for all responses
+        :return: dict of async-id -> response for the received responses
+        """
+        keys, check, responses = self._async_responses_query(
+            async_response_ids
+        )
+        await self._wait(keys, check, timeout)
+        return self._async_responses_result(responses)
+
+    async def wait_for_registration(self, device_id, timeout=30, since=None):
+        """
+        Wait for given device id registration to appear in WebSocket
+        :param device_id: string
+        :param timeout: int
+        :param since: Only events received at or after this time.time()
+        :return: False / dict
+        """
+        return await self._wait(
+            *self._event_query("registrations", device_id, since), timeout
+        )
+
+    async def wait_for_registration_updates(
+        self, device_id, timeout=30, since=None
+    ):
+        """
+        Wait for given device id registration update notification to appear in WebSocket
+        :param device_id: string
+        :param timeout: int
+        :param since: Only events received at or after this time.time()
+        :return: False / dict
+        """
+        return await self._wait(
+            *self._event_query("reg-updates", device_id, since), timeout
+        )
+
+    async def wait_for_registration_expiration(
+        self, device_id, timeout=30, since=None
+    ):
+        """
+        Wait for given device id registration expiration notification to appear in WebSocket
+        :param device_id: string
+        :param timeout: int
+        :param since: Only events received at or after this time.time()
+        :return: False / dict
+        """
+        return await self._wait(
+            *self._event_query("registrations-expired", device_id, since),
+            timeout
+        )
+
+    async def wait_for_deregistration(self, device_id, timeout=30, since=None):
+        """
+        Wait for given device id de-registration to appear in WebSocket
+        :param device_id: string
+        :param timeout: int
+        :param since: Only events received at or after this time.time()
+        :return: False / dict
+        """
+        return await self._wait(
+            *self._event_query("de-registrations", device_id, since), timeout
+        )
@@ -0,0 +1,286 @@
+# pylint: disable=broad-except
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+from time import monotonic, sleep, time
+from client_test_lib.tools.utils import assert_status
+
+log = logging.getLogger(__name__)
+
+# prefix of the names of cloud objects created by the tests
+E2E_NAME_PREFIX = "pelion_e2e_"
+# objects released back to a cache instead of being deleted
+RELEASE_KIND = "release"
+# objects are deleted in this order, objects of one kind concurrently
+CLEANUP_ORDER = (
+    "campaign",
+    RELEASE_KIND,
+    "manifest",
+    "image",
+    "websocket",
+    "api_key",
+)
+DONE_STATUS_CODES = (200, 202, 204, 404)
+RETRY_STATUS_CODES = (409, 429, 500, 502, 503, 504)
+LIST_PAGE_SIZE = 1000
+
+
+def e2e_name(name):
+    """
+    Name for a cloud object created by the tests, recognized by the orphan
+    sweeper
+    :param name: Name without the prefix
+    :return: Name with the test prefix
+    """
+    return "{}{}".format(E2E_NAME_PREFIX, name)[:128]
+
+
+class CleanupRegistry:
+    """
+    Records created cloud objects and deletes them at teardown. Objects are
+    deleted kind by kind in CLEANUP_ORDER, objects of the same kind
+    concurrently. Failed deletes are retried with backoff until the time
+    budget is used, and a failing delete doesn't stop the others.
+    :param cloud: Cloud API object
+    :param budget: Time budget in seconds for the whole cleanup
+    :param max_workers: Number of concurrent deletes
+    """
+
+    def __init__(self, cloud, budget=300, max_workers=8):
+        self.cloud = cloud
+        self.budget = budget
+        self.max_workers = max_workers
+        self._objects = []
+
+    def __len__(self):
+        return len(self._objects)
+
+    def add(self, kind, object_id, delete):
+        """
+        Record created object
+        :param kind: Object kind, one of CLEANUP_ORDER
+        :param object_id: Object id
+        :param delete: Function (object_id) -> Rest API response, or None
+                       when there is nothing to check
+        """
+        log.debug("Registered {} {} for cleanup".format(kind, object_id))
+        self._objects.append((kind, object_id, delete))
+
+    def remove(self, kind, object_id):
+        """
+        Forget object that was deleted by the test
+        :param kind: Object kind
+        :param object_id: Object id
+        """
+        self._objects = [
+            (k, i, d)
+            for k, i, d in self._objects
+            if (k, i) != (kind, object_id)
+        ]
+
+    def add_campaign(self, campaign_id):
+        """
+        Record update campaign, it is stopped before the delete
+        :param campaign_id: Campaign id
+        """
+
+        def delete(campaign_id):
+            self.cloud.update.stop_update_campaign(campaign_id)
+            # deleting is refused until the campaign has stopped
+            return self.cloud.update.delete_update_campaign(campaign_id)
+
+        self.add("campaign", campaign_id, delete)
+
+    def add_firmware_manifest(self, manifest_id):
+        """
+        Record firmware manifest
+        :param manifest_id: Manifest id
+        """
+        self.add(
+            "manifest", manifest_id, self.cloud.update.delete_firmware_manifest
+        )
+
+    def add_firmware_image(self, fw_image_id):
+        """
+        Record firmware image
+        :param fw_image_id: Firmware image id
+        """
+        self.add("image", fw_image_id, self.cloud.update.delete_firmware_image)
+
+    def add_api_key(self, api_key_id):
+        """
+        Record API key
+        :param api_key_id: API key id
+        """
+        self.add("api_key", api_key_id, self.cloud.account.delete_api_key)
+
+    def add_release(self, kind, object_id, release):
+        """
+        Record object borrowed from a cache, it is released instead of
+        deleted
+        :param kind: Kind of the cached object, e.g. "manifest"
+        :param object_id: Object id
+        :param release: Function (object_id) releasing the object
+        """
+        self.add(
+            RELEASE_KIND,
+            "{} {}".format(kind, object_id),
+            lambda _: release(object_id),
+        )
+
+    def add_websocket_channel(self, headers):
+        """
+        Record WebSocket notification channel
+        :param headers: Headers with the authorization of the channel
+        """
+        self.add(
+            "websocket",
+            "channel",
+            lambda _: self.cloud.connect.delete_websocket_channel(
+                headers=headers
+            ),
+        )
+
+    def _delete(self, kind, object_id, delete, deadline):
+        """
+        Delete one object, retry until it is done or deadline is reached
+        :return: Error message or None
+        """
+        delay = 1
+        error = None
+        while True:
+            try:
+                r = delete(object_id)
+                if r is None or r.status_code in DONE_STATUS_CODES:
+                    if kind == RELEASE_KIND:
+                        log.info("Released cached {}".format(object_id))
+                    else:
+                        log.info("Deleted {} {}".format(kind, object_id))
+                    return None
+                error = "[{}] {}".format(r.status_code, r.text)
+                if r.status_code not in RETRY_STATUS_CODES:
+                    break
+            except Exception as e:
+                error = str(e)
+            if monotonic() + delay > deadline:
+                break
+            log.debug(
+                "Retrying delete of {} {} in {} s: {}".format(
+                    kind, object_id, delay, error
+                )
+            )
+            sleep(delay)
+            delay = min(delay * 2, 10)
+        return "{} {}: {}".format(kind, object_id, error)
+
+    def cleanup(self, assert_errors=False):
+        """
+        Delete the recorded objects
+        :param assert_errors: Fail the test case if some object was not deleted
+        :return: List of error messages of the objects not deleted
+        """
+        if not self._objects:
+            return []
+        started = monotonic()
+        deadline = started + self.budget
+        kinds = list(CLEANUP_ORDER) + sorted(
+            {k for k, _, _ in self._objects} - set(CLEANUP_ORDER)
+        )
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for kind in kinds:
+                futures = [
+                    executor.submit(
+                        self._delete, kind, object_id, delete, deadline
+                    )
+                    for k, object_id, delete in self._objects
+                    if k == kind
+                ]
+                errors.extend(
+                    error for error in (f.result() for f in futures) if error
+                )
+        log.info(
+            "Cleaned up {}/{} objects in {:.1f} s".format(
+                len(self._objects) - len(errors),
+                len(self._objects),
+                monotonic() - started,
+            )
+        )
+        self._objects = []
+        if errors:
+            err_msg = "Cleanup failed for {}".format("; ".join(errors))
+            if assert_errors:
+                assert False, err_msg
+            log.error(err_msg)
+        return errors
+
+
+def _created_time(item):
+    """
+    Creation time of a listed cloud object
+    :param item: Object dict with "created_at" UTC timestamp
+    :return: Seconds since the epoch
+    """
+    created = datetime.datetime.fromisoformat(item["created_at"].rstrip("Z"))
+    return created.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _iter_list(get_list):
+    """
+    Iterate all objects of a cloud list endpoint page by page
+    :param get_list: List function taking query_params
+    :return: Generator of object dicts
+    """
+    query_params = {"limit": LIST_PAGE_SIZE, "order": "ASC"}
+    while True:
+        r = get_list(query_params=query_params)
+        assert_status(r, "list", 200)
+        page = r.json()
+        for item in page["data"]:
+            yield item
+        if not page.get("has_more") or not page["data"]:
+            return
+        query_params["after"] = page["data"][-1]["id"]
+
+
+def sweep_orphans(cloud, max_age=86400, budget=300):
+    """
+    Delete test objects left behind by crashed or interrupted runs. Only
+    objects named with E2E_NAME_PREFIX and older than max_age are deleted,
+    so objects of test runs in progress are left alone.
+    :param cloud: Cloud API object
+    :param max_age: Minimum age in seconds of deleted objects
+    :param budget: Time budget in seconds for the deletes
+    :return: Number of objects found
+    """
+    cutoff = time() - max_age
+    registry = CleanupRegistry(cloud, budget)
+    for get_list, add in (
+        (cloud.update.get_update_campaigns, registry.add_campaign),
+        (cloud.update.get_firmware_manifests, registry.add_firmware_manifest),
+        (cloud.update.get_firmware_images, registry.add_firmware_image),
+        (cloud.account.get_api_keys, registry.add_api_key),
+    ):
+        for item in _iter_list(get_list):
+            if (item.get("name") or "").startswith(
+                E2E_NAME_PREFIX
+            ) and _created_time(item) < cutoff:
+                add(item["id"])
+    found = len(registry)
+    log.info("Found {} orphaned test objects".format(found))
+    registry.cleanup()
+    return found
@@ -14,12 +14,37 @@ limitations under the License.
 """
 
 import base64
+from concurrent.futures import ThreadPoolExecutor, wait
 import logging
+from time import time
 import uuid
+from client_test_lib.helpers.poller import Poller, RETRY_STATUS_CODES
+from client_test_lib.helpers.websocket_handler import event_time
+from client_test_lib.tools.utils import percentiles
 
 log = logging.getLogger(__name__)
 
 
+def _device_request_payload(
+    method, path, request_data=None, content_type="text/plain"
+):
+    """
+    Build async request payload
+    :param method: Request method
+    :param path: Device resource path
+    :param request_data: Data sent to resource path or None
+    :param content_type: Data content type
+    :return: Request payload dict
+    """
+    request_payload = {"method": method, "uri": path}
+    if request_data is not None:
+        request_payload["content-type"] = content_type
+        request_payload["payload-b64"] = base64.b64encode(
+            str.encode(request_data)
+        ).decode()
+    return request_payload
+
+
 def get_async_device_request(cloud, path, device_id, headers):
     """
     Sends GET async request to device
@@ -58,14 +83,10 @@ def put_async_device_request(
     :return: Async_id
     """
     async_id = str(uuid.uuid4())
-    payload_data = base64.b64encode(str.encode(request_data)).decode()
     request_params = {"async-id": async_id}
-    request_payload = {
-        "method": "PUT",
-        "uri": path,
-        "content-type": content_type,
-        "payload-b64": payload_data,
-    }
+    request_payload = _device_request_payload(
+        "PUT", path, request_data, content_type
+    )
     cloud.connect.send_device_request(
         device_id,
         request_payload,
@@ -123,3 +144,195 @@ def device_resource_exists(cloud, path, device_id, headers):
             return False
         log.error(r.text)
     return True
+
+
+def wait_for_device_state(
+    cloud,
+    device_id,
+    expected_state="registered",
+    timeout=60,
+    delay=5,
+    initial_delay=0.5,
+):
+    """
+    Wait device to reach expected state in device directory, device that
+    is not found yet is polled again
+    :param cloud: Cloud object
+    :param device_id: Device ID
+    :param expected_state: Expected device state
+    :param timeout: timeout in seconds
+    :param delay: maximum delay in seconds between the checks
+    :param initial_delay: delay in seconds after the first checks
+    :raises: Assert fail if timeout is reached
+    """
+    poller = Poller(initial_delay, delay)
+    poller.watch(
+        device_id,
+        lambda: cloud.device_directory.get_device(device_id),
+        lambda r: (r.json()["state"] == expected_state, r.json()["state"]),
+        retry_status_codes=RETRY_STATUS_CODES + (404,),
+    )
+    results = poller.run(timeout)
+    assert (
+        device_id in results
+    ), 'Device {} didn\'t reach "{}" state in {} s, state "{}"'.format(
+        device_id, expected_state, timeout, poller.values.get(device_id)
+    )
+    log.info('Device {} is in "{}" state'.format(device_id, expected_state))
+
+
+class AsyncRequestBatch:
+    """
+    Handle set of async device requests sent by send_async_device_requests()
+    Each request is a dict with device_id, method, path, async_id, sent
+    time, status_code of the request, error if it was not sent and the
+    async response with latency after gather_async_responses().
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.futures = []
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __iter__(self):
+        return iter(self.requests)
+
+    def wait_sent(self, timeout=None):
+        """
+        Wait until all requests have been sent, requests that failed or
+        were not sent in time get an error
+        :param timeout: Timeout in seconds for the whole batch
+        :return: List of request dicts
+        """
+        wait(self.futures, timeout)
+        for request, future in zip(self.requests, self.futures):
+            if not future.done():
+                request["error"] = "Not sent in {} s".format(timeout)
+            elif future.exception() is not None:
+                request["error"] = repr(future.exception())
+            else:
+                continue
+            log.error(
+                'Async request {} "{}" to "{}" failed: {}'.format(
+                    request["method"],
+                    request["path"],
+                    request["device_id"],
+                    request["error"],
+                )
+            )
+        return self.requests
+
+
+def _send_batch_request(cloud, request, request_data, content_type, headers):
+    """
+    Send one async request of the batch
+    """
+    request_payload = _device_request_payload(
+        request["method"], request["path"], request_data, content_type
+    )
+    request["sent"] = time()
+    r = cloud.connect.send_device_request(
+        request["device_id"],
+        request_payload,
+        {"async-id": request["async_id"]},
+        headers=headers,
+    )
+    request["status_code"] = r.status_code
+    if r.status_code != 202:
+        log.error(
+            'Async request {} "{}" to "{}" failed: {} {}'.format(
+                request["method"],
+                request["path"],
+                request["device_id"],
+                r.status_code,
+                r.text,
+            )
+        )
+
+
+def send_async_device_requests(
+    cloud, operations, headers, content_type="text/plain", max_workers=16
+):
+    """
+    Sends async requests concurrently over the pooled cloud session
+    https://www.pelion.com/docs/device-management/current/service-api-references/device-management-connect.html#createAsyncRequest
+    :param cloud: Cloud object
+    :param operations: List of (device_id, method, path, request_data)
+                       tuples, request_data is None for GET and POST
+    :param headers: Request headers
+    :param content_type: Data content type
+    :param max_workers: Number of requests sent in parallel, keep it below
+                        the cloud connection pool size
+    :return: AsyncRequestBatch
+    """
+    batch = AsyncRequestBatch()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    for device_id, method, path, request_data in operations:
+        request = {
+            "device_id": device_id,
+            "method": method,
+            "path": path,
+            "async_id": str(uuid.uuid4()),
+            "sent": None,
+            "status_code": None,
+            "error": None,
+            "response": None,
+            "latency": None,
+        }
+        batch.requests.append(request)
+        batch.futures.append(
+            executor.submit(
+                _send_batch_request,
+                cloud,
+                request,
+                request_data,
+                content_type,
+                headers,
+            )
+        )
+    executor.shutdown(wait=False)
+    return batch
+
+
+def gather_async_responses(websocket, batch, timeout=60, assert_errors=True):
+    """
+    Gather async responses of the batch from WebSocket
+    :param websocket: WebSocketHandler
+    :param batch: AsyncRequestBatch
+    :param timeout: Timeout in seconds for the whole batch
+    :param assert_errors: Fail the test case if some response is missing
+    :return: List of request dicts with response and latency in seconds
+    """
+    deadline = time() + timeout
+    batch.wait_sent(timeout)
+    sent = {
+        request["async_id"]: request
+        for request in batch
+        if request["status_code"] == 202
+    }
+    responses = websocket.wait_for_async_responses(
+        list(sent), max(round(deadline - time(), 1), 0)
+    )
+    for async_id, response in responses.items():
+        request = sent[async_id]
+        request["response"] = response
+        request["latency"] = event_time(response) - request["sent"]
+    latencies = [r["latency"] for r in batch if r["latency"] is not None]
+    stats = percentiles(latencies)
+    log.info(
+        "Received {}/{} async responses, latency "
+        "p50 {} s, p95 {} s, p99 {} s".format(
+            len(latencies),
+            len(batch),
+            stats["p50"],
+            stats["p95"],
+            stats["p99"],
+        )
+    )
+    if assert_errors and len(latencies) != len(batch):
+        assert False, "Received {}/{} async responses in {} s".format(
+            len(latencies), len(batch), timeout
+        )
+    return batch.requests
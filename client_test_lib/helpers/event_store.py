@@ -0,0 +1,301 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict, deque
+import logging
+import threading
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """
+    Retention policy for stored WebSocket events
+    :param max_entries: Maximum number of stored events, oldest are evicted
+    :param max_age: Maximum age of stored events in seconds
+    :param drop_after_consumed: Remove async response once it has been waited
+    """
+
+    def __init__(
+        self, max_entries=None, max_age=None, drop_after_consumed=False
+    ):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.drop_after_consumed = drop_after_consumed
+
+    def __repr__(self):
+        return (
+            "RetentionPolicy(max_entries={}, max_age={}, "
+            "drop_after_consumed={})".format(
+                self.max_entries, self.max_age, self.drop_after_consumed
+            )
+        )
+
+
+class EventStore:
+    """
+    Insertion ordered store for WebSocket events of one notification type.
+    Events are indexed by endpoint and by endpoint + resource path, so
+    lookups only go through the events of the asked device/resource.
+    :param policy: RetentionPolicy, by default events are kept forever
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetentionPolicy()
+        self.evicted = 0
+        self._lock = threading.RLock()
+        self._next_seq = 0
+        self._events = deque()
+        self._by_endpoint = {}
+        self._by_path = {}
+
+    def __len__(self):
+        return len(self._events)
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __bool__(self):
+        return bool(self._events)
+
+    @property
+    def next_seq(self):
+        """
+        Sequence number of the next stored event, events stored after
+        reading it have this or a higher number
+        """
+        return self._next_seq
+
+    def append(self, event):
+        """
+        Store event
+        :param event: Event dict with "ep" and optional "path" fields
+        """
+        with self._lock:
+            entry = (self._next_seq, monotonic(), event)
+            self._next_seq += 1
+            self._events.append(entry)
+            self._by_endpoint.setdefault(event.get("ep"), deque()).append(
+                entry
+            )
+            if "path" in event:
+                self._by_path.setdefault(
+                    (event.get("ep"), event["path"]), deque()
+                ).append(entry)
+            self._evict()
+
+    def _evict(self):
+        """
+        Evict the oldest events exceeding the retention policy
+        """
+        max_entries = self.policy.max_entries
+        max_age = self.policy.max_age
+        with self._lock:
+            if max_entries is not None:
+                while len(self._events) > max_entries:
+                    self._evict_oldest()
+            if max_age is not None:
+                cutout_time = monotonic() - max_age
+                while self._events and self._events[0][1] < cutout_time:
+                    self._evict_oldest()
+
+    def _evict_oldest(self):
+        """
+        Remove the oldest event from the store and from its index buckets
+        """
+        entry = self._events.popleft()
+        event = entry[2]
+        # The oldest event of the store is also the oldest one in its buckets
+        for index, key in (
+            (self._by_endpoint, event.get("ep")),
+            (self._by_path, (event.get("ep"), event.get("path"))),
+        ):
+            bucket = index.get(key)
+            if bucket and bucket[0] is entry:
+                bucket.popleft()
+                if not bucket:
+                    del index[key]
+        self.evicted += 1
+
+    def to_list(self, min_seq=None, endpoints=None):
+        """
+        Get all stored events
+        :param min_seq: Only events with this or a higher sequence number
+        :param endpoints: Only events of these endpoints
+        :return: List of events in insertion order
+        """
+        with self._lock:
+            self._evict()
+            if endpoints is None:
+                entries = _tail(self._events, min_seq)
+            else:
+                entries = []
+                for endpoint in set(endpoints):
+                    entries.extend(
+                        _tail(self._by_endpoint.get(endpoint, ()), min_seq)
+                    )
+                entries.sort(key=lambda entry: entry[0])
+        return [entry[2] for entry in entries]
+
+    def _entries(self, endpoint, paths=None, min_seq=None):
+        """
+        Get index entries for endpoint and optional resource paths
+        :param endpoint: Endpoint (device) id
+        :param paths: List of resource paths or None for all paths
+        :param min_seq: Only entries with this or a higher sequence number
+        :return: List of (sequence, received time, event) tuples in
+                 insertion order
+        """
+        with self._lock:
+            self._evict()
+            if paths is None:
+                return _tail(self._by_endpoint.get(endpoint, ()), min_seq)
+            entries = []
+            for path in set(paths):
+                entries.extend(
+                    _tail(self._by_path.get((endpoint, path), ()), min_seq)
+                )
+        if len(paths) > 1:
+            entries.sort(key=lambda entry: entry[0])
+        return entries
+
+    def find(self, endpoint, path=None, match=None, min_seq=None):
+        """
+        Find the first event for endpoint
+        :param endpoint: Endpoint (device) id
+        :param path: Resource path
+        :param match: Optional function to filter events
+        :param min_seq: Only events with this or a higher sequence number
+        :return: Event dict or None
+        """
+        for _, _, event in self._entries(
+            endpoint, None if path is None else [path], min_seq
+        ):
+            if match is None or match(event):
+                return event
+        return None
+
+    def find_all(self, endpoint, paths=None, match=None, min_seq=None):
+        """
+        Find all events for endpoint
+        :param endpoint: Endpoint (device) id
+        :param paths: List of resource paths or None for all paths
+        :param match: Optional function to filter events
+        :param min_seq: Only events with this or a higher sequence number
+        :return: List of events in insertion order
+        """
+        return [
+            event
+            for _, _, event in self._entries(endpoint, paths, min_seq)
+            if match is None or match(event)
+        ]
+
+
+def _tail(entries, min_seq=None):
+    """
+    Get the newest entries of a sequence ordered deque, only the returned
+    entries are visited
+    :param entries: Deque of (sequence, received time, event) tuples
+    :param min_seq: Only entries with this or a higher sequence number
+    :return: List of entries in insertion order
+    """
+    if not min_seq:
+        return list(entries)
+    tail = []
+    for entry in reversed(entries):
+        if entry[0] < min_seq:
+            break
+        tail.append(entry)
+    tail.reverse()
+    return tail
+
+
+class AsyncResponseStore:
+    """
+    Store for WebSocket async responses keyed by async-id
+    :param policy: RetentionPolicy, by default responses are kept forever
+    """
+
+    def __init__(self, policy=None):
+        self.policy = policy or RetentionPolicy()
+        self.evicted = 0
+        self.consumed = 0
+        self._lock = threading.RLock()
+        self._responses = OrderedDict()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def __contains__(self, async_id):
+        return async_id in self._responses
+
+    def __getitem__(self, async_id):
+        return self._responses[async_id][1]
+
+    def __setitem__(self, async_id, response):
+        with self._lock:
+            self._responses.pop(async_id, None)
+            self._responses[async_id] = (monotonic(), response)
+            self._evict()
+
+    def get(self, async_id, default=None):
+        """
+        Get async response
+        :param async_id: Async-id
+        :param default: Returned if response is not found
+        :return: Async response dict
+        """
+        with self._lock:
+            self._evict()
+            if async_id in self._responses:
+                return self._responses[async_id][1]
+        return default
+
+    def consume(self, async_id):
+        """
+        Mark async response as consumed by a waiter. Response is removed
+        if the retention policy drops consumed responses.
+        :param async_id: Async-id
+        :return: Async response dict or None
+        """
+        with self._lock:
+            response = self.get(async_id)
+            if response is not None and self.policy.drop_after_consumed:
+                del self._responses[async_id]
+                self.consumed += 1
+        return response
+
+    def _evict(self):
+        """
+        Evict the oldest responses exceeding the retention policy
+        """
+        max_entries = self.policy.max_entries
+        max_age = self.policy.max_age
+        with self._lock:
+            if max_entries is not None:
+                while len(self._responses) > max_entries:
+                    self._responses.popitem(last=False)
+                    self.evicted += 1
+            if max_age is not None:
+                cutout_time = monotonic() - max_age
+                while self._responses:
+                    received, _ = next(iter(self._responses.values()))
+                    if received >= cutout_time:
+                        break
+                    self._responses.popitem(last=False)
+                    self.evicted += 1
@@ -0,0 +1,183 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+from client_test_lib.helpers.cleanup import e2e_name
+import client_test_lib.tools.manifest_tool as manifest_tool
+from client_test_lib.tools.utils import file_sha256
+
+log = logging.getLogger(__name__)
+
+
+class FirmwareCache:
+    """
+    Content-addressed cache of uploaded firmware images and manifests.
+    Images are keyed by the SHA-256 of the binary, manifests by the image
+    hash and the manifest options. Cached ids are checked to exist before
+    reuse, entries are reference counted and the released ones are deleted
+    by cleanup().
+    :param cloud: Cloud API object living as long as the cache
+    """
+
+    def __init__(self, cloud):
+        self.cloud = cloud
+        self._images = {}
+        self._manifests = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _exists(self, get, entry_id):
+        """
+        Check that the cached entry still exists in the cloud
+        """
+        r = get(entry_id)
+        if r.status_code == 200:
+            return True
+        log.info(
+            "Cached id {} is no longer available: {}".format(
+                entry_id, r.status_code
+            )
+        )
+        return False
+
+    def firmware_image(self, binary_path):
+        """
+        Get uploaded firmware image for the binary, upload it if not cached
+        :param binary_path: Path to firmware binary
+        :return: Firmware image dict with id and datafile URL
+        """
+        key = file_sha256(binary_path)
+        entry = self._images.get(key)
+        if entry and self._exists(
+            self.cloud.update.get_firmware_image, entry["image"]["id"]
+        ):
+            self.hits += 1
+            log.info(
+                "Reusing firmware image {} for sha256 {}".format(
+                    entry["image"]["id"], key
+                )
+            )
+        else:
+            self.misses += 1
+            fw_image = self.cloud.update.upload_firmware_image(
+                binary_path,
+                {"name": e2e_name(os.path.basename(binary_path))},
+                expected_status_code=201,
+            ).json()
+            log.info(
+                "Firmware image uploaded! Image ID: {}".format(fw_image["id"])
+            )
+            entry = {"image": fw_image, "refs": 0}
+            self._images[key] = entry
+        entry["refs"] += 1
+        return entry["image"]
+
+    def firmware_manifest(self, fw_image, binary_path, **manifest_options):
+        """
+        Get uploaded manifest for the image, create and upload it if not
+        cached with the same options
+        :param fw_image: Firmware image dict from firmware_image()
+        :param binary_path: Path to firmware binary
+        :param manifest_options: manifest_tool.create_manifest() arguments
+                                 path, delta_manifest and manifest_version
+        :return: Manifest dict with id
+        """
+        options = dict(manifest_options)
+        delta_manifest = options.get("delta_manifest")
+        if delta_manifest and os.path.isfile(delta_manifest):
+            options["delta_manifest_sha256"] = file_sha256(delta_manifest)
+        key = (
+            file_sha256(binary_path),
+            fw_image["datafile"],
+            tuple(sorted((k, str(v)) for k, v in options.items())),
+        )
+        entry = self._manifests.get(key)
+        if entry and self._exists(
+            self.cloud.update.get_firmware_manifest, entry["manifest"]["id"]
+        ):
+            self.hits += 1
+            log.info("Reusing manifest {}".format(entry["manifest"]["id"]))
+        else:
+            self.misses += 1
+            manifest_file = manifest_tool.create_manifest(
+                firmware_url=fw_image["datafile"],
+                update_image_path=binary_path,
+                **manifest_options
+            )
+            assert manifest_file is not None, "Manifest file was not created"
+            try:
+                manifest = self.cloud.update.upload_firmware_manifest(
+                    manifest_file,
+                    {"name": e2e_name(os.path.basename(manifest_file))},
+                    expected_status_code=201,
+                ).json()
+            finally:
+                os.remove(manifest_file)
+            log.info(
+                "Firmware manifest uploaded! Manifest ID: {}".format(
+                    manifest["id"]
+                )
+            )
+            entry = {"manifest": manifest, "refs": 0}
+            self._manifests[key] = entry
+        entry["refs"] += 1
+        return entry["manifest"]
+
+    def release(self, fw_image_id=None, manifest_id=None):
+        """
+        Release references taken by firmware_image() and firmware_manifest()
+        :param fw_image_id: Firmware image id
+        :param manifest_id: Manifest id
+        """
+        for entries, field, entry_id in (
+            (self._images, "image", fw_image_id),
+            (self._manifests, "manifest", manifest_id),
+        ):
+            for entry in entries.values():
+                if entry_id and entry[field]["id"] == entry_id:
+                    entry["refs"] = max(entry["refs"] - 1, 0)
+
+    def cleanup(self):
+        """
+        Delete the released cached manifests and images at the end of the
+        session. Entries still referenced are kept and reported, they are
+        named as test objects so the orphan sweeper deletes them later.
+        :return: Number of kept entries
+        """
+        log.info(
+            "Firmware cache hits {}, misses {}".format(self.hits, self.misses)
+        )
+        kept = 0
+        for entries, field, delete in (
+            (
+                self._manifests,
+                "manifest",
+                self.cloud.update.delete_firmware_manifest,
+            ),
+            (self._images, "image", self.cloud.update.delete_firmware_image),
+        ):
+            for key, entry in list(entries.items()):
+                entry_id = entry[field]["id"]
+                if entry["refs"]:
+                    log.warning(
+                        "Keeping cached {} {} with {} unreleased "
+                        "references".format(field, entry_id, entry["refs"])
+                    )
+                    kept += 1
+                    continue
+                log.info("Deleting cached {}. ID: {}".format(field, entry_id))
+                delete(entry_id, expected_status_code=[204, 404])
+                del entries[key]
+        return kept
@@ -0,0 +1,154 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from email.utils import parsedate_to_datetime
+import logging
+from time import monotonic, sleep, time
+from client_test_lib.tools.utils import assert_status
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+def server_delay(response):
+    """
+    Delay requested by the server with Retry-After or rate limit headers
+    :param response: Rest API response
+    :return: Delay in seconds or None
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(retry_after).timestamp()
+                return max(retry_at - time(), 0)
+            except (TypeError, ValueError):
+                log.debug("Invalid Retry-After: {}".format(retry_after))
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        try:
+            reset = float(response.headers.get("X-RateLimit-Reset", ""))
+        except ValueError:
+            return None
+        # reset is either seconds to wait or epoch time of the reset
+        return max(reset - time(), 0) if reset > 1e9 else reset
+    return None
+
+
+class _Watch:
+    """
+    Polling state of one watched resource
+    """
+
+    def __init__(self, fetch, check, delay, retry_status_codes):
+        self.fetch = fetch
+        self.check = check
+        self.retry_status_codes = retry_status_codes
+        self.delay = delay
+        self.due = monotonic()
+        self.value = None
+
+
+class Poller:
+    """
+    Polls many resources from one loop with adaptive intervals. Polls are
+    fast at first and back off exponentially while the watched value stays
+    the same, a changed value resets the interval. Retry-After and rate
+    limit headers of the responses extend the interval.
+    :param initial_delay: First polling interval in seconds
+    :param max_delay: Maximum polling interval in seconds
+    :param backoff: Interval multiplier after each unchanged poll
+    """
+
+    def __init__(self, initial_delay=1, max_delay=10, backoff=1.5):
+        self.initial_delay = initial_delay
+        self.max_delay = max(max_delay, initial_delay)
+        self.backoff = backoff
+        self.polls = 0
+        self._watches = {}
+        self.results = {}
+        self.values = {}
+
+    def watch(self, key, fetch, check, retry_status_codes=RETRY_STATUS_CODES):
+        """
+        Add resource to poll
+        :param key: Key of the watch, e.g. campaign id
+        :param fetch: Function returning Rest API response
+        :param check: Function (response) -> tuple of done flag and value.
+                      Value is returned as the result when done, otherwise
+                      it tells whether the resource has changed.
+        :param retry_status_codes: Response status codes polled again with
+                                   a longer interval, others must be 200
+        """
+        self._watches[key] = _Watch(
+            fetch, check, self.initial_delay, retry_status_codes
+        )
+
+    def pending(self):
+        """
+        :return: Keys of the watches not done yet
+        """
+        return list(self._watches)
+
+    def _poll(self, key, watch):
+        """
+        Poll one watch and schedule its next poll
+        """
+        response = watch.fetch()
+        self.polls += 1
+        if response.status_code in watch.retry_status_codes:
+            log.warning(
+                "Poll of {} got {}, backing off".format(
+                    key, response.status_code
+                )
+            )
+            watch.delay = min(watch.delay * 2, self.max_delay)
+        else:
+            assert_status(response, "poll {}".format(key), 200)
+            done, value = watch.check(response)
+            self.values[key] = value
+            if done:
+                self.results[key] = value
+                del self._watches[key]
+                return
+            if value != watch.value:
+                watch.value = value
+                watch.delay = self.initial_delay
+            else:
+                watch.delay = min(watch.delay * self.backoff, self.max_delay)
+        hint = server_delay(response)
+        delay = watch.delay if hint is None else max(watch.delay, hint)
+        watch.due = monotonic() + delay
+
+    def run(self, timeout):
+        """
+        Poll until all watches are done or timeout is reached
+        :param timeout: Timeout in seconds
+        :return: dict of key -> value of the done watches, last values of
+                 all watches are in values
+        """
+        deadline = monotonic() + timeout
+        while self._watches:
+            now = monotonic()
+            for key, watch in list(self._watches.items()):
+                # everything is polled once more when timeout is reached
+                if watch.due <= now or now >= deadline:
+                    self._poll(key, watch)
+            if not self._watches or now >= deadline:
+                break
+            next_due = min(watch.due for watch in self._watches.values())
+            sleep(max(min(next_due, deadline) - monotonic(), 0))
+        return self.results
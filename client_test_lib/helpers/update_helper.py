@@ -14,13 +14,89 @@ limitations under the License.
 """
 
 import logging
-from time import sleep, time
+from time import time
+from client_test_lib.helpers.poller import Poller
+from client_test_lib.tools.utils import assert_status, percentiles
 
 log = logging.getLogger(__name__)
 
+METADATA_PAGE_SIZE = 1000
+
+# States and phases after which the campaign or device no longer changes
+TERMINAL_CAMPAIGN_STATES = [
+    "autostopped",
+    "userstopped",
+    "conflict",
+    "expired",
+    "quotaallocationfailed",
+    "manifestremoved",
+]
+TERMINAL_CAMPAIGN_PHASES = ["stopped", "deleted", "archived"]
+TERMINAL_DEVICE_STATES = [
+    "deployed",
+    "failed_connector_channel_update",
+    "manifestremoved",
+    "deregistered",
+]
+
+
+def _value_check(name, get_value, expected, terminal):
+    """
+    Build poll check that is done when value is one of the expected values
+    and fails if value reaches a terminal value that is not expected
+    :param name: Name of the value for logging, e.g. "Campaign state"
+    :param get_value: Function (response) -> value or None
+    :param expected: List of expected values
+    :param terminal: List of terminal values
+    :return: Check function for Poller.watch()
+    """
+    last = [None]
+
+    def check(response):
+        value = get_value(response)
+        if value in expected:
+            return True, value
+        if value in terminal:
+            assert False, '{} reached terminal "{}" while waiting "{}"'.format(
+                name, value, expected
+            )
+        if value != last[0]:
+            log.info('{} "{}" - waiting...'.format(name, value))
+            last[0] = value
+        return False, value
+
+    return check
+
+
+def watch_campaign_state(poller, cloud, campaign_id, expected_state):
+    """
+    Add campaign state to shared poller
+    :param poller: Poller
+    :param cloud: Cloud API object
+    :param campaign_id: Campaign id
+    :param expected_state: Expected state or list of states
+    """
+    if isinstance(expected_state, str):
+        expected_state = [expected_state]
+    poller.watch(
+        campaign_id,
+        lambda: cloud.update.get_update_campaign(campaign_id),
+        _value_check(
+            "Campaign {} state".format(campaign_id),
+            lambda r: r.json()["state"],
+            expected_state,
+            TERMINAL_CAMPAIGN_STATES,
+        ),
+    )
+
 
 def wait_for_campaign_state(
-    cloud, campaign_id, expected_state="autostopped", timeout=300, delay=10
+    cloud,
+    campaign_id,
+    expected_state="autostopped",
+    timeout=300,
+    delay=10,
+    initial_delay=1,
 ):
     """
     Wait campaign to reach expected state
@@ -28,45 +104,65 @@ def wait_for_campaign_state(
     :param campaign_id: Campaign id
     :param expected_state: Expected state
     :param timeout: timeout in seconds
-    :param delay: delay in seconds per each check
-    :raises: Assert fail if timeout is reached
+    :param delay: maximum delay in seconds between the checks
+    :param initial_delay: delay in seconds after the first checks
+    :raises: Assert fail if timeout or other terminal state is reached
+    """
+    wait_for_campaigns_state(
+        cloud, [campaign_id], expected_state, timeout, delay, initial_delay
+    )
+
+
+def wait_for_campaigns_state(
+    cloud,
+    campaign_ids,
+    expected_state="autostopped",
+    timeout=300,
+    delay=10,
+    initial_delay=1,
+):
+    """
+    Wait campaigns to reach expected state, all campaigns are polled by
+    one adaptive poller
+    :param cloud: Cloud API object
+    :param campaign_ids: List of campaign ids
+    :param expected_state: Expected state
+    :param timeout: timeout in seconds
+    :param delay: maximum delay in seconds between the checks
+    :param initial_delay: delay in seconds after the first checks
+    :raises: Assert fail if timeout or other terminal state is reached
     """
-    cutout_time = time() + timeout
-    campaign_state = ""
     log.info(
-        'Waiting update campaign to reach "{}" state in next {} seconds'.format(
+        'Waiting update campaign(s) to reach "{}" state in next {} seconds'.format(
             expected_state, timeout
         )
     )
-    while time() < cutout_time:
-        r = cloud.update.get_update_campaign(
-            campaign_id, expected_status_code=200
-        )
-        campaign_data = r.json()
-        campaign_state = campaign_data["state"]
-        if campaign_state == expected_state:
+    poller = Poller(initial_delay, delay)
+    for campaign_id in campaign_ids:
+        watch_campaign_state(poller, cloud, campaign_id, expected_state)
+    poller.run(timeout)
+    for campaign_id in campaign_ids:
+        if campaign_id in poller.results:
             log.info(
                 'Update campaign reached the "{}" state. Campaign: {}'.format(
                     expected_state, campaign_id
                 )
             )
-            return
-        log.info(
-            'Campaign state "{}" - waiting {} seconds...'.format(
-                campaign_state, delay
-            )
-        )
-        sleep(delay)
-    assert False, (
+    pending = poller.pending()
+    assert not pending, (
         'Timeout while waiting update campaign to reach "{}" state. '
-        'Campaign: {} - "{}"'.format(
-            expected_state, campaign_id, campaign_state
+        "Campaign: {}".format(
+            expected_state,
+            ", ".join(
+                '{} - "{}"'.format(campaign_id, poller.values.get(campaign_id))
+                for campaign_id in pending
+            ),
         )
     )
 
 
 def wait_for_campaign_phase(
-    cloud, campaign_id, expected_phases, timeout=300, delay=10
+    cloud, campaign_id, expected_phases, timeout=300, delay=10, initial_delay=1
 ):
     """
     Wait campaign to reach expected phase
@@ -74,43 +170,132 @@ def wait_for_campaign_phase(
     :param campaign_id: Campaign id
     :param expected_phases: List of phases e.g. ['draft', 'stopped']
     :param timeout: timeout in seconds
-    :param delay: delay in seconds per each check
-    :raises: Assert fail if timeout is reached
+    :param delay: maximum delay in seconds between the checks
+    :param initial_delay: delay in seconds after the first checks
+    :raises: Assert fail if timeout or other terminal phase is reached
     """
-    cutout_time = time() + timeout
-    campaign_phase = ""
     log.info(
         'Waiting update campaign to reach "{}" phase(s) in next {} seconds'.format(
             expected_phases, timeout
         )
     )
-    while time() < cutout_time:
-        r = cloud.update.get_update_campaign(
-            campaign_id, expected_status_code=200
-        )
-        campaign_data = r.json()
-        campaign_phase = campaign_data["phase"]
-        if campaign_phase in expected_phases:
-            log.info(
-                'Update campaign reached the "{}" phase. Campaign: {}'.format(
-                    campaign_phase, campaign_id
-                )
-            )
-            return
+    poller = Poller(initial_delay, delay)
+    poller.watch(
+        campaign_id,
+        lambda: cloud.update.get_update_campaign(campaign_id),
+        _value_check(
+            "Campaign {} phase".format(campaign_id),
+            lambda r: r.json()["phase"],
+            expected_phases,
+            TERMINAL_CAMPAIGN_PHASES,
+        ),
+    )
+    results = poller.run(timeout)
+    if campaign_id in results:
         log.info(
-            'Campaign phase "{}" - waiting {} seconds...'.format(
-                campaign_phase, delay
+            'Update campaign reached the "{}" phase. Campaign: {}'.format(
+                results[campaign_id], campaign_id
             )
         )
-        sleep(delay)
+        return
     assert False, (
         'Timeout while waiting update campaign to reach "{}" phase(s). '
         'Campaign: {} - "{}"'.format(
-            expected_phases, campaign_id, campaign_phase
+            expected_phases, campaign_id, poller.values.get(campaign_id)
         )
     )
 
 
+def get_campaign_metadata_page(
+    cloud, campaign_id, after=None, page_size=METADATA_PAGE_SIZE
+):
+    """
+    Get one page of campaign device metadata
+    :param cloud: Cloud API object
+    :param campaign_id: Campaign id
+    :param after: Metadata id after which the page starts
+    :param page_size: Number of devices per page
+    :return: Campaign device metadata response
+    """
+    query_params = {"limit": page_size, "order": "ASC"}
+    if after:
+        query_params["after"] = after
+    return cloud.update.get_update_campaign_metadata(
+        campaign_id, query_params=query_params
+    )
+
+
+def iter_campaign_device_metadata(
+    cloud, campaign_id, page_size=METADATA_PAGE_SIZE, first_page=None
+):
+    """
+    Iterate campaign device metadata, pages are fetched lazily with
+    after/limit cursors while the iteration proceeds
+    :param cloud: Cloud API object
+    :param campaign_id: Campaign id
+    :param page_size: Number of devices per page
+    :param first_page: Already fetched first page response
+    :return: Generator of campaign device metadata dicts
+    """
+    r = first_page
+    if r is None:
+        r = get_campaign_metadata_page(cloud, campaign_id, None, page_size)
+    while True:
+        assert_status(r, "iter_campaign_device_metadata", 200)
+        page = r.json()
+        for metadata in page["data"]:
+            yield metadata
+        if not page.get("has_more") or not page["data"]:
+            return
+        r = get_campaign_metadata_page(
+            cloud, campaign_id, page["data"][-1]["id"], page_size
+        )
+
+
+def campaign_device_states(
+    cloud,
+    campaign_id,
+    device_ids=None,
+    page_size=METADATA_PAGE_SIZE,
+    first_page=None,
+):
+    """
+    Build device id -> deployment state index in a single pass over the
+    campaign device metadata
+    :param cloud: Cloud API object
+    :param campaign_id: Campaign id
+    :param device_ids: Devices of interest, iteration stops when all of
+                       them are found. All devices are indexed by default.
+    :param page_size: Number of devices per page
+    :param first_page: Already fetched first page response
+    :return: dict of device id -> deployment state
+    """
+    wanted = None if device_ids is None else set(device_ids)
+    states = {}
+    for metadata in iter_campaign_device_metadata(
+        cloud, campaign_id, page_size, first_page
+    ):
+        device_id = metadata["device_id"]
+        if wanted is None or device_id in wanted:
+            states[device_id] = metadata["deployment_state"]
+            if wanted is not None and len(states) == len(wanted):
+                break
+    return states
+
+
+def group_devices_by_state(states):
+    """
+    Group device deployment states, e.g. to see which devices are
+    deployed or failed
+    :param states: dict of device id -> deployment state
+    :return: dict of deployment state -> list of device ids
+    """
+    groups = {}
+    for device_id, state in states.items():
+        groups.setdefault(state, []).append(device_id)
+    return groups
+
+
 def wait_for_campaign_device_state(
     cloud,
     campaign_id,
@@ -118,6 +303,7 @@ def wait_for_campaign_device_state(
     expected_state="deployed",
     timeout=300,
     delay=10,
+    initial_delay=1,
 ):
     """
     Wait campaign device state to reach expected state
@@ -126,40 +312,247 @@ def wait_for_campaign_device_state(
     :param device_id: device id
     :param expected_state: Expected state
     :param timeout: timeout in seconds
-    :param delay: delay in seconds per each check
-    :raises: Assert fail if timeout is reached
+    :param delay: maximum delay in seconds between the checks
+    :param initial_delay: delay in seconds after the first checks
+    :raises: Assert fail if timeout or other terminal state is reached
     """
-    cutout_time = time() + timeout
-    campaign_device_state = ""
     log.info(
         'Waiting update campaign device state to reach "{}" state in next {} seconds'.format(
             expected_state, timeout
         )
     )
-    while time() < cutout_time:
-        r = cloud.update.get_update_campaign_metadata(
-            campaign_id, expected_status_code=200
-        )
-        resp_data = r.json()["data"]
-        campaign_device_state = resp_data[0]
-        if device_id == campaign_device_state["device_id"]:
-            campaign_device_state = campaign_device_state["deployment_state"]
-            if campaign_device_state == expected_state:
-                log.info(
-                    'Update campaign device reached the "{}" state. Campaign: {}'.format(
-                        expected_state, campaign_id
-                    )
-                )
-                return
-            log.info(
-                'Device state "{}" - waiting {} seconds...'.format(
-                    campaign_device_state, delay
-                )
+    poller = Poller(initial_delay, delay)
+    poller.watch(
+        device_id,
+        lambda: get_campaign_metadata_page(cloud, campaign_id),
+        _value_check(
+            "Device {} state".format(device_id),
+            lambda r: campaign_device_states(
+                cloud, campaign_id, [device_id], first_page=r
+            ).get(device_id),
+            [expected_state],
+            TERMINAL_DEVICE_STATES,
+        ),
+    )
+    if device_id in poller.run(timeout):
+        log.info(
+            'Update campaign device reached the "{}" state. Campaign: {}'.format(
+                expected_state, campaign_id
             )
-            sleep(delay)
+        )
+        return
     assert False, (
         'Timeout while waiting update campaign device state to reach "{}". '
         'Campaign: {} - "{}"'.format(
-            expected_state, campaign_id, campaign_device_state
+            expected_state, campaign_id, poller.values.get(device_id)
         )
     )
+
+
+class CampaignTracker:
+    """
+    Tracks the deployment of a campaign to many devices. Keeps per-device
+    state timelines, counts devices per state and measures time to deployed
+    from the tracker start.
+    :param cloud: Cloud API object
+    :param campaign_id: Campaign id
+    :param device_ids: Targeted devices, by default all devices listed in
+                       the campaign device metadata
+    :param started: Start time for time to deployed, defaults to now
+    :param page_size: Number of devices per metadata page
+    :param expected_devices: Number of targeted devices when device_ids is
+                             not given. Without it the tracker is done only
+                             after the campaign itself has finished, as the
+                             devices are listed while the campaign runs.
+    """
+
+    def __init__(
+        self,
+        cloud,
+        campaign_id,
+        device_ids=None,
+        started=None,
+        page_size=METADATA_PAGE_SIZE,
+        expected_devices=None,
+    ):
+        self.cloud = cloud
+        self.campaign_id = campaign_id
+        self.device_ids = None if device_ids is None else list(device_ids)
+        self.started = time() if started is None else started
+        self.page_size = page_size
+        self.expected_devices = expected_devices
+        self.states = {}
+        self.timelines = {}
+        self.campaign_finished = False
+        if self.device_ids is not None:
+            self.states = dict.fromkeys(self.device_ids)
+
+    def update(self, first_page=None):
+        """
+        Read the device states in one pass and record the state changes
+        :param first_page: Already fetched first metadata page response
+        :return: dict of device id -> deployment state
+        """
+        now = time()
+        states = campaign_device_states(
+            self.cloud,
+            self.campaign_id,
+            self.device_ids,
+            self.page_size,
+            first_page,
+        )
+        for device_id, state in states.items():
+            if self.states.get(device_id) != state:
+                self.timelines.setdefault(device_id, []).append(
+                    (now - self.started, state)
+                )
+            self.states[device_id] = state
+        if self._needs_campaign_state() and not self.stragglers():
+            self.campaign_finished = self._campaign_finished()
+        return self.states
+
+    def _needs_campaign_state(self):
+        """
+        :return: True when the targeted devices are not known up front
+        """
+        return self.device_ids is None and self.expected_devices is None
+
+    def _campaign_finished(self):
+        """
+        :return: True when the campaign is in a terminal state or phase
+        """
+        r = self.cloud.update.get_update_campaign(self.campaign_id)
+        assert_status(r, "CampaignTracker", 200)
+        campaign = r.json()
+        return (
+            campaign.get("state") in TERMINAL_CAMPAIGN_STATES
+            or campaign.get("phase") in TERMINAL_CAMPAIGN_PHASES
+        )
+
+    def done(self):
+        """
+        Without device_ids all targeted devices are known only when
+        expected_devices are listed or when the campaign has finished
+        :return: True when every targeted device is in a terminal state
+        """
+        if not self.states or self.stragglers():
+            return False
+        if self.expected_devices is not None:
+            return len(self.states) >= self.expected_devices
+        if self.device_ids is None:
+            return self.campaign_finished
+        return True
+
+    def state_counts(self):
+        """
+        :return: dict of deployment state -> number of devices, devices not
+                 yet listed in the campaign are counted as None
+        """
+        counts = {}
+        for state in self.states.values():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def time_to_deployed(self):
+        """
+        Time to deployed, accuracy is limited by the polling interval
+        :return: dict of device id -> seconds from start to deployed state
+        """
+        deployed = {}
+        for device_id, timeline in self.timelines.items():
+            for elapsed, state in timeline:
+                if state == "deployed":
+                    deployed[device_id] = elapsed
+                    break
+        return deployed
+
+    def stragglers(self):
+        """
+        :return: List of device ids not in a terminal state
+        """
+        return [
+            device_id
+            for device_id, state in self.states.items()
+            if state not in TERMINAL_DEVICE_STATES
+        ]
+
+    def report(self):
+        """
+        :return: dict of device count, state counts, failed devices,
+                 stragglers and time to deployed min, max and percentiles
+        """
+        times = list(self.time_to_deployed().values())
+        time_stats = {
+            "min": min(times) if times else None,
+            "max": max(times) if times else None,
+        }
+        time_stats.update(percentiles(times))
+        return {
+            "devices": len(self.states),
+            "states": self.state_counts(),
+            "failed": [
+                device_id
+                for device_id, state in self.states.items()
+                if state in TERMINAL_DEVICE_STATES and state != "deployed"
+            ],
+            "stragglers": self.stragglers(),
+            "time_to_deployed": time_stats,
+        }
+
+    def _check(self, response):
+        """
+        Poll check, the state counts tell the poller about progress
+        """
+        self.update(response)
+        counts = self.state_counts()
+        log.info(
+            "Campaign {} device states: {}".format(self.campaign_id, counts)
+        )
+        return self.done(), sorted(counts.items(), key=str)
+
+    def wait(self, timeout=900, delay=30, initial_delay=1, assert_errors=True):
+        """
+        Poll until every targeted device reaches a terminal state, see done()
+        :param timeout: timeout in seconds
+        :param delay: maximum delay in seconds between the checks
+        :param initial_delay: delay in seconds after the first checks
+        :param assert_errors: Fail the test case if some device failed or
+                              didn't reach a terminal state
+        :return: Tracker report, see report()
+        """
+        poller = Poller(initial_delay, delay)
+        poller.watch(
+            self.campaign_id,
+            lambda: get_campaign_metadata_page(
+                self.cloud, self.campaign_id, page_size=self.page_size
+            ),
+            self._check,
+        )
+        poller.run(timeout)
+        report = self.report()
+        log.info(
+            "Campaign {}: {} devices, states {}, time to deployed "
+            "p50 {} s, p95 {} s, p99 {} s".format(
+                self.campaign_id,
+                report["devices"],
+                report["states"],
+                report["time_to_deployed"]["p50"],
+                report["time_to_deployed"]["p95"],
+                report["time_to_deployed"]["p99"],
+            )
+        )
+        if report["stragglers"] or report["failed"] or not self.done():
+            err_msg = (
+                "Campaign {} failed devices: {}, stragglers: {}, "
+                "devices listed: {}, campaign finished: {}".format(
+                    self.campaign_id,
+                    report["failed"],
+                    report["stragglers"],
+                    report["devices"],
+                    self.campaign_finished,
+                )
+            )
+            if assert_errors:
+                assert False, err_msg
+            log.error(err_msg)
+        return report
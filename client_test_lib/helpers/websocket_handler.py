@@ -13,28 +13,145 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import abc
 import base64
+import binascii
+from collections import deque
 import datetime
 import json
 import logging
 import queue
+import random
 import threading
-from time import sleep
+from time import monotonic
 from ws4py.client.threadedclient import WebSocketClient
 from ws4py.exc import WebSocketException
+from client_test_lib.helpers.event_store import (
+    AsyncResponseStore,
+    EventStore,
+)
 from client_test_lib.tools.utils import build_random_string
 
 log = logging.getLogger(__name__)
 
+NOTIFICATION_TYPES = (
+    "registrations",
+    "notifications",
+    "reg-updates",
+    "de-registrations",
+    "registrations-expired",
+)
+RECONNECT_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+RECONNECT_HISTORY = 100
+# Time for the service to re-deliver events after a gap before failing waits
+GAP_GRACE_PERIOD = 5
+# Sentinel for stopping the message handle thread
+_STOP = object()
+
+
+class WebSocketChannelGap(Exception):
+    """
+    Awaited event may have been lost while the WebSocket was disconnected
+    """
+
+
+def event_time(event):
+    """
+    Receive time of a stored WebSocket event
+    :param event: Event dict with "dt" UTC timestamp
+    :return: Seconds since the epoch, comparable with time.time()
+    """
+    received = datetime.datetime.fromisoformat(event["dt"].rstrip("Z"))
+    return received.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def decode_payload(content):
+    """
+    Decode base64 payload of notification or async response once and store
+    the result in the content as "raw_payload" (bytes) and "decoded_payload"
+    (utf-8 string, undecodable bytes replaced)
+    :param content: Notification or async response dict
+    :return: Decoded payload string, None if content has no valid payload
+    """
+    if "decoded_payload" not in content:
+        if "payload" not in content:
+            return None
+        try:
+            raw_payload = base64.b64decode(content["payload"])
+        except (binascii.Error, TypeError, ValueError) as e:
+            log.warning(
+                'Invalid payload "{}": {}'.format(content["payload"], e)
+            )
+            content["raw_payload"] = None
+            content["decoded_payload"] = None
+            return None
+        content["raw_payload"] = raw_payload
+        content["decoded_payload"] = raw_payload.decode("utf-8", "replace")
+    return content["decoded_payload"]
+
 
 class WebSocketHandler:
     """
-    Class to handle messages via WebSocket
+    Class to handle messages via WebSocket. Handlers can be views of a
+    shared channel that only see the events stored after the view was
+    created and the events of given devices.
     :param ws: WebSocket Runner class
+    :param marks: dict of notification type -> first sequence number of
+                  the events seen by the handler, None for all events
+    :param device_ids: Only events of these devices are seen
     """
 
-    def __init__(self, ws):
+    def __init__(self, ws, marks=None, device_ids=None):
         self.ws = ws
+        self.marks = marks or {}
+        self.device_ids = None if device_ids is None else set(device_ids)
+
+    def view(self, device_ids=None):
+        """
+        Handler sharing the WebSocket runner, e.g. for one test module or
+        test case. The view sees the events stored from now on.
+        :param device_ids: Only events of these devices are seen
+        :return: Handler of the same class
+        """
+        return self.__class__(
+            self.ws,
+            {
+                notification_type: store.next_seq
+                for notification_type, store in self.ws.events.items()
+            },
+            device_ids,
+        )
+
+    def _find(self, notification_type, device_id, path=None, match=None):
+        """
+        Find the first event of the view for device
+        :param notification_type: Notification type
+        :param device_id: string
+        :param path: Resource path
+        :param match: Optional function to filter events
+        :return: Event dict or None
+        """
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return None
+        return self.ws.events[notification_type].find(
+            device_id, path, match, self.marks.get(notification_type)
+        )
+
+    def _find_all(self, notification_type, device_id, paths=None, match=None):
+        """
+        Find all events of the view for device
+        :param notification_type: Notification type
+        :param device_id: string
+        :param paths: List of resource paths or None for all paths
+        :param match: Optional function to filter events
+        :return: List of events in insertion order
+        """
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return []
+        return self.ws.events[notification_type].find_all(
+            device_id, paths, match, self.marks.get(notification_type)
+        )
 
     def check_registration(self, device_id):
         """
@@ -42,11 +159,8 @@ class WebSocketHandler:
         :param device_id: string
         :return:
         """
-        for item in self.ws.events["registrations"]:
-            # If asked device_id is found return its data. Otherwise return False
-            if item["ep"] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its data. Otherwise return False
+        return self._find("registrations", device_id) or False
 
     def check_deregistration(self, device_id):
         """
@@ -54,11 +168,8 @@ class WebSocketHandler:
         :param device_id: string
         :return:
         """
-        for item in self.ws.events["de-registrations"]:
-            # If asked device_id is found return its data. Otherwise return False
-            if item["ep"] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its data. Otherwise return False
+        return self._find("de-registrations", device_id) or False
 
     def check_registration_updates(self, device_id):
         """
@@ -66,11 +177,8 @@ class WebSocketHandler:
         :param device_id: string
         :return: False / dict
         """
-        for item in self.ws.events["reg-updates"]:
-            # If asked device_id is found return its data. Otherwise return False
-            if item["ep"] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its data. Otherwise return False
+        return self._find("reg-updates", device_id) or False
 
     def check_registration_expiration(self, device_id):
         """
@@ -78,18 +186,17 @@ class WebSocketHandler:
         :param device_id: string
         :return: False / dict
         """
-        for item in self.ws.events["registrations-expired"]:
-            # If asked device_id is found return its data. Otherwise return False
-            if item["ep"] == device_id:
-                return item
-        return False
+        # If asked device_id is found return its data. Otherwise return False
+        return self._find("registrations-expired", device_id) or False
 
     def get_notifications(self):
         """
         Get all notifications from WebSocket data
-        :return: dict
+        :return: list
         """
-        return self.ws.events["notifications"]
+        return self.ws.events["notifications"].to_list(
+            self.marks.get("notifications"), self.device_ids
+        )
 
     def get_async_response(self, async_response_id):
         """
@@ -99,6 +206,93 @@ class WebSocketHandler:
         """
         return self.ws.async_responses.get(async_response_id)
 
+    def _wait(self, keys, check, timeout, assert_errors=False):
+        """
+        Wait for the runner to have result for check
+        :param keys: List of event keys
+        :param check: Function returning the wanted data or False/None
+        :param timeout: int
+        :param assert_errors: Fail the test case on channel gap
+        :return: Result of check or False on timeout or on channel gap
+        """
+        try:
+            return self.ws.wait_for(keys, check, timeout)
+        except WebSocketChannelGap as e:
+            log.error(str(e))
+            if assert_errors:
+                assert False, str(e)
+            return False
+
+    def _find_multiple_notifications(self, device_id, expected_notifications):
+        """
+        Find notifications matching the expected resource paths and values
+        :param device_id: string
+        :param expected_notifications: list of dicts of resource paths with expected values
+        :return: list of found notifications, at most as many as expected
+        """
+        item_list = []
+        paths = [
+            path
+            for expect_item in expected_notifications
+            for path in expect_item
+        ]
+        for item in self._find_all("notifications", device_id, paths):
+            # Check if received notification contains any combinations defined in expected_notifications.
+            # If found, append item to item_list. If as many items are found as are expected, return list.
+            if [
+                expect_item
+                for expect_item in expected_notifications
+                if item["path"] in expect_item.keys()
+                and decode_payload(item) in expect_item.values()
+            ]:
+                item_list.append(item)
+                if len(item_list) == len(expected_notifications):
+                    break
+        return item_list
+
+    def _multiple_notification_query(self, device_id, expected_notifications):
+        """
+        Build waiter keys and check for wait_for_multiple_notification
+        :param device_id: string
+        :param expected_notifications: list of dicts of resource paths with expected values
+        :return: tuple of waiter keys and check function
+        """
+
+        def _check():
+            item_list = self._find_multiple_notifications(
+                device_id, expected_notifications
+            )
+            if len(item_list) == len(expected_notifications):
+                return item_list
+            return False
+
+        keys = [
+            ("notifications", device_id, path)
+            for expect_item in expected_notifications
+            for path in expect_item
+        ]
+        return keys, _check
+
+    def _multiple_notification_result(
+        self, device_id, expected_notifications, result, assert_errors
+    ):
+        """
+        Handle the result of wait_for_multiple_notification
+        """
+        if result:
+            return result
+        log.debug(
+            "Expected {}, found only {}!".format(
+                expected_notifications,
+                self._find_multiple_notifications(
+                    device_id, expected_notifications
+                ),
+            )
+        )
+        if assert_errors:
+            assert False, "Failed to receive notifications"
+        return False
+
     def wait_for_multiple_notification(
         self,
         device_id,
@@ -118,31 +312,48 @@ class WebSocketHandler:
         :param assert_errors: boolean for user if to fail test case in case of expected notifications not received
         :return: False / list of received notifications or fail the test case if confirm_resp=True
         """
-        item_list = []
-        for _ in range(timeout):
-            notifications = self.get_notifications()
-            for item in notifications:
-                if item["ep"] == device_id:
-                    # Check if received notification contains any combinations defined in expected_notifications.
-                    # If found, append item to item_list. If as many items are found as are expected, return list.
-                    if [
-                        expect_item
-                        for expect_item in expected_notifications
-                        if item["path"] in expect_item.keys()
-                        and base64.b64decode(item["payload"]).decode("utf8")
-                        in expect_item.values()
-                    ]:
-                        item_list.append(item)
-                        if len(item_list) == len(expected_notifications):
-                            return item_list
-            sleep(1)
-        log.debug(
-            "Expected {}, found only {}!".format(
-                expected_notifications, item_list
-            )
+        keys, check = self._multiple_notification_query(
+            device_id, expected_notifications
+        )
+        result = self._wait(keys, check, timeout, assert_errors)
+        return self._multiple_notification_result(
+            device_id, expected_notifications, result, assert_errors
         )
+
+    def _notification_query(self, device_id, resource_path, expected_value):
+        """
+        Build waiter keys and check for wait_for_notification
+        :param device_id: string
+        :param resource_path: string
+        :param expected_value: string
+        :return: tuple of waiter keys and check function
+        """
+        expected_value = str(expected_value)
+
+        def _check():
+            return self._find(
+                "notifications",
+                device_id,
+                resource_path,
+                lambda item: decode_payload(item) == expected_value,
+            )
+
+        return [("notifications", device_id, resource_path)], _check
+
+    @staticmethod
+    def _notification_result(expected_value, item, assert_errors):
+        """
+        Handle the result of wait_for_notification
+        """
+        if item:
+            log.info(
+                'Expected notification value "{}" received at callback'.format(
+                    expected_value
+                )
+            )
+            return item
         if assert_errors:
-            assert False, "Failed to receive notifications"
+            assert False, "Failed to receive notification"
         return False
 
     def wait_for_notification(
@@ -162,24 +373,48 @@ class WebSocketHandler:
         :param assert_errors: boolean for user if to fail test case in case of expected notification not received
         :return: dict or fail the test case if confirm_resp=True
         """
-        expected_value = str(expected_value)
-        for _ in range(timeout):
-            for item in self.ws.events["notifications"]:
-                if (
-                    item["ep"] == device_id
-                    and item["path"] == resource_path
-                    and base64.b64decode(item["payload"]).decode("utf8")
-                    == expected_value
-                ):
-                    log.info(
-                        'Expected notification value "{}" received at callback'.format(
-                            expected_value
-                        )
+        keys, check = self._notification_query(
+            device_id, resource_path, expected_value
+        )
+        item = self._wait(keys, check, timeout, assert_errors)
+        return self._notification_result(expected_value, item, assert_errors)
+
+    def _async_response_query(self, async_response_id):
+        """
+        Build waiter keys and check for wait_for_async_response
+        :param async_response_id: string
+        :return: tuple of waiter keys and check function
+        """
+        return [("async-responses", async_response_id)], lambda: (
+            self.ws.async_responses.get(async_response_id)
+        )
+
+    def _async_response_result(
+        self, async_response_id, async_response, assert_errors
+    ):
+        """
+        Handle the result of wait_for_async_response
+        """
+        if async_response:
+            log.info(
+                'Async response received for async-id: "{}". Status: {}'.format(
+                    async_response_id, async_response["status"]
+                )
+            )
+            if "payload" in async_response:
+                # payload is decoded once when the async response is received
+                decode_payload(async_response)
+                log.info(
+                    'Async response payload: "{}"'.format(
+                        async_response["decoded_payload"]
                     )
-                    return item
-            sleep(1)
+                )
+
+            log.debug(async_response)
+            self.ws.async_responses.consume(async_response_id)
+            return async_response
         if assert_errors:
-            assert False, "Failed to receive notification"
+            assert False, "Failed to receive async response"
         return False
 
     def wait_for_async_response(
@@ -192,108 +427,493 @@ class WebSocketHandler:
         :param assert_errors: boolean for user if to fail test case in case of expected response not received
         :return: dict or fail the test case if confirm_resp=True
         """
-        for _ in range(timeout):
-            async_response = self.ws.async_responses.get(async_response_id)
-            if async_response:
-                log.info(
-                    'Async response received for async-id: "{}". Status: {}'.format(
-                        async_response_id, async_response["status"]
-                    )
-                )
-                if "payload" in async_response:
-                    # decode original payload and append in received async response
-                    async_response["decoded_payload"] = base64.b64decode(
-                        async_response["payload"]
-                    ).decode("utf-8", "replace")
-                    log.info(
-                        'Async response payload: "{}"'.format(
-                            async_response["decoded_payload"]
-                        )
-                    )
+        keys, check = self._async_response_query(async_response_id)
+        async_response = self._wait(keys, check, timeout, assert_errors)
+        return self._async_response_result(
+            async_response_id, async_response, assert_errors
+        )
 
-                log.debug(async_response)
-                return async_response
-            sleep(1)
-        if assert_errors:
-            assert False, "Failed to receive async response"
-        return False
+    def _async_responses_query(self, async_response_ids):
+        """
+        Build waiter keys and check for wait_for_async_responses
+        :param async_response_ids: List of async-ids
+        :return: tuple of waiter keys, check function and dict of async-id
+                 -> response filled by the check
+        """
+        pending = set(async_response_ids)
+        responses = {}
+
+        def _check():
+            for async_id in list(pending):
+                response = self.ws.async_responses.get(async_id)
+                if response is not None:
+                    responses[async_id] = response
+                    pending.discard(async_id)
+            return not pending
+
+        keys = [("async-responses", async_id) for async_id in pending]
+        return keys, _check, responses
 
-    def wait_for_registration(self, device_id, timeout=30):
+    def _async_responses_result(self, responses):
+        """
+        Handle the result of wait_for_async_responses
+        """
+        for async_id, response in responses.items():
+            decode_payload(response)
+            self.ws.async_responses.consume(async_id)
+        return responses
+
+    def wait_for_async_responses(self, async_response_ids, timeout=30):
+        """
+        Wait for many async-responses at once
+        :param async_response_ids: List of async-ids
+        :param timeout: Timeout in seconds for all responses
+        :return: dict of async-id -> response for the received responses
+        """
+        keys, check, responses = self._async_responses_query(
+            async_response_ids
+        )
+        self._wait(keys, check, timeout)
+        return self._async_responses_result(responses)
+
+    def _event_query(self, notification_type, device_id, since=None):
+        """
+        Build waiter keys and check for registration event waits
+        :param notification_type: Notification type
+        :param device_id: string
+        :param since: Only events received at or after this time.time()
+        :return: tuple of waiter keys and check function
+        """
+        match = (
+            None if since is None else lambda event: event_time(event) >= since
+        )
+        return [(notification_type, device_id)], lambda: (
+            self._find(notification_type, device_id, match=match) or False
+        )
+
+    def wait_for_registration(self, device_id, timeout=30, since=None):
         """
         Wait for given device id registration to appear in WebSocket
         :param device_id: string
         :param timeout: int
+        :param since: Only events received at or after this time.time()
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self._wait(
+            *self._event_query("registrations", device_id, since), timeout
+        )
 
-    def wait_for_registration_updates(self, device_id, timeout=30):
+    def wait_for_registration_updates(self, device_id, timeout=30, since=None):
         """
         Wait for given device id registration update notification to appear in WebSocket
         :param device_id: string
         :param timeout: int
+        :param since: Only events received at or after this time.time()
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration_updates(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self._wait(
+            *self._event_query("reg-updates", device_id, since), timeout
+        )
 
-    def wait_for_registration_expiration(self, device_id, timeout=30):
+    def wait_for_registration_expiration(
+        self, device_id, timeout=30, since=None
+    ):
         """
         Wait for given device id registration expiration notification to appear in WebSocket
         :param device_id: string
         :param timeout: int
+        :param since: Only events received at or after this time.time()
         :return: False / dict
         """
-        for _ in range(timeout):
-            registration = self.check_registration_expiration(device_id)
-            if registration:
-                return registration
-            sleep(1)
-        return False
+        return self._wait(
+            *self._event_query("registrations-expired", device_id, since),
+            timeout
+        )
 
-    def wait_for_deregistration(self, device_id, timeout=30):
+    def wait_for_deregistration(self, device_id, timeout=30, since=None):
         """
         Wait for given device id de-registration to appear in WebSocket
         :param device_id: string
         :param timeout: int
+        :param since: Only events received at or after this time.time()
         :return: False / dict
         """
-        for _ in range(timeout):
-            deregistration = self.check_deregistration(device_id)
-            if deregistration:
-                return deregistration
-            sleep(1)
+        return self._wait(
+            *self._event_query("de-registrations", device_id, since), timeout
+        )
+
+
+class BaseWebSocketRunner(abc.ABC):
+    """
+    Base class for storing data from notification service and waking up
+    the waiters of received events
+    :param retention: dict of notification type -> RetentionPolicy, e.g.
+                      {"notifications": RetentionPolicy(max_entries=10000)}
+    :param backfill: Function (device_id, resource_path) -> REST response
+                     for reading resource values missed during a channel
+                     gap, e.g. ConnectAPI.get_device_resource_value
+    """
+
+    def __init__(self, retention=None, backfill=None):
+        retention = retention or {}
+        self.async_responses = AsyncResponseStore(
+            retention.get("async-responses")
+        )
+        self.events = {
+            notification_type: EventStore(retention.get(notification_type))
+            for notification_type in NOTIFICATION_TYPES
+        }
+        self.backfill = backfill
+        self.connected = threading.Event()
+        self.reconnect_latencies = deque(maxlen=RECONNECT_HISTORY)
+        self.gaps = deque(maxlen=RECONNECT_HISTORY)
+        self._disconnected_at = None
+        self._reconnect_attempt = 0
+        self._waiters_lock = threading.RLock()
+        self._waiters = {}
+        self._gapped = {}
+        # guards _backfill_requests against the async responses received
+        # while the backfill request is still being sent
+        self._backfill_lock = threading.Lock()
+        self._backfill_requests = {}
+
+    def reconnect_stats(self):
+        """
+        Get reconnect latency statistics, latency is the time from losing
+        the connection to having it opened again
+        :return: dict with reconnect count and latencies in seconds
+        """
+        latencies = list(self.reconnect_latencies)
+        return {
+            "reconnects": len(latencies),
+            "last": latencies[-1] if latencies else None,
+            "max": max(latencies) if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "backfilled": sum(gap["backfilled"] for gap in self.gaps),
+            "lost": sum(gap["lost"] for gap in self.gaps),
+        }
+
+    def _on_connected(self):
+        """
+        Mark the WebSocket connection opened
+        """
+        gap = None
+        if self._disconnected_at is not None:
+            latency = monotonic() - self._disconnected_at
+            self.reconnect_latencies.append(latency)
+            log.info("WebSocket reconnected in {:.3f} s".format(latency))
+            gap = {
+                "start": self._disconnected_at,
+                "end": monotonic(),
+                "backfilled": 0,
+                "lost": 0,
+            }
+            self.gaps.append(gap)
+            self._disconnected_at = None
+        self._reconnect_attempt = 0
+        self.connected.set()
+        if gap:
+            self._handle_gap(gap)
+
+    def _on_disconnected(self):
+        """
+        Mark the WebSocket connection lost
+        """
+        self.connected.clear()
+        if self._disconnected_at is None:
+            self._disconnected_at = monotonic()
+
+    def _next_reconnect_delay(self):
+        """
+        Exponential backoff with jitter for the next reconnect attempt
+        :return: Delay in seconds
+        """
+        delay = min(
+            RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2**self._reconnect_attempt
+        )
+        self._reconnect_attempt += 1
+        return random.uniform(delay / 2, delay)
+
+    def _handle_gap(self, gap):
+        """
+        Backfill or fail the waits pending over a channel gap
+        :param gap: Gap dict with monotonic start and end times
+        """
+        with self._waiters_lock:
+            keys = list(self._waiters.keys())
+        if not keys:
+            return
+        log.warning(
+            "WebSocket channel gap of {:.1f} s, {} pending wait(s)".format(
+                gap["end"] - gap["start"], len(keys)
+            )
+        )
+        self._run_in_background(self._backfill_gap, gap, keys)
+
+    def _backfill_gap(self, gap, keys):
+        """
+        Read the awaited resource values via REST API, waits which can not
+        be backfilled fail after GAP_GRACE_PERIOD unless the event arrives
+        :param gap: Gap dict
+        :param keys: Event keys of the pending waits
+        """
+        for key in keys:
+            if key[0] == "notifications" and self._backfill_resource(
+                key[1], key[2]
+            ):
+                gap["backfilled"] += 1
+                continue
+            gap["lost"] += 1
+            self._call_in_runner(self._mark_gapped, key, gap)
+
+    def _backfill_resource(self, device_id, resource_path):
+        """
+        Read resource value missed during channel gap
+        :param device_id: Device id
+        :param resource_path: Resource path
+        :return: True if value was or will be received
+        """
+        if self.backfill is None:
+            return False
+        log.info(
+            'Backfilling "{}" of device {} after channel gap'.format(
+                resource_path, device_id
+            )
+        )
+        try:
+            r = self.backfill(device_id, resource_path)
+            if r.status_code == 200:
+                notification = {
+                    "ep": device_id,
+                    "path": resource_path,
+                    "payload": base64.b64encode(r.content).decode(),
+                    "backfilled": True,
+                }
+                self._call_in_runner(
+                    self._handle_content, "notifications", [notification]
+                )
+                return True
+            if r.status_code == 202:
+                async_id = r.json()["async-response-id"]
+                backfill = (device_id, resource_path)
+                with self._backfill_lock:
+                    # the response may have arrived before the 202 response
+                    response = self.async_responses.get(async_id)
+                    if response is None:
+                        self._backfill_requests[async_id] = backfill
+                if response is not None:
+                    self._call_in_runner(
+                        self._store_backfill, backfill, response
+                    )
+                return True
+            log.warning(
+                "Backfill failed with status {}: {}".format(
+                    r.status_code, r.text
+                )
+            )
+        except (OSError, ValueError, KeyError) as e:
+            log.warning("Backfill failed: {}".format(e))
         return False
 
+    def _mark_gapped(self, key, gap):
+        """
+        Mark waits of event key to fail after the gap grace period
+        :param key: Event key
+        :param gap: Gap dict
+        """
+        self._gapped[key] = (gap, monotonic() + GAP_GRACE_PERIOD)
+        self._wake_waiters(key)
+
+    def _gap_for(self, keys, started):
+        """
+        Get channel gap affecting a wait
+        :param keys: Event keys of the wait
+        :param started: Monotonic start time of the wait
+        :return: Tuple of gap dict and time to fail the wait, or None
+        """
+        for key in keys:
+            gapped = self._gapped.get(key)
+            if gapped and gapped[0]["end"] >= started:
+                return gapped
+        return None
+
+    @staticmethod
+    def _gap_error(keys, gap):
+        """
+        Build the error for a wait failed because of a channel gap
+        :param keys: Event keys of the wait
+        :param gap: Gap dict
+        :return: WebSocketChannelGap
+        """
+        return WebSocketChannelGap(
+            "WebSocket channel gap: connection was lost for {:.1f} s "
+            "while waiting for {}, the event may have been lost".format(
+                gap["end"] - gap["start"], keys
+            )
+        )
 
-class WebSocketRunner:
+    def _run_in_background(self, func, *args):
+        """
+        Run function without blocking the runner
+        """
+        thread = threading.Thread(
+            target=func,
+            args=args,
+            name="backfill_{}".format(build_random_string(3)),
+        )
+        thread.daemon = True
+        thread.start()
+
+    def _call_in_runner(self, func, *args):
+        """
+        Call function in the context handling the received content
+        """
+        func(*args)
+
+    def eviction_stats(self):
+        """
+        Get counters of items evicted by the retention policies
+        :return: dict of notification type -> evicted count
+        """
+        stats = {
+            notification_type: store.evicted
+            for notification_type, store in self.events.items()
+        }
+        stats["async-responses"] = self.async_responses.evicted
+        stats["async-responses-consumed"] = self.async_responses.consumed
+        return stats
+
+    @abc.abstractmethod
+    def wait_for(self, keys, check, timeout):
+        """
+        Wait until check returns a result, waking up whenever an event
+        with one of the given keys is received
+        :param keys: List of event keys, see _event_key()
+        :param check: Function returning the wanted data or False/None
+        :param timeout: Timeout in seconds
+        :return: Result of check or False on timeout
+        """
+
+    @abc.abstractmethod
+    def _wake_waiters(self, key):
+        """
+        Wake up the waiters of given event key
+        :param key: Event key
+        """
+
+    @staticmethod
+    def _event_key(notification_type, content):
+        """
+        Key for waking up the waiters of received content
+        :param notification_type: Notification type
+        :param content: Content data
+        :return: Tuple key
+        """
+        if notification_type == "async-responses":
+            return notification_type, content["id"]
+        if notification_type == "notifications":
+            return notification_type, content["ep"], content["path"]
+        return notification_type, content["ep"]
+
+    def _handle_text(self, message):
+        """
+        Decode and handle received message, a malformed or unexpected
+        message is logged and skipped so that it doesn't stop the channel
+        :param message: Message text
+        """
+        try:
+            self._handle_message(json.loads(message))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            log.error(
+                "Failed to handle WebSocket message {}: {!r}".format(
+                    message, e
+                )
+            )
+
+    def _handle_message(self, data):
+        """
+        Handle received message
+        :param data: Message data
+        """
+        if data == {}:
+            log.info("Received message is empty")
+        for notification_type, notification_value in data.items():
+            log.debug("Message contains %s", notification_type)
+            self._handle_content(notification_type, notification_value)
+
+    def _handle_content(self, notification_type, data):
+        """
+        Handle received content
+        :param notification_type: Notification type
+        :param data: Content data
+        """
+        for content in data:
+            date_now = datetime.datetime.utcnow().isoformat("T") + "Z"
+            # De-registrations is plain list, need to convert it to dict. Otherwise just add timestamp
+            if notification_type in (
+                "de-registrations",
+                "registrations-expired",
+            ):
+                content = {"dt": date_now, "ep": content}
+            else:
+                content["dt"] = date_now
+            decode_payload(content)
+            # Async-responses are saved by response, others are pushed to list
+            if notification_type == "async-responses":
+                self.async_responses[content["id"]] = content
+                self._handle_backfill_response(content)
+            else:
+                self.events[notification_type].append(content)
+            self._wake_waiters(self._event_key(notification_type, content))
+
+    def _handle_backfill_response(self, content):
+        """
+        Store the value of backfill resource read as notification
+        :param content: Async response
+        """
+        with self._backfill_lock:
+            backfill = self._backfill_requests.pop(content["id"], None)
+        if backfill:
+            self._store_backfill(backfill, content)
+
+    def _store_backfill(self, backfill, content):
+        """
+        Store successful async response of backfill read as notification
+        :param backfill: Tuple of device id and resource path
+        :param content: Async response
+        """
+        if content.get("status") == 200:
+            self._handle_content(
+                "notifications",
+                [
+                    {
+                        "ep": backfill[0],
+                        "path": backfill[1],
+                        "payload": content.get("payload", ""),
+                        "backfilled": True,
+                    }
+                ],
+            )
+
+
+class WebSocketRunner(BaseWebSocketRunner):
     """
     Class for handling WebSocket connection and storing data from notification service
     :param api: string URL for WebSocket connection endpoint
     :param api_key: string
+    :param retention: dict of notification type -> RetentionPolicy, e.g.
+                      {"notifications": RetentionPolicy(max_entries=10000)}
+    :param backfill: Function (device_id, resource_path) -> REST response
+                     for reading resource values missed during a channel gap
     """
 
-    def __init__(self, api, api_key):
-        self.async_responses = {}
-        self.events = {
-            "registrations": [],
-            "notifications": [],
-            "reg-updates": [],
-            "de-registrations": [],
-            "registrations-expired": [],
-        }
+    def __init__(self, api, api_key, retention=None, backfill=None):
+        super(WebSocketRunner, self).__init__(retention, backfill)
         self.run = True
         self.exit = False
         self.message_queue = queue.Queue()
+        self._ws = None
+        self._stop = threading.Event()
 
         _it = threading.Thread(
             target=self._input_thread,
@@ -304,8 +924,9 @@ class WebSocketRunner:
             target=self._handle_thread,
             name="messages_{}".format(build_random_string(3)),
         )
-        _it.setDaemon(True)
-        _ht.setDaemon(True)
+        _it.daemon = True
+        _ht.daemon = True
+        self._threads = [_it, _ht]
         log.info("Starting WebSocket threads")
         _it.start()
         _ht.start()
@@ -318,23 +939,27 @@ class WebSocketRunner:
         """
         while self.run:
             try:
-                ws = CallbackClient(
+                self._ws = CallbackClient(
                     self.message_queue,
                     api,
                     protocols=["wss", "pelion_{}".format(api_key)],
+                    on_opened=self._on_connected,
                 )
                 log.debug("Connecting WebSocket")
-                ws.connect()
+                self._ws.connect()
                 log.debug("Run forever WebSocket handler")
-                ws.run_forever()
+                self._ws.run_forever()
                 if self.exit:
                     log.info("WebSocket handler exited")
                 else:
                     log.error("WebSocket handler exited")
-            except (WebSocketException, RuntimeError) as e:
+            except (WebSocketException, RuntimeError, OSError) as e:
                 log.warning("WebSocket failed, retrying! {}".format(e))
-                sleep(1)
-            sleep(1)
+            self._on_disconnected()
+            if self.run:
+                delay = self._next_reconnect_delay()
+                log.debug("Reconnecting WebSocket in {:.2f} s".format(delay))
+                self._stop.wait(delay)
         log.info("WebSocket input thread was stopped.")
 
     def _handle_thread(self):
@@ -343,41 +968,99 @@ class WebSocketRunner:
         """
         while self.run:
             data = self.message_queue.get()
-            if data == {}:
-                log.info("Received message is empty")
-            for notification_type, notification_value in data.items():
-                log.debug("Message contains %s", notification_type)
-                self._handle_content(notification_type, notification_value)
+            if data is _STOP:
+                break
+            self._handle_text(data)
+        log.info("WebSocket handle thread was stopped.")
 
-    def close(self):
+    def close(self, timeout=5):
         """
-        Close WebSocket threads
+        Close WebSocket connection and wait for the threads to stop
+        :param timeout: Maximum time in seconds to wait for the threads
         """
         log.info("Closing WebSocket threads")
         self.exit = True
         self.run = False
+        self._stop.set()
+        self.message_queue.put(_STOP)
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except (WebSocketException, RuntimeError, OSError) as e:
+                log.debug("WebSocket close failed: {}".format(e))
+        deadline = monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - monotonic(), 0))
+        if ws is not None and self._threads[0].is_alive():
+            # Server did not answer to close, drop the connection
+            ws.close_connection()
+            self._threads[0].join(max(deadline - monotonic(), 0))
+        alive = [thread.name for thread in self._threads if thread.is_alive()]
+        if alive:
+            log.warning(
+                "WebSocket threads {} did not stop in {} s".format(
+                    alive, timeout
+                )
+            )
 
-    def _handle_content(self, notification_type, data):
+    def wait_for(self, keys, check, timeout):
         """
-        Handle received content
-        :param notification_type: Notification type
-        :param data: Content data
+        Wait until check returns a result, waking up whenever an event
+        with one of the given keys is received
+        :param keys: List of event keys, see _event_key()
+        :param check: Function returning the wanted data or False/None
+        :param timeout: Timeout in seconds
+        :return: Result of check or False on timeout
         """
-        for content in data:
-            date_now = datetime.datetime.utcnow().isoformat("T") + "Z"
-            # De-registrations is plain list, need to convert it to dict. Otherwise just add timestamp
-            if notification_type in (
-                "de-registrations",
-                "registrations-expired",
-            ):
-                content = {"dt": date_now, "ep": content}
-            else:
-                content["dt"] = date_now
-            # Async-responses are saved by response, others are pushed to list
-            if notification_type == "async-responses":
-                self.async_responses[content["id"]] = content
-            else:
-                self.events[notification_type].append(content)
+        started = monotonic()
+        deadline = started + timeout
+        waiter = threading.Event()
+        with self._waiters_lock:
+            for key in keys:
+                self._waiters.setdefault(key, []).append(waiter)
+        try:
+            while True:
+                result = check()
+                if result:
+                    return result
+                now = monotonic()
+                remaining = deadline - now
+                with self._waiters_lock:
+                    gapped = self._gap_for(keys, started)
+                if gapped:
+                    if now >= gapped[1]:
+                        raise self._gap_error(keys, gapped[0])
+                    remaining = min(remaining, gapped[1] - now)
+                if now >= deadline:
+                    return False
+                waiter.wait(remaining)
+                waiter.clear()
+        finally:
+            with self._waiters_lock:
+                for key in keys:
+                    key_waiters = self._waiters.get(key, [])
+                    if waiter in key_waiters:
+                        key_waiters.remove(waiter)
+                    if not key_waiters:
+                        self._waiters.pop(key, None)
+                        self._gapped.pop(key, None)
+
+    def _call_in_runner(self, func, *args):
+        """
+        Call function with the waiters locked
+        """
+        with self._waiters_lock:
+            func(*args)
+
+    def _wake_waiters(self, key):
+        """
+        Wake up the waiters of given event key
+        :param key: Event key
+        """
+        with self._waiters_lock:
+            for waiter in self._waiters.get(key, []):
+                waiter.set()
 
 
 class CallbackClient(WebSocketClient):
@@ -385,16 +1068,19 @@ class CallbackClient(WebSocketClient):
     WebSocket callback client class
     """
 
-    def __init__(self, messaqe_queue, api, protocols):
+    def __init__(self, messaqe_queue, api, protocols, on_opened=None):
         super(CallbackClient, self).__init__(api, protocols=protocols)
         self.message_queue = messaqe_queue
         self.api = api
+        self.on_opened = on_opened
 
     def opened(self):
         """
         WebSocket opened logging
         """
         log.info("WebSocket opened to {}".format(self.api))
+        if self.on_opened:
+            self.on_opened()
 
     def closed(self, code, reason=None):
         """
@@ -411,4 +1097,4 @@ class CallbackClient(WebSocketClient):
         WebSocket message received
         """
         log.debug("WebSocket Received: {}".format(message))
-        self.message_queue.put(json.loads(str(message)))
+        self.message_queue.put(str(message))
@@ -0,0 +1,187 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+from time import perf_counter, time
+from client_test_lib.helpers.websocket_handler import event_time
+import client_test_lib.tools.utils as utils
+
+log = logging.getLogger(__name__)
+
+# Typical trace level client output with colors and carriage returns
+SAMPLE_OUTPUT_LINES = [
+    b"\x1b[2m[DBG ][mClt]: M2MNsdlInterface::send_update_registration()"
+    b"\x1b[0m\r\n",
+    b"\x1b[32m[INFO][mClt]: Client registered\x1b[0m\r\n",
+    b"\x1b[2m[DBG ][COAP]: sn_coap_protocol_exec\tmessage id 4711\x1b[0m\n",
+    b"Device Id: 0179c8d1a1d40a580a01431100000000\r\n",
+    b"progress 10%\rprogress 50%\rprogress 100%\r\n",
+    b"\x1b[31m[ERR ][mClt]: Error occurred: ERROR_TIMEOUT\x1b[0m\r\n",
+]
+
+
+def line_normalizer_throughput(lines=None, rounds=20000):
+    """
+    Measure per-line throughput of the client output line normalizer
+    :param lines: Raw output lines (bytes), defaults to sample trace output
+    :param rounds: How many times the lines are normalized
+    :return: dict with processed lines, bytes, seconds and rates
+    """
+    if lines is None:
+        lines = SAMPLE_OUTPUT_LINES
+    line_count = len(lines) * rounds
+    byte_count = sum(len(line) for line in lines) * rounds
+    start = perf_counter()
+    for _ in range(rounds):
+        for line in lines:
+            utils.normalize_line(line)
+    elapsed = perf_counter() - start
+    result = {
+        "lines": line_count,
+        "bytes": byte_count,
+        "seconds": elapsed,
+        "lines_per_second": line_count / elapsed,
+        "bytes_per_second": byte_count / elapsed,
+    }
+    log.info(
+        "Line normalizer: {:.0f} lines/s, {:.1f} MB/s".format(
+            result["lines_per_second"], result["bytes_per_second"] / 1e6
+        )
+    )
+    return result
+
+
+class RegistrationBenchmark:
+    """
+    Measures device registration latency: time from process start or reset
+    to the client's "Client registered" output line, and to the WebSocket
+    registrations event of the device
+    :param websocket: WebSocketHandler for the registration events
+    :param timeout: Registration timeout in seconds for one measurement
+    """
+
+    def __init__(self, websocket, timeout=300):
+        self.websocket = websocket
+        self.timeout = timeout
+        self.samples = []
+
+    def measure(self, cli, started, run=0):
+        """
+        Measure one registration, the client must be started or reset at
+        the given time
+        :param cli: Client
+        :param started: Wall clock time of the process start or reset
+        :param run: Run number of the sample
+        :return: Sample dict, latencies are None if not registered in time
+        """
+        sample = {
+            "client": cli.name,
+            "device_id": None,
+            "run": run,
+            "client_registered": None,
+            "cloud_registered": None,
+        }
+        self.samples.append(sample)
+        cursor = cli.history.cursor_from_time(started)
+        line = cli.wait_for_output(
+            "Client registered",
+            max(round(started + self.timeout - time(), 1), 0),
+            assert_errors=False,
+            cursor=cursor,
+        )
+        if line is None:
+            return sample
+        sample["client_registered"] = cursor.timestamp - started
+        sample["device_id"] = cli.endpoint_id()
+        remaining = max(round(started + self.timeout - time(), 1), 0)
+        event = self.websocket.wait_for_registration(
+            sample["device_id"], remaining, since=started
+        )
+        if event:
+            sample["cloud_registered"] = event_time(event) - started
+        log.debug("Registration sample: {}".format(sample))
+        return sample
+
+    def measure_reset(self, clients, run=0, max_workers=32):
+        """
+        Reset the clients and measure their registrations in parallel
+        :param clients: List of Client objects
+        :param run: Run number of the samples
+        :param max_workers: Number of parallel measurements
+        :return: List of sample dicts
+        """
+
+        def reset_and_measure(cli):
+            started = time()
+            cli.reset()
+            return self.measure(cli, started, run)
+
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(clients)))
+        ) as executor:
+            return list(executor.map(reset_and_measure, clients))
+
+    def report(self):
+        """
+        Latency statistics over all samples
+        :return: dict of latency name -> count, failed, min, max and
+                 p50/p95/p99 in seconds
+        """
+        report = {}
+        for latency in ("client_registered", "cloud_registered"):
+            values = [
+                sample[latency]
+                for sample in self.samples
+                if sample[latency] is not None
+            ]
+            stats = {
+                "count": len(values),
+                "failed": len(self.samples) - len(values),
+                "min": min(values) if values else None,
+                "max": max(values) if values else None,
+            }
+            stats.update(utils.percentiles(values))
+            report[latency] = stats
+            log.info(
+                "{}: {}/{} samples, p50 {} s, p95 {} s, p99 {} s".format(
+                    latency,
+                    stats["count"],
+                    len(self.samples),
+                    stats["p50"],
+                    stats["p95"],
+                    stats["p99"],
+                )
+            )
+        return report
+
+    def save(self, path, info=None):
+        """
+        Write the report and samples to a JSON file for comparing builds
+        :param path: Output file path
+        :param info: Optional dict of extra information, e.g. build version
+        :return: Written dict
+        """
+        result = {
+            "created": datetime.datetime.utcnow().isoformat("T") + "Z",
+            "info": info or {},
+            "report": self.report(),
+            "samples": self.samples,
+        }
+        with open(path, "w") as output_file:
+            json.dump(result, output_file, indent=2)
+        log.info("Registration benchmark results written to {}".format(path))
+        return result
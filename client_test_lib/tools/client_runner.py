@@ -13,11 +13,13 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from copy import deepcopy
 import logging
 import queue
+import re
 import threading
-from time import time
+from time import sleep, time
+from client_test_lib.tools.output_history import OutputHistory
+from client_test_lib.tools.output_matcher import OutputMatcher
 import client_test_lib.tools.utils as utils
 
 flog = logging.getLogger("ClientRunner")
@@ -32,6 +34,8 @@ flog.addHandler(fh)
 
 log = logging.getLogger(__name__)
 
+DEVICE_ID_PATTERN = re.compile(r"Device Id:\s*(?P<device_id>\S+)")
+
 
 class Client:
     """
@@ -39,15 +43,33 @@ class Client:
     :param dut: Running client object
     :param trace: Log the raw client output
     :param name: Logging name for the client
+    :param history_size: Number of output lines kept in the output history
+    :param reactor: OutputReactor reading the output of many clients in one
+                    thread, by default the client starts its own input thread.
+                    The connection must provide fileno() to use the reactor.
     """
 
-    def __init__(self, dut, trace=False, name="0"):
+    def __init__(
+        self, dut, trace=False, name="0", history_size=10000, reactor=None
+    ):
         self._ep_id = None
         self.name = name
         self.trace = trace
         self.run = True
-        self.iq = queue.Queue()
+        self.history = OutputHistory(history_size)
+        self._cursor = self.history.cursor_from_start()
         self.dut = dut
+        if reactor is not None and not hasattr(dut, "fileno"):
+            raise ValueError(
+                'Client "D{}" connection {} has no fileno() for the '
+                "reactor".format(name, type(dut).__name__)
+            )
+        self._reactor = reactor
+
+        if self._reactor is not None:
+            log.info('Reading client "D{}" via reactor'.format(self.name))
+            self._reactor.register(self.dut, self._handle_line)
+            return
 
         input_thread_name = "<-- D{}".format(name)
         it = threading.Thread(
@@ -64,35 +86,43 @@ class Client:
         while self.run:
             line = self.dut.readline()
             if line:
-                plain_line = utils.strip_escape(line)
-                if b"\r" in line and line.count(b"\r") > 1:
-                    plain_line = plain_line.split(b"\r")[-2]
-                plain_line = plain_line.replace(b"\t", b"  ").decode(
-                    "utf-8", "replace"
-                )
-                flog.info("<--|D{}| {}".format(self.name, plain_line.strip()))
-                if self.trace:
-                    log.debug("Raw output: {}".format(line))
-                if b"Error" in line:
-                    log.error("Output: {}".format(line))
-                self.iq.put(plain_line)
+                self._handle_line(line)
             else:
-                pass
+                # no output or end of stream, don't spin the CPU
+                sleep(0.05)
+
+    def _handle_line(self, line):
+        """
+        Normalize, log and store one raw output line
+        :param line: Raw output line
+        """
+        if not self.run:
+            return
+        plain_line = utils.normalize_line(line)
+        flog.info("<--|D{}| {}".format(self.name, plain_line.strip()))
+        if self.trace:
+            log.debug("Raw output: {}".format(line))
+        if b"Error" in line:
+            log.error("Output: {}".format(line))
+        self.history.append(plain_line)
 
-    def _read_line(self, timeout):
+    def _read_line(self, timeout, cursor=None):
         """
-        Read data from input queue
+        Read next line from output history
         :param timeout: Timeout
-        :return: Data from queue
+        :param cursor: OutputCursor to read from, defaults to client's cursor
+        :return: Output line
         """
-        return self.iq.get(timeout=timeout)
+        if cursor is None:
+            cursor = self._cursor
+        return cursor.read(timeout)
 
     def clear_input(self):
         """
-        Clear input queue messages
+        Skip the output received so far, the lines are kept in the output
+        history for cursors reading it
         """
-        with self.iq.mutex:
-            self.iq.queue.clear()
+        self._cursor = self.history.cursor_from_now()
 
     def kill(self):
         """
@@ -100,25 +130,34 @@ class Client:
         """
         log.debug('Killing client "D{}" runner...'.format(self.name))
         self.run = False
+        if self._reactor is not None:
+            self._reactor.unregister(self.dut)
 
     def reset(self):
         """
         Send reset to client
         """
+        self.history.mark_reset()
         self.dut.reset()
+        if self._reactor is not None:
+            # local process restart opens new output pipes
+            self._reactor.register(self.dut, self._handle_line)
 
     def endpoint_id(self, wait_for_response=10):
         """
-        Get endpoint id from client
+        Get endpoint id from client, the output since the last reset is
+        scanned so the id line can precede other awaited lines
         :param wait_for_response: Timeout waiting the response
         :return: Endpoint id
         """
         if self._ep_id is None:
-            ep_id = self.wait_for_output("Device Id:", wait_for_response)
-            if ep_id is not None:
-                ep_array = ep_id.split()
-                if len(ep_array) > 1:
-                    self._ep_id = ep_array[2]
+            match = self.wait_for_match(
+                {"device_id": DEVICE_ID_PATTERN},
+                wait_for_response,
+                cursor=self.history.cursor_from_reset(),
+            )
+            if match is not None:
+                self._ep_id = match.fields["device_id"]
         return self._ep_id
 
     def wait_for_output(
@@ -128,6 +167,7 @@ class Client:
         assert_errors=True,
         ignore_case=True,
         errors=None,
+        cursor=None,
     ):
         """
         Wait for expected output response
@@ -136,61 +176,81 @@ class Client:
         :param assert_errors: Assert on error situations
         :param ignore_case: Ignore client output's casing
         :param errors: String(s) that should cause error
+        :param cursor: OutputCursor to scan, e.g. history.cursor_from_reset(),
+                       defaults to client's own cursor
         :return: Response line with expected string or None if either line containing
                  one of the errors strings was found or timeout was reached (and assert_errors was False)
         """
-
-        if errors is None:
-            errors = []
-        elif isinstance(errors, str):
-            errors = [errors]
-
+        matcher = OutputMatcher({search: search}, errors, ignore_case)
+        match = self._do_wait_for_output(
+            matcher, timeout, assert_errors, cursor
+        )
+        if match is None:
+            return None
         if ignore_case:
-            search = search.lower()
-            errors = deepcopy(errors)
-            for i, error in enumerate(errors):
-                errors[i] = error.lower()
+            return match.line.lower()
+        return match.line
 
+    def wait_for_match(
+        self,
+        patterns,
+        timeout=60,
+        assert_errors=True,
+        ignore_case=True,
+        errors=None,
+        cursor=None,
+    ):
+        """
+        Wait for any of the expected patterns
+        :param patterns: dict of name -> string or compiled regex, e.g.
+                         {"registered": "Client registered",
+                          "device_id": re.compile(r"Device Id: (?P<id>\S+)")}
+        :param timeout: Response waiting time
+        :param assert_errors: Assert on error situations
+        :param ignore_case: Ignore client output's casing
+        :param errors: dict of name -> pattern or string(s) that should cause error
+        :param cursor: OutputCursor to scan, defaults to client's own cursor
+        :return: OutputMatch telling the matched pattern name and its named
+                 groups as fields, or None if error pattern was found or
+                 timeout was reached (and assert_errors was False)
+        """
+        matcher = OutputMatcher(patterns, errors, ignore_case)
         return self._do_wait_for_output(
-            search, errors, timeout, assert_errors, ignore_case
+            matcher, timeout, assert_errors, cursor
         )
 
-    def _do_wait_for_output(
-        self, search, errors, timeout, assert_errors, ignore_case
-    ):
+    def _do_wait_for_output(self, matcher, timeout, assert_errors, cursor):
         start = time()
         now = 0
         time_to_wait = timeout
+        search = " or ".join(
+            '"{}"'.format(getattr(pattern, "pattern", pattern))
+            for pattern in matcher.patterns.values()
+        )
         timeout_error_msg = "Didn't find {} in {} s".format(
             search, time_to_wait
         )
 
         while True:
             try:
-                line = self._read_line(1)
+                line = self._read_line(1, cursor)
                 if line:
-                    if ignore_case:
-                        line = line.lower()
-                    if search in line:
-                        end = time()
+                    match = matcher.match(line)
+                    if match is None:
+                        continue
+                    end = time()
+                    if not match.is_error:
                         log.debug(
                             'Expected string "{}" found! [time][{:.4f} s]'.format(
-                                search, end - start
+                                match.name, end - start
                             )
                         )
-                        return line
-                    for error in errors:
-                        if error in line:
-                            end = time()
-                            log.debug(
-                                'Expected error string "{}" found! [time][{:.4f} s]'.format(
-                                    error, end - start
-                                )
-                            )
-                            break
-                    else:
-                        continue
-
+                        return match
+                    log.debug(
+                        'Expected error string "{}" found! [time][{:.4f} s]'.format(
+                            match.name, end - start
+                        )
+                    )
                     if assert_errors:
                         assert (
                             False
@@ -208,7 +268,7 @@ class Client:
                             break
                     if now - last > 1:
                         log.debug(
-                            'Waiting for "{}" string... Timeout in {:.0f} s'.format(
+                            "Waiting for {} string... Timeout in {:.0f} s".format(
                                 search, abs(now - start - timeout)
                             )
                         )
@@ -223,7 +283,8 @@ class Client:
                         break
                 if now - last > 1:
                     log.debug(
-                        'Waiting for "{}" string... Timeout in {:.0f} s'.format(
+                        "Waiting for {} string... Timeout in {:.0f} s".format(
                             search, abs(now - start - timeout)
                         )
                     )
+        return None
@@ -0,0 +1,303 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Delta tool helper
+Prerequisites: manifest-tool package providing manifest-delta-tool is
+installed
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+from time import monotonic
+import uuid
+import client_test_lib.tools.manifest_tool as manifest_tool
+from client_test_lib.tools.utils import file_sha256
+
+log = logging.getLogger(__name__)
+
+MANIFEST_DELTA_TOOL = "manifest-delta-tool"
+DELTA_FILE = "delta.bin"
+# cache entry metadata, must not clash with the files of delta-tool
+STATS_FILE = "cache-entry.json"
+# delta-tool writes the manifest input next to the delta file
+DELTA_MANIFEST_EXTENSIONS = (".yaml", ".json")
+
+
+def _delta_manifest_file(delta_file):
+    """
+    Find the manifest input file generated by delta-tool
+    :param delta_file: Path to delta file
+    :return: Path to the manifest input file or None
+    """
+    base = os.path.splitext(delta_file)[0]
+    for extension in DELTA_MANIFEST_EXTENSIONS:
+        if os.path.isfile(base + extension):
+            return base + extension
+    return None
+
+
+def create_delta(old_image_path, new_image_path, output):
+    """
+    Create a bsdiff-stream delta between two images with manifest-delta-tool
+    :param old_image_path: Path to image installed on the device
+    :param new_image_path: Path to update image
+    :param output: Path to delta file
+    :return: dict with delta and delta_manifest paths, image and delta sizes
+             and generation time in seconds, None if delta was not created
+    """
+    cmd = [
+        MANIFEST_DELTA_TOOL,
+        "-c",
+        os.path.abspath(old_image_path),
+        "-n",
+        os.path.abspath(new_image_path),
+        "-o",
+        os.path.abspath(output),
+    ]
+    log.debug(cmd)
+    started = monotonic()
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    seconds = monotonic() - started
+    if stdout:
+        log.debug(stdout)
+    if stderr:
+        log.warning(stderr)
+    delta_manifest = _delta_manifest_file(output)
+    if (
+        p.returncode
+        or not os.path.isfile(output)
+        or os.path.getsize(output) <= 0
+        or delta_manifest is None
+    ):
+        log.error(
+            "{} failed for {} -> {}".format(
+                MANIFEST_DELTA_TOOL, old_image_path, new_image_path
+            )
+        )
+        return None
+    return {
+        "delta": os.path.abspath(output),
+        "delta_manifest": os.path.abspath(delta_manifest),
+        "old_size": os.path.getsize(old_image_path),
+        "new_size": os.path.getsize(new_image_path),
+        "delta_size": os.path.getsize(output),
+        "seconds": seconds,
+    }
+
+
+def _build_delta(old_image_path, new_image_path, entry_dir):
+    """
+    Create delta into a temporary directory and move it to the cache, so
+    that interrupted runs don't leave partial cache entries
+    :return: Delta info from create_delta() or None
+    """
+    tmp_dir = "{}.{}.tmp".format(entry_dir, uuid.uuid4().hex)
+    os.makedirs(tmp_dir)
+    try:
+        delta = create_delta(
+            old_image_path,
+            new_image_path,
+            os.path.join(tmp_dir, DELTA_FILE),
+        )
+        if delta is None:
+            return None
+        delta_manifest = os.path.basename(delta["delta_manifest"])
+        with open(os.path.join(tmp_dir, STATS_FILE), "w") as f:
+            json.dump(
+                {
+                    "delta_manifest": delta_manifest,
+                    "old_size": delta["old_size"],
+                    "new_size": delta["new_size"],
+                    "delta_size": delta["delta_size"],
+                    "seconds": delta["seconds"],
+                },
+                f,
+            )
+        _replace_entry(tmp_dir, entry_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return _load_entry(entry_dir)
+
+
+def _replace_entry(tmp_dir, entry_dir):
+    """
+    Move built delta to the cache. A valid entry built concurrently by
+    another run is kept, a partial or corrupt entry is replaced.
+    :param tmp_dir: Directory of the built delta
+    :param entry_dir: Cache entry directory
+    """
+    try:
+        os.rename(tmp_dir, entry_dir)
+        return
+    except OSError:
+        if _load_entry(entry_dir) is not None:
+            return
+    log.warning("Replacing invalid cached delta {}".format(entry_dir))
+    old_dir = "{}.{}.old".format(entry_dir, uuid.uuid4().hex)
+    try:
+        os.rename(entry_dir, old_dir)
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        log.warning("Failed to replace cached delta: {}".format(e))
+    finally:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def _load_entry(entry_dir):
+    """
+    Load cached delta
+    :param entry_dir: Cache entry directory
+    :return: Delta info as from create_delta() or None if not cached or the
+             entry is partial or corrupt
+    """
+    try:
+        with open(os.path.join(entry_dir, STATS_FILE)) as f:
+            stats = json.load(f)
+        delta = os.path.join(entry_dir, DELTA_FILE)
+        delta_manifest = os.path.join(entry_dir, stats.pop("delta_manifest"))
+        if (
+            not os.path.isfile(delta_manifest)
+            or os.path.getsize(delta) != stats["delta_size"]
+        ):
+            return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+    stats.update({"delta": delta, "delta_manifest": delta_manifest})
+    return stats
+
+
+class DeltaCache:
+    """
+    Builds delta images for (old, new) image pairs in a process pool and
+    caches them on disk by the SHA-256 of both images, so the same upgrade
+    path is generated only once across test runs.
+    :param cache_dir: Directory of the cached deltas
+    :param max_workers: Number of parallel delta builds, CPU count by default
+    """
+
+    def __init__(self, cache_dir, max_workers=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_workers = max_workers
+        self.results = []
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, old_image_path, new_image_path):
+        """
+        :return: Cache entry directory of the image pair
+        """
+        return os.path.join(
+            self.cache_dir,
+            "{}-{}".format(
+                file_sha256(old_image_path), file_sha256(new_image_path)
+            ),
+        )
+
+    def deltas(self, pairs):
+        """
+        Get deltas for image pairs, missing deltas are built in parallel
+        :param pairs: List of (old image path, new image path) tuples
+        :return: List of delta info dicts as from create_delta() with old,
+                 new, cached and savings fields, None for failed pairs
+        """
+        entries = [self._entry_dir(old, new) for old, new in pairs]
+        deltas = [_load_entry(entry_dir) for entry_dir in entries]
+        missing = [i for i, delta in enumerate(deltas) if delta is None]
+        log.info(
+            "Deltas for {} image pairs, {} cached".format(
+                len(pairs), len(pairs) - len(missing)
+            )
+        )
+        if missing:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            ) as executor:
+                futures = {}
+                for i in missing:
+                    if entries[i] not in futures:
+                        futures[entries[i]] = executor.submit(
+                            _build_delta, pairs[i][0], pairs[i][1], entries[i]
+                        )
+                for i in missing:
+                    deltas[i] = futures[entries[i]].result()
+        results = []
+        for i, ((old, new), delta) in enumerate(zip(pairs, deltas)):
+            if delta is not None:
+                delta.update(
+                    {
+                        "old": old,
+                        "new": new,
+                        "cached": i not in missing,
+                        "savings": (
+                            1 - delta["delta_size"] / delta["new_size"]
+                            if delta["new_size"]
+                            else 0
+                        ),
+                    }
+                )
+            results.append(delta)
+        self.results.extend(delta for delta in results if delta)
+        return results
+
+    def delta(self, old_image_path, new_image_path):
+        """
+        Get delta for one image pair
+        :param old_image_path: Path to image installed on the device
+        :param new_image_path: Path to update image
+        :return: Delta info dict, see deltas()
+        """
+        return self.deltas([(old_image_path, new_image_path)])[0]
+
+    def report(self):
+        """
+        Log size savings and generation time of the deltas
+        :return: List of delta info dicts
+        """
+        for delta in self.results:
+            log.info(
+                "Delta {} -> {}: {} / {} bytes, {:.1f} % saved, "
+                "generated in {:.2f} s{}".format(
+                    os.path.basename(delta["old"]),
+                    os.path.basename(delta["new"]),
+                    delta["delta_size"],
+                    delta["new_size"],
+                    delta["savings"] * 100,
+                    delta["seconds"],
+                    " (cached)" if delta["cached"] else "",
+                )
+            )
+        return self.results
+
+
+def create_delta_manifest(path, firmware_url, delta, manifest_version="v1"):
+    """
+    Create a manifest for an uploaded delta image
+    :param path: Manifest-tool path
+    :param firmware_url: URL to the uploaded delta image
+    :param delta: Delta info dict from DeltaCache or create_delta()
+    :param manifest_version: Version for created manifest, either 'v1' or 'v3'
+    :return: Path to a manifest file on success. Otherwise None.
+    """
+    return manifest_tool.create_manifest(
+        path,
+        firmware_url,
+        delta["delta"],
+        delta_manifest=delta["delta_manifest"],
+        manifest_version=manifest_version,
+    )
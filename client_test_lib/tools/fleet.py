@@ -0,0 +1,188 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+from time import time
+from client_test_lib.tools.client_runner import Client
+from client_test_lib.tools.local_conn import LocalConnection
+from client_test_lib.tools.reactor import OutputReactor
+from client_test_lib.tools.utils import percentiles
+
+log = logging.getLogger(__name__)
+
+REGISTERED_OUTPUT = "Client registered"
+
+
+class ClientFleet:
+    """
+    Runs many local client binaries in parallel, each in its own working
+    directory so that every client has its own storage. Output of all the
+    clients is read by one OutputReactor thread.
+    :param command: Command to start the local binary
+    :param size: Number of clients
+    :param work_dir: Directory for the client-<n> working directories
+    :param use_stderr: Use stderr output instead of stdout
+    :param reactor: OutputReactor to use, by default fleet has its own
+    """
+
+    def __init__(
+        self, command, size, work_dir, use_stderr=False, reactor=None
+    ):
+        if isinstance(command, str) and os.path.exists(command):
+            # relative binary path would be resolved from client's cwd
+            command = os.path.abspath(command)
+        self.command = command
+        self.size = size
+        self.work_dir = work_dir
+        self.use_stderr = use_stderr
+        self._own_reactor = reactor is None
+        self.reactor = OutputReactor() if reactor is None else reactor
+        self.clients = []
+        self.connections = []
+        self.start_times = []
+        self.registration_times = {}
+        self._cursors = []
+
+    def _start_client(self, index):
+        """
+        Start one client process in its own working directory
+        :param index: Client index
+        :return: Tuple of start time, LocalConnection and Client
+        """
+        cwd = os.path.join(self.work_dir, "client-{}".format(index))
+        os.makedirs(cwd, exist_ok=True)
+        started = time()
+        conn = LocalConnection(self.command, self.use_stderr, cwd=cwd)
+        cli = Client(conn, name=str(index), reactor=self.reactor)
+        return started, conn, cli
+
+    def start(self, max_workers=16):
+        """
+        Start the client processes concurrently
+        :param max_workers: Number of processes started in parallel
+        :return: List of Client objects
+        """
+        log.info(
+            'Starting fleet of {} clients: "{}"'.format(
+                self.size, self.command
+            )
+        )
+        indexes = range(len(self.clients), self.size)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for started, conn, cli in executor.map(
+                self._start_client, indexes
+            ):
+                self.start_times.append(started)
+                self.connections.append(conn)
+                self.clients.append(cli)
+                self._cursors.append(cli.history.cursor_from_start())
+        return self.clients
+
+    def _wait_for_registration(self, index, deadline):
+        """
+        Wait for one client to register
+        :param index: Client index
+        :param deadline: Wall clock deadline
+        :return: Time to register in seconds or None
+        """
+        cursor = self._cursors[index]
+        line = self.clients[index].wait_for_output(
+            REGISTERED_OUTPUT,
+            max(round(deadline - time(), 1), 0),
+            assert_errors=False,
+            cursor=cursor,
+        )
+        if line is None:
+            return None
+        return cursor.timestamp - self.start_times[index]
+
+    def wait_for_registration(
+        self, timeout=300, assert_errors=True, max_workers=32
+    ):
+        """
+        Wait for all clients to register in parallel
+        :param timeout: Timeout in seconds for the whole fleet
+        :param assert_errors: Fail the test case if some client didn't register
+        :param max_workers: Number of parallel waits
+        :return: dict of registration statistics, see registration_stats()
+        """
+        deadline = time() + timeout
+        pending = [
+            index
+            for index in range(len(self.clients))
+            if index not in self.registration_times
+        ]
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(pending)))
+        ) as executor:
+            results = executor.map(
+                lambda index: self._wait_for_registration(index, deadline),
+                pending,
+            )
+            for index, elapsed in zip(pending, results):
+                if elapsed is not None:
+                    self.registration_times[index] = elapsed
+        stats = self.registration_stats()
+        log.info(
+            "Fleet registered {}/{} clients, time to register "
+            "p50 {} s, p95 {} s, p99 {} s".format(
+                stats["registered"],
+                stats["clients"],
+                stats["p50"],
+                stats["p95"],
+                stats["p99"],
+            )
+        )
+        if stats["failed"]:
+            err_msg = "Clients {} didn't register in {} s".format(
+                ", ".join(stats["failed"]), timeout
+            )
+            if assert_errors:
+                assert False, err_msg
+            log.error(err_msg)
+        return stats
+
+    def registration_stats(self):
+        """
+        Time to register statistics of the fleet
+        :return: dict with client counts, failed client names, min, max and
+                 p50/p95/p99 of time to register in seconds
+        """
+        times = list(self.registration_times.values())
+        stats = {
+            "clients": len(self.clients),
+            "registered": len(times),
+            "failed": [
+                cli.name
+                for index, cli in enumerate(self.clients)
+                if index not in self.registration_times
+            ],
+            "min": min(times) if times else None,
+            "max": max(times) if times else None,
+        }
+        stats.update(percentiles(times))
+        return stats
+
+    def close(self):
+        """
+        Stop the clients and the fleet's reactor
+        """
+        log.info("Closing fleet of {} clients".format(len(self.clients)))
+        for cli, conn in zip(self.clients, self.connections):
+            cli.kill()
+            conn.close()
+        if self._own_reactor:
+            self.reactor.close()
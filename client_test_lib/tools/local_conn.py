@@ -22,12 +22,14 @@ class LocalConnection:
     Connection class for local binary
     :param command: Command to start the local binary
     :param use_stderr: Use stderr output instead of stdout
+    :param cwd: Working directory for the process, e.g. for own storage
     """
 
-    def __init__(self, command, use_stderr=False):
+    def __init__(self, command, use_stderr=False, cwd=None):
         self.process = None
         self.command = command
         self.use_stderr = use_stderr
+        self.cwd = cwd
         self.open()
 
     def open(self):
@@ -37,7 +39,12 @@ class LocalConnection:
         log.info('Starting local process: "{}"'.format(self.command))
         if not self.process:
             self.process = Popen(
-                self.command, stdin=PIPE, stdout=PIPE, stderr=PIPE, bufsize=0
+                self.command,
+                stdin=PIPE,
+                stdout=PIPE,
+                stderr=PIPE,
+                bufsize=0,
+                cwd=self.cwd,
             )
 
     def readline(self):
@@ -49,6 +56,15 @@ class LocalConnection:
             return self.process.stderr.readline()
         return self.process.stdout.readline()
 
+    def fileno(self):
+        """
+        File descriptor of the output stream, for polling the output
+        :return: stdout or stderr file descriptor
+        """
+        if self.use_stderr:
+            return self.process.stderr.fileno()
+        return self.process.stdout.fileno()
+
     def write(self, data):
         """
         Write data to stdin
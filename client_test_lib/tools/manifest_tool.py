@@ -17,9 +17,15 @@ Prerequisites: manifest-tool has been cloned from github
 
 """
 
+import atexit
+from concurrent.futures import Future, ProcessPoolExecutor
+import contextlib
+import io
 import logging
+import multiprocessing
 import subprocess
 import os
+import threading
 import uuid
 
 log = logging.getLogger(__name__)
@@ -29,6 +35,30 @@ MANIFEST_TOOL = "manifest-tool"
 MANIFEST_DEV_TOOL = "manifest-dev-tool"
 UPDATE_DEFAULT_RESOURCES = "update_default_resources.c"
 SETTINGS_FILE = ".manifest_tool.json"
+# manifest-dev-tool entry point loaded by a manifest worker process
+_DEV_TOOL = None
+# worker pools of create_manifest() by manifest-tool path
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _run_command(command, cwd):
+    """
+    Run manifest-tool command in a subprocess and log its output
+    :param command: Command list
+    :param cwd: Working directory
+    :return: Return code
+    """
+    log.debug(command)
+    p = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    stdout, stderr = p.communicate()
+    if stdout:
+        log.debug(stdout)
+    if stderr:
+        log.warning(stderr)
+    return p.returncode
 
 
 def init(working_path, vendor_domain=None, model_name=None):
@@ -54,18 +84,7 @@ def init(working_path, vendor_domain=None, model_name=None):
         "-q",
         "-f",
     ]
-    log.debug(command)
-    p = subprocess.Popen(
-        command,
-        cwd=working_path,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = p.communicate()
-    if stdout:
-        log.debug(stdout)
-    if stderr:
-        log.warning(stderr)
+    _run_command(command, working_path)
     log.debug("{} init - DONE".format(MANIFEST_DEV_TOOL))
     f = os.path.join(os.sep, working_path, UPDATE_DEFAULT_RESOURCES)
     if os.path.isfile(f):
@@ -75,8 +94,7 @@ def init(working_path, vendor_domain=None, model_name=None):
     return None
 
 
-def create_manifest(
-    path,
+def manifest_command(
     firmware_url,
     update_image_path,
     output="output.manifest",
@@ -84,23 +102,14 @@ def create_manifest(
     manifest_version="v1",
 ):
     """
-    Create a manifest file
-    :param path: Manifest-tool path
+    Build the manifest-dev-tool command creating a manifest
     :param firmware_url: URL to firmware image
     :param update_image_path: Path to local update image
     :param output: Manifest file name
     :param delta_manifest: File name of the json input file generated by delta-tool in case of delta update
     :param manifest_version: Version for created manifest, either 'v1' or 'v3'
-    :returns: Path to a manifest file on success. Otherwise None.
-    :raises: OSError if invalid or inaccessible file name or path.
-             ValueError if Popen is called with invalid arguments.
+    :return: Command list, None if the manifest version is not supported
     """
-    log.info("Creating manifest for update campaign with manifest-tool...")
-    log.debug("{} create - START".format(MANIFEST_DEV_TOOL))
-    path = os.path.abspath(path)
-    # remove file if it exists
-    if os.path.isfile(output):
-        os.remove(output)
     if manifest_version == "v1":
         cmd = [
             MANIFEST_DEV_TOOL,
@@ -132,17 +141,16 @@ def create_manifest(
     else:
         cmd.append("-p")
         cmd.append(update_image_path)
-    log.debug(cmd)
-    p = subprocess.Popen(
-        cmd, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    stdout, stderr = p.communicate()
-    if stdout:
-        log.debug(stdout)
-    if stderr:
-        log.warning(stderr)
-    log.debug("{} create - DONE".format(MANIFEST_DEV_TOOL))
-    # return path to manifest file
+    return cmd
+
+
+def _manifest_file(path, output):
+    """
+    Check the created manifest file
+    :param path: Manifest-tool path
+    :param output: Manifest file name
+    :return: Path to a manifest file on success. Otherwise None.
+    """
     f = os.path.join(os.sep, path, output)
     if os.path.isfile(f):
         if os.path.getsize(f) <= 0:
@@ -152,3 +160,269 @@ def create_manifest(
         return os.path.abspath(f)
     log.error("Could not find manifest file")
     return None
+
+
+def create_manifest(
+    path,
+    firmware_url,
+    update_image_path,
+    output=None,
+    delta_manifest=None,
+    manifest_version="v1",
+):
+    """
+    Create a manifest file in the shared manifest worker pool of the path
+    :param path: Manifest-tool path
+    :param firmware_url: URL to firmware image
+    :param update_image_path: Path to local update image
+    :param output: Manifest file name, unique name by default
+    :param delta_manifest: File name of the json input file generated by delta-tool in case of delta update
+    :param manifest_version: Version for created manifest, either 'v1' or 'v3'
+    :returns: Path to a manifest file on success. Otherwise None. The
+              caller removes the file when it is no longer needed.
+    """
+    log.info("Creating manifest for update campaign with manifest-tool...")
+    return (
+        shared_pool(path)
+        .submit(
+            firmware_url,
+            update_image_path,
+            output,
+            delta_manifest,
+            manifest_version,
+        )
+        .result()
+    )
+
+
+def shared_pool(path):
+    """
+    Manifest worker pool shared by all manifests of a manifest-tool path,
+    the pools are stopped at exit
+    :param path: Manifest-tool path
+    :return: ManifestWorkerPool
+    """
+    path = os.path.abspath(path)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(path)
+        if pool is None:
+            if not _POOLS:
+                atexit.register(close_shared_pools)
+            pool = ManifestWorkerPool(path)
+            _POOLS[path] = pool
+    return pool
+
+
+def close_shared_pools():
+    """
+    Stop the worker processes of the shared manifest worker pools
+    """
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _load_dev_tool():
+    """
+    Import manifest-dev-tool entry point of the installed manifest-tool
+    package
+    :return: Entry point function, None if the package is not available
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        from manifesttool.dev_tool.dev_tool import entry_point
+    except ImportError:
+        return None
+    return entry_point
+
+
+def _worker_init(in_process):
+    """
+    Manifest worker process initializer, loads manifest-tool once
+    :param in_process: Run manifest-dev-tool in the worker process
+    """
+    global _DEV_TOOL  # pylint: disable=global-statement
+    _DEV_TOOL = _load_dev_tool() if in_process else None
+
+
+def _create_in_worker(path, cmd, output):
+    """
+    Run manifest-dev-tool command in a worker process
+    :param path: Manifest-tool path
+    :param cmd: Command list from manifest_command()
+    :param output: Manifest file name
+    :return: Path to a manifest file on success. Otherwise None.
+    """
+    log.debug("{} create - START".format(MANIFEST_DEV_TOOL))
+    # remove file if it exists
+    if os.path.isfile(os.path.join(path, output)):
+        os.remove(os.path.join(path, output))
+    if _DEV_TOOL is None:
+        returncode = _run_command(cmd, path)
+    else:
+        # worker processes run one command at a time, so manifest-tool
+        # relative key and config paths can be resolved from the cwd
+        os.chdir(path)
+        try:
+            returncode = _DEV_TOOL(cmd[1:])
+        except SystemExit as e:
+            returncode = e.code
+    log.debug("{} create - DONE".format(MANIFEST_DEV_TOOL))
+    if returncode:
+        log.error(
+            "{} failed with exit code {}".format(MANIFEST_DEV_TOOL, returncode)
+        )
+        return None
+    return _manifest_file(path, output)
+
+
+def _worker_create(path, cmd, output):
+    """
+    Create manifest in a worker process. The logging and the output of
+    manifest-tool are captured and returned for logging in the parent.
+    :param path: Manifest-tool path
+    :param cmd: Command list from manifest_command()
+    :param output: Manifest file name
+    :return: Tuple of path to a manifest file or None on failure, and the
+             captured log and output
+    """
+    buffer = io.StringIO()
+    handler = logging.StreamHandler(buffer)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG)
+    try:
+        with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(
+            buffer
+        ):
+            manifest_file = _create_in_worker(path, cmd, output)
+    except Exception as e:  # pylint: disable=broad-except
+        log.error("{} failed: {!r}".format(MANIFEST_DEV_TOOL, e))
+        manifest_file = None
+    finally:
+        root.removeHandler(handler)
+    return manifest_file, buffer.getvalue()
+
+
+def _worker_done(output, worker_future, future):
+    """
+    Log the captured output of a manifest worker and resolve the manifest
+    future
+    :param output: Manifest file name
+    :param worker_future: Future of _worker_create()
+    :param future: Future of the path to the manifest file or None
+    """
+    try:
+        manifest_file, worker_log = worker_future.result()
+    except Exception as e:  # pylint: disable=broad-except
+        log.error("Manifest worker failed for {}: {!r}".format(output, e))
+        future.set_result(None)
+        return
+    if worker_log:
+        log_level = logging.DEBUG if manifest_file else logging.ERROR
+        log.log(
+            log_level,
+            "{} output for {}:\n{}".format(
+                MANIFEST_DEV_TOOL, output, worker_log.rstrip()
+            ),
+        )
+    future.set_result(manifest_file)
+
+
+class ManifestWorkerPool:
+    """
+    Pool of long-lived worker processes creating manifests in parallel.
+    Workers call the installed manifest-tool package directly, so the
+    interpreter startup and the package import are paid once per worker.
+    A manifest-dev-tool subprocess is used if the package can't be
+    imported. Every manifest gets a unique output file, remove it when it
+    is no longer needed. The log and output of manifest-tool are passed
+    back to the test process and logged there.
+    :param path: Manifest-tool path where manifest-dev-tool init was run
+    :param max_workers: Number of worker processes, CPU count by default
+    :param in_process: Use manifest-tool package in the workers
+    """
+
+    def __init__(self, path, max_workers=None, in_process=True):
+        self.path = os.path.abspath(path)
+        # spawned workers don't inherit the threads of the test process
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_init,
+            initargs=(in_process,),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(
+        self,
+        firmware_url,
+        update_image_path,
+        output=None,
+        delta_manifest=None,
+        manifest_version="v1",
+    ):
+        """
+        Start creating a manifest file
+        :param firmware_url: URL to firmware image
+        :param update_image_path: Path to local update image
+        :param output: Manifest file name, unique name by default
+        :param delta_manifest: File name of the json input file generated by delta-tool in case of delta update
+        :param manifest_version: Version for created manifest, either 'v1' or 'v3'
+        :return: Future of the path to the manifest file or None
+        """
+        if output is None:
+            output = "{}.manifest".format(uuid.uuid4().hex)
+        cmd = manifest_command(
+            firmware_url,
+            update_image_path,
+            output,
+            delta_manifest,
+            manifest_version,
+        )
+        if cmd is None:
+            future = Future()
+            future.set_result(None)
+            return future
+        log.debug("Submitting manifest {}".format(output))
+        future = Future()
+        self._executor.submit(
+            _worker_create, self.path, cmd, output
+        ).add_done_callback(
+            lambda worker_future: _worker_done(output, worker_future, future)
+        )
+        return future
+
+    def create_manifests(self, manifests):
+        """
+        Create many manifest files concurrently
+        :param manifests: List of dicts of submit() arguments
+        :return: List of paths to manifest files, None for failed ones
+        """
+        log.info(
+            "Creating {} manifests with manifest-tool...".format(
+                len(manifests)
+            )
+        )
+        futures = [self.submit(**manifest) for manifest in manifests]
+        files = [future.result() for future in futures]
+        log.info(
+            "Created {}/{} manifests".format(
+                len([f for f in files if f]), len(files)
+            )
+        )
+        return files
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        self._executor.shutdown()
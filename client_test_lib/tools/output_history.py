@@ -0,0 +1,149 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import deque
+import logging
+import queue
+import threading
+from time import monotonic, time
+
+log = logging.getLogger(__name__)
+
+
+class OutputHistory:
+    """
+    Ring buffer of client output lines. Lines are never consumed, every
+    reader scans the history with its own OutputCursor.
+    Each line gets an increasing sequence number, oldest lines are dropped
+    when the history is full.
+    :param maxlen: Maximum number of lines kept
+    """
+
+    def __init__(self, maxlen=10000):
+        self._lines = deque(maxlen=maxlen)
+        self._next_seq = 0
+        self._reset_seq = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._lines)
+
+    @property
+    def first_seq(self):
+        """
+        Sequence number of the oldest line still in the history
+        """
+        return self._next_seq - len(self._lines)
+
+    def append(self, line):
+        """
+        Add line to the history and wake up the waiting readers
+        :param line: Output line
+        """
+        with self._cond:
+            self._lines.append((time(), line))
+            self._next_seq += 1
+            self._cond.notify_all()
+
+    def mark_reset(self):
+        """
+        Mark the current position as the last client reset
+        """
+        with self._cond:
+            self._reset_seq = self._next_seq
+
+    def get(self, seq, timeout):
+        """
+        Get line with given sequence number, wait for it if not yet received
+        :param seq: Sequence number
+        :param timeout: Timeout in seconds
+        :return: Tuple of sequence number, receive time and line. The
+                 sequence number is larger than the requested one if the
+                 line was already dropped from the history.
+        :raises queue.Empty: on timeout
+        """
+        deadline = monotonic() + timeout
+        with self._cond:
+            while seq >= self._next_seq:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self._cond.wait(remaining)
+            first = self.first_seq
+            if seq < first:
+                log.warning(
+                    "{} output lines dropped from history before read".format(
+                        first - seq
+                    )
+                )
+                seq = first
+            return (seq,) + self._lines[seq - first]
+
+    def cursor_from_now(self):
+        """
+        :return: OutputCursor reading lines received from now on
+        """
+        return OutputCursor(self, self._next_seq)
+
+    def cursor_from_start(self):
+        """
+        :return: OutputCursor reading the whole history
+        """
+        return OutputCursor(self, self.first_seq)
+
+    def cursor_from_reset(self):
+        """
+        :return: OutputCursor reading lines received since the last reset
+        """
+        return OutputCursor(self, max(self._reset_seq, self.first_seq))
+
+    def cursor_from_time(self, timestamp):
+        """
+        :param timestamp: Wall clock time as returned by time.time()
+        :return: OutputCursor reading lines received at or after timestamp
+        """
+        with self._cond:
+            low, high = 0, len(self._lines)
+            while low < high:
+                middle = (low + high) // 2
+                if self._lines[middle][0] < timestamp:
+                    low = middle + 1
+                else:
+                    high = middle
+            return OutputCursor(self, self.first_seq + low)
+
+
+class OutputCursor:
+    """
+    Independent read position in OutputHistory
+    :param history: OutputHistory
+    :param seq: Sequence number of the next line to read
+    """
+
+    def __init__(self, history, seq):
+        self.history = history
+        self.seq = seq
+        self.timestamp = None
+
+    def read(self, timeout):
+        """
+        Read the next line and advance the cursor, receive time of the line
+        is stored to timestamp
+        :param timeout: Timeout in seconds
+        :return: Output line
+        :raises queue.Empty: on timeout
+        """
+        seq, self.timestamp, line = self.history.get(self.seq, timeout)
+        self.seq = seq + 1
+        return line
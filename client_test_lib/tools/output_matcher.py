@@ -0,0 +1,151 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+
+_NAMED_GROUP = re.compile(r"\(\?P<(\w+)>")
+_NAMED_BACKREF = re.compile(r"\(\?P=(\w+)\)")
+# global inline flags at the start of a pattern, e.g. "(?i)"
+_INLINE_FLAGS = re.compile(r"^(?:\(\?[aiLmsux]+\))+")
+# flags kept per pattern as a scoped group, e.g. "(?i:...)"
+_SCOPED_FLAGS = (
+    (re.ASCII, "a"),
+    (re.IGNORECASE, "i"),
+    (re.MULTILINE, "m"),
+    (re.DOTALL, "s"),
+    (re.VERBOSE, "x"),
+)
+
+
+class OutputMatch:
+    """
+    Client output line matched by OutputMatcher
+    :param name: Name of the matched pattern
+    :param line: Matched line
+    :param fields: dict of named groups captured by the pattern
+    :param is_error: True if the matched pattern is an error pattern
+    """
+
+    def __init__(self, name, line, fields, is_error=False):
+        self.name = name
+        self.line = line
+        self.fields = fields
+        self.is_error = is_error
+
+    def __repr__(self):
+        return "OutputMatch(name={!r}, fields={!r}, is_error={})".format(
+            self.name, self.fields, self.is_error
+        )
+
+
+class OutputMatcher:
+    """
+    Match client output lines against many patterns with one combined
+    regular expression, so matching cost per line does not grow with the
+    number of patterns.
+    Plain strings are matched as substrings, compiled regular expressions
+    as is. Named groups of the regular expressions are returned as fields.
+    :param patterns: dict of pattern name -> string or compiled regex
+    :param errors: dict of name -> pattern, or list of error strings
+    :param ignore_case: Ignore casing of the output
+    """
+
+    def __init__(self, patterns, errors=None, ignore_case=True):
+        if errors is None:
+            errors = {}
+        elif not isinstance(errors, dict):
+            if isinstance(errors, (str, bytes, re.Pattern)):
+                errors = [errors]
+            errors = {
+                "error_{}".format(i): error for i, error in enumerate(errors)
+            }
+        self.patterns = dict(patterns)
+        self.errors = errors
+        self._alternatives = []
+        sources = []
+        for names, is_error in ((self.patterns, False), (errors, True)):
+            for name, pattern in names.items():
+                group = "_p{}".format(len(self._alternatives))
+                source, fields = self._rename_groups(pattern, group)
+                sources.append("(?P<{}>{})".format(group, source))
+                self._alternatives.append((group, name, fields, is_error))
+        flags = re.IGNORECASE if ignore_case else 0
+        self._groups = {alt[0]: alt for alt in self._alternatives}
+        self._combined = re.compile("|".join(sources), flags)
+        self._success = re.compile(
+            "|".join(sources[: len(self.patterns)]) or "(?!)", flags
+        )
+
+    @staticmethod
+    def _rename_groups(pattern, prefix):
+        """
+        Make named groups of the pattern unique in the combined expression.
+        Flags of a compiled regex, also inline ones like "(?i)", are kept
+        as a scoped flag group that only applies to the pattern.
+        :param pattern: String or compiled regex
+        :param prefix: Unique prefix for the group names
+        :return: Tuple of regex source and dict of field -> group name
+        """
+        if not isinstance(pattern, re.Pattern):
+            return re.escape(pattern), {}
+        fields = {}
+
+        def _rename(match):
+            fields[match.group(1)] = "{}_{}".format(prefix, match.group(1))
+            return "(?P<{}>".format(fields[match.group(1)])
+
+        # inline flags are already in pattern.flags
+        source = _INLINE_FLAGS.sub("", pattern.pattern)
+        source = _NAMED_GROUP.sub(_rename, source)
+        source = _NAMED_BACKREF.sub(
+            lambda match: "(?P={}_{})".format(prefix, match.group(1)), source
+        )
+        letters = "".join(
+            letter for flag, letter in _SCOPED_FLAGS if pattern.flags & flag
+        )
+        if pattern.flags & re.VERBOSE:
+            # end a trailing comment before the group is closed
+            source += "\n"
+        if letters:
+            source = "(?{}:{})".format(letters, source)
+        return source, fields
+
+    def _to_match(self, regex_match, line):
+        group, name, fields, is_error = self._groups[regex_match.lastgroup]
+        return OutputMatch(
+            name,
+            line,
+            {
+                field: regex_match.group(group_name)
+                for field, group_name in fields.items()
+            },
+            is_error,
+        )
+
+    def match(self, line):
+        """
+        Match output line
+        :param line: Output line
+        :return: OutputMatch or None. Expected patterns take precedence
+                 over error patterns found from the same line.
+        """
+        regex_match = self._combined.search(line)
+        if regex_match is None:
+            return None
+        result = self._to_match(regex_match, line)
+        if result.is_error:
+            success_match = self._success.search(line)
+            if success_match is not None:
+                return self._to_match(success_match, line)
+        return result
@@ -0,0 +1,164 @@
+# pylint: disable=broad-except
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import queue
+import selectors
+import threading
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 4096
+
+
+class OutputReactor:
+    """
+    Reads the output of many connections in one thread. Connections are
+    polled with selectors (epoll on Linux), their output is split to lines
+    and every line is passed to the callback given for the connection.
+    Connection must provide fileno() of a pollable file descriptor, this
+    works for LocalConnection pipes and SerialConnection on POSIX systems.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._commands = queue.Queue()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self.run = True
+        self._thread = threading.Thread(
+            target=self._reactor_thread, name="<-- reactor", daemon=True
+        )
+        log.info("Starting output reactor thread")
+        self._thread.start()
+
+    def register(self, conn, callback):
+        """
+        Start reading the connection, replaces an earlier registration
+        of the same file descriptor
+        :param conn: Connection providing fileno()
+        :param callback: Function called with each output line (bytes)
+        """
+        self._command("register", conn.fileno(), callback)
+
+    def unregister(self, conn=None, fd=None):
+        """
+        Stop reading the connection
+        :param conn: Connection providing fileno()
+        :param fd: File descriptor, if the connection is already closed
+        """
+        if fd is None:
+            fd = conn.fileno()
+        self._command("unregister", fd)
+
+    def close(self, timeout=5):
+        """
+        Stop the reactor thread
+        :param timeout: Timeout in seconds for the thread to stop
+        """
+        log.info("Closing output reactor")
+        self.run = False
+        self._command("stop")
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            log.warning("Output reactor thread did not stop")
+            return
+        self._selector.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _command(self, *command):
+        """
+        Pass command to the reactor thread and wake it up
+        """
+        self._commands.put(command)
+        os.write(self._wakeup_w, b"\0")
+
+    def _handle_commands(self):
+        """
+        Apply pending register and unregister commands
+        """
+        try:
+            os.read(self._wakeup_r, READ_SIZE)
+        except BlockingIOError:
+            pass
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if command[0] == "register":
+                _, fd, callback = command
+                self._remove(fd, flush=False)
+                self._selector.register(
+                    fd, selectors.EVENT_READ, [callback, b""]
+                )
+            elif command[0] == "unregister":
+                self._remove(command[1])
+
+    def _remove(self, fd, flush=True):
+        """
+        Stop polling file descriptor
+        :param fd: File descriptor
+        :param flush: Pass the unterminated last line to the callback
+        """
+        try:
+            key = self._selector.unregister(fd)
+        except (KeyError, ValueError):
+            return
+        callback, pending = key.data
+        if flush and pending:
+            callback(pending)
+
+    def _read(self, key):
+        """
+        Read available data and pass the complete lines to the callback
+        :param key: Selector key of a connection
+        """
+        try:
+            data = os.read(key.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            log.debug("Output reactor read error: {}".format(e))
+            data = b""
+        if not data:
+            log.debug("End of output from fd {}".format(key.fd))
+            self._remove(key.fd)
+            return
+        callback = key.data[0]
+        lines = (key.data[1] + data).split(b"\n")
+        key.data[1] = lines.pop()
+        for line in lines:
+            callback(line + b"\n")
+
+    def _reactor_thread(self):
+        """
+        Reactor's polling thread
+        """
+        while self.run:
+            for key, _ in self._selector.select(timeout=1):
+                if key.fd == self._wakeup_r:
+                    self._handle_commands()
+                elif self._selector.get_map().get(key.fd) is key:
+                    try:
+                        self._read(key)
+                    except Exception as e:
+                        log.error(
+                            "Output reactor callback failed: {}".format(e)
+                        )
+        log.info("Output reactor thread was stopped.")
@@ -49,6 +49,13 @@ class SerialConnection:
             log.debug("Serial connection read error: {}".format(e))
             return None
 
+    def fileno(self):
+        """
+        File descriptor of the serial port, for polling the output
+        :return: Serial port file descriptor
+        """
+        return self.ser.fileno()
+
     def write(self, data):
         """
         Write data to serial port
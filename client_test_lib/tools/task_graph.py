@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+from time import monotonic
+
+log = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """
+    Runs named steps in threads as soon as the steps they depend on are
+    done, and records when each step started and finished.
+    :param max_workers: Maximum number of steps running at the same time
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._tasks = {}
+        self.results = {}
+        self.timings = {}
+
+    def add(self, name, func, *deps):
+        """
+        Add step to the graph
+        :param name: Step name
+        :param func: Function called with the results of deps as arguments
+        :param deps: Names of the steps this step depends on
+        """
+        for dep in deps:
+            assert (
+                dep in self._tasks
+            ), 'Unknown dependency "{}" of "{}"'.format(dep, name)
+        self._tasks[name] = (func, deps)
+
+    def run(self):
+        """
+        Run all steps, a failed step stops scheduling of new steps and its
+        exception is raised when the running steps have finished
+        :return: dict of step name -> result
+        """
+        started = monotonic()
+        pending = dict(self._tasks)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, (func, deps) in list(pending.items()):
+                        if all(dep in self.results for dep in deps):
+                            del pending[name]
+                            running[
+                                executor.submit(
+                                    self._run_step, name, func, deps, started
+                                )
+                            ] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:  # pylint: disable=broad-except
+                        log.error('Step "{}" failed: {}'.format(name, e))
+                        if error is None:
+                            error = e
+        self.report()
+        if error is not None:
+            raise error
+        return self.results
+
+    def _run_step(self, name, func, deps, started):
+        """
+        Run one step and record its timing relative to the graph start
+        """
+        start = monotonic() - started
+        try:
+            return func(*[self.results[dep] for dep in deps])
+        finally:
+            self.timings[name] = (start, monotonic() - started)
+
+    def critical_path(self):
+        """
+        Chain of steps that determined the total run time, found by walking
+        back from the last finished step through its latest finished
+        dependency
+        :return: List of step names from the first to the last step
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda step: self.timings[step][1])
+        path = [name]
+        while True:
+            deps = [dep for dep in self._tasks[name][1] if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda dep: self.timings[dep][1])
+            path.append(name)
+        return path[::-1]
+
+    def report(self):
+        """
+        Log the per-step timing breakdown and the critical path
+        :return: dict of step name -> (start, end) seconds from graph start
+        """
+        critical = self.critical_path()
+        for name, (start, end) in sorted(
+            self.timings.items(), key=lambda item: item[1]
+        ):
+            log.info(
+                "Step {:<20} {:7.2f} s - {:7.2f} s  {:7.2f} s{}".format(
+                    name,
+                    start,
+                    end,
+                    end - start,
+                    "  *" if name in critical else "",
+                )
+            )
+        if critical:
+            log.info(
+                "Critical path: {} ({:.2f} s)".format(
+                    " -> ".join(critical), self.timings[critical[-1]][1]
+                )
+            )
+        return self.timings
@@ -12,6 +12,7 @@ limitations under the License.
 """
 
 from datetime import datetime
+import hashlib
 import logging
 import os
 import random
@@ -21,6 +22,8 @@ import mbed_lstools
 
 log = logging.getLogger(__name__)
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
 
 def get_bootstrap_time_and_execution_mode(cloud_api, endpoint_id, headers):
     """
@@ -98,24 +101,66 @@ def build_random_string(str_length, use_digits=False, use_punctuations=False):
     return "".join(random.choice(letters) for c in range(str_length))
 
 
+ANSI_ESCAPE_PATTERN = re.compile(rb"\033\[(?:\d|;)*[a-zA-Z]")
+
+
 def strip_escape(string_to_escape):
     """
     Strip escape characters from string.
     :param string_to_escape: string to work on
     :return: stripped string
     """
-    raw_ansi_pattern = r"\033\[((?:\d|;)*)([a-zA-Z])"
-    ansi_pattern = raw_ansi_pattern.encode()
-    ansi_eng = re.compile(ansi_pattern)
-    matches = []
-    for match in ansi_eng.finditer(string_to_escape):
-        matches.append(match)
-    matches.reverse()
-    for match in matches:
-        start = match.start()
-        end = match.end()
-        string_to_escape = string_to_escape[0:start] + string_to_escape[end:]
-    return string_to_escape
+    return ANSI_ESCAPE_PATTERN.sub(b"", string_to_escape)
+
+
+def normalize_line(line):
+    """
+    Normalize raw client output line in one pass: strip escape characters,
+    keep only the last carriage return overwritten part of the line and
+    replace tabs
+    :param line: Raw output line (bytes)
+    :return: Decoded output line
+    """
+    plain_line = ANSI_ESCAPE_PATTERN.sub(b"", line)
+    if line.count(b"\r") > 1:
+        plain_line = plain_line.split(b"\r")[-2]
+    return plain_line.replace(b"\t", b"  ").decode("utf-8", "replace")
+
+
+def percentiles(values, wanted=(50, 95, 99)):
+    """
+    Calculate percentiles with linear interpolation between closest ranks
+    :param values: List of numbers
+    :param wanted: Percentiles to calculate
+    :return: dict of "p<percentile>" -> value, None values if no values given
+    """
+    ordered = sorted(values)
+    result = {}
+    for percentile in wanted:
+        key = "p{}".format(percentile)
+        if not ordered:
+            result[key] = None
+            continue
+        rank = (len(ordered) - 1) * percentile / 100.0
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        result[key] = ordered[low] + (ordered[high] - ordered[low]) * (
+            rank - low
+        )
+    return result
+
+
+def file_sha256(path):
+    """
+    Calculate SHA-256 of file content
+    :param path: File path
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def get_serial_port_for_mbed(target_id):
@@ -45,4 +45,5 @@ setup(
     license="Apache-2.0",
     packages=PACKAGE_LIST,
     install_requires=required,
+    extras_require={"asyncio": ["websockets"]},
 )
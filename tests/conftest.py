@@ -62,6 +62,30 @@ def pytest_addoption(parser):
         default=False,
         help="set true if given update_bin is a delta image",
     )
+    parser.addoption(
+        "--old_bin",
+        action="store",
+        default=None,
+        help="image on the device, update with delta from it to update_bin",
+    )
+    parser.addoption(
+        "--delta_cache",
+        action="store",
+        default=os.path.join(os.getcwd(), "delta-cache"),
+        help="directory of cached delta images",
+    )
+    parser.addoption(
+        "--firmware_cache",
+        action="store_true",
+        default=False,
+        help="reuse uploaded update image and manifest within test session",
+    )
+    parser.addoption(
+        "--sweep_orphans",
+        action="store_true",
+        default=False,
+        help="delete test objects left by crashed runs at session start",
+    )
     parser.addoption(
         "--local_binary", action="store", help="local linux client binary path"
     )
@@ -77,6 +101,40 @@ def pytest_addoption(parser):
         default="v3",
         help="manifest template version",
     )
+    parser.addoption(
+        "--ws_max_events",
+        action="store",
+        type=int,
+        default=None,
+        help="maximum number of stored WebSocket events per type",
+    )
+    parser.addoption(
+        "--ws_max_event_age",
+        action="store",
+        type=float,
+        default=None,
+        help="maximum age of stored WebSocket events in seconds",
+    )
+    parser.addoption(
+        "--fleet_size",
+        action="store",
+        type=int,
+        default=10,
+        help="number of local client binaries run by client_fleet fixture",
+    )
+    parser.addoption(
+        "--benchmark_runs",
+        action="store",
+        type=int,
+        default=5,
+        help="number of registrations measured per device in benchmark",
+    )
+    parser.addoption(
+        "--benchmark_output",
+        action="store",
+        default="registration-benchmark.json",
+        help="registration benchmark results file",
+    )
 
 
 def pytest_report_teststatus(report):
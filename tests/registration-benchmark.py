@@ -0,0 +1,53 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+from client_test_lib.tools.benchmark import RegistrationBenchmark
+
+log = logging.getLogger(__name__)
+
+REGISTRATION_TIMEOUT = 300
+
+
+def _run_benchmark(benchmark, clients, request, prefix=""):
+    for run in range(1, request.config.getoption("benchmark_runs", 5) + 1):
+        log.info("Registration benchmark run {}".format(run))
+        benchmark.measure_reset(clients, run)
+    output_dir, output_name = os.path.split(
+        request.config.getoption("benchmark_output")
+    )
+    return benchmark.save(
+        os.path.join(output_dir, prefix + output_name),
+        {"clients": len(clients)},
+    )
+
+
+def test_registration_benchmark(websocket, client, request):
+    benchmark = RegistrationBenchmark(websocket, REGISTRATION_TIMEOUT)
+    result = _run_benchmark(benchmark, [client], request)
+    assert (
+        result["report"]["cloud_registered"]["failed"] == 0
+    ), "Client didn't register in all benchmark runs"
+
+
+def test_fleet_registration_benchmark(websocket, client_fleet, request):
+    benchmark = RegistrationBenchmark(websocket, REGISTRATION_TIMEOUT)
+    # run 0 measures the registrations from process start
+    for cli, started in zip(client_fleet.clients, client_fleet.start_times):
+        benchmark.measure(cli, started, 0)
+    result = _run_benchmark(benchmark, client_fleet.clients, request, "fleet-")
+    assert (
+        result["report"]["cloud_registered"]["failed"] == 0
+    ), "Clients didn't register in all benchmark runs"
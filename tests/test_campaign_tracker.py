@@ -0,0 +1,77 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from types import SimpleNamespace
+from client_test_lib.helpers.update_helper import CampaignTracker
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.text = str(body)
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+
+class FakeUpdate:
+    def __init__(self):
+        self.devices = {}
+        self.campaign = {"state": "active", "phase": "active"}
+
+    def get_update_campaign(self, campaign_id):
+        return FakeResponse(self.campaign)
+
+    def get_update_campaign_metadata(self, campaign_id, query_params=None):
+        data = [
+            {"id": str(i), "device_id": device_id, "deployment_state": state}
+            for i, (device_id, state) in enumerate(self.devices.items())
+        ]
+        return FakeResponse({"data": data, "has_more": False})
+
+
+def _cloud():
+    return SimpleNamespace(update=FakeUpdate())
+
+
+def test_not_done_before_campaign_finishes():
+    cloud = _cloud()
+    tracker = CampaignTracker(cloud, "campaign")
+    cloud.update.devices["dev-1"] = "deployed"
+    tracker.update()
+    assert not tracker.done()
+
+    cloud.update.devices["dev-2"] = "pending"
+    tracker.update()
+    assert not tracker.done()
+
+    cloud.update.devices["dev-2"] = "deployed"
+    cloud.update.campaign = {"state": "autostopped", "phase": "stopped"}
+    tracker.update()
+    assert tracker.done()
+
+
+def test_expected_devices():
+    cloud = _cloud()
+    tracker = CampaignTracker(cloud, "campaign", expected_devices=2)
+    cloud.update.devices["dev-1"] = "deployed"
+    tracker.update()
+    assert not tracker.done()
+
+    cloud.update.devices["dev-2"] = "deployed"
+    tracker.update()
+    assert tracker.done()
+    assert not tracker.campaign_finished
@@ -0,0 +1,174 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+from types import SimpleNamespace
+import pytest
+from client_test_lib.helpers import cleanup
+from client_test_lib.helpers.cleanup import (
+    CLEANUP_ORDER,
+    CleanupRegistry,
+    e2e_name,
+    sweep_orphans,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = str(body)
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Fake monotonic clock advanced by the retry sleeps
+    """
+    fake = SimpleNamespace(now=0.0, sleeps=[])
+
+    def sleep(delay):
+        fake.sleeps.append(delay)
+        fake.now += delay
+
+    monkeypatch.setattr(cleanup, "monotonic", lambda: fake.now)
+    monkeypatch.setattr(cleanup, "sleep", sleep)
+    return fake
+
+
+def _responses(*status_codes):
+    """
+    Delete function returning the given status codes, the last one repeats
+    """
+    calls = []
+
+    def delete(object_id):
+        calls.append(object_id)
+        return FakeResponse(
+            status_codes[min(len(calls), len(status_codes)) - 1]
+        )
+
+    return delete, calls
+
+
+def test_cleanup_order():
+    deleted = []
+    registry = CleanupRegistry(None, max_workers=1)
+    for kind in ("other", "api_key", "image", "campaign", "manifest"):
+        registry.add(kind, kind, deleted.append)
+    registry.add_release("manifest", "1", deleted.append)
+    registry.add("websocket", "websocket", deleted.append)
+
+    assert registry.cleanup() == []
+    expected = [kind for kind in CLEANUP_ORDER if kind != "release"]
+    expected.insert(1, "1")
+    assert deleted == expected + ["other"]
+    assert len(registry) == 0
+
+
+def test_retry_until_deleted(clock):
+    delete, calls = _responses(409, 429, 503, 204)
+    registry = CleanupRegistry(None, budget=60)
+    registry.add("image", "img", delete)
+
+    assert registry.cleanup() == []
+    assert len(calls) == 4
+    assert clock.sleeps == [1, 2, 4]
+
+
+def test_retry_until_budget_is_used(clock):
+    delete, calls = _responses(500, 429)
+    registry = CleanupRegistry(None, budget=10)
+    registry.add("image", "img", delete)
+
+    errors = registry.cleanup()
+    assert len(errors) == 1 and "[429]" in errors[0]
+    assert clock.sleeps == [1, 2, 4]
+    assert len(calls) == 4
+    registry.add("image", "img", delete)
+    with pytest.raises(AssertionError):
+        registry.cleanup(assert_errors=True)
+
+
+def test_no_retry_on_client_error(clock):
+    delete, calls = _responses(400)
+    registry = CleanupRegistry(None)
+    registry.add("image", "img", delete)
+
+    assert registry.cleanup() == ["image img: [400] None"]
+    assert len(calls) == 1 and clock.sleeps == []
+
+
+def _created_at(age):
+    created = datetime.datetime.now(
+        datetime.timezone.utc
+    ) - datetime.timedelta(seconds=age)
+    return created.replace(tzinfo=None).isoformat() + "Z"
+
+
+class FakeList:
+    """
+    Cloud list endpoint returning the items one per page
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __call__(self, query_params=None):
+        ids = [item["id"] for item in self.items]
+        start = 0
+        if "after" in query_params:
+            start = ids.index(query_params["after"]) + 1
+        page = self.items[start : start + 1]
+        return FakeResponse(
+            200, {"data": page, "has_more": start + 1 < len(self.items)}
+        )
+
+
+def test_sweep_orphans(clock):
+    deleted = []
+    images = FakeList(
+        [
+            {
+                "id": "old",
+                "name": e2e_name("img"),
+                "created_at": _created_at(7200),
+            },
+            {
+                "id": "new",
+                "name": e2e_name("img"),
+                "created_at": _created_at(60),
+            },
+            {"id": "user", "name": "img", "created_at": _created_at(7200)},
+            {"id": "unnamed", "name": None, "created_at": _created_at(7200)},
+        ]
+    )
+    empty = FakeList([])
+    cloud = SimpleNamespace(
+        update=SimpleNamespace(
+            get_update_campaigns=empty,
+            get_firmware_manifests=empty,
+            get_firmware_images=images,
+            delete_firmware_image=lambda i: deleted.append(i)
+            or FakeResponse(204),
+        ),
+        account=SimpleNamespace(get_api_keys=empty),
+    )
+
+    assert sweep_orphans(cloud, max_age=3600) == 1
+    assert deleted == ["old"]
@@ -0,0 +1,78 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import sys
+from client_test_lib.tools import delta_tool
+from client_test_lib.tools.delta_tool import DeltaCache
+
+FAKE_DELTA_TOOL = """#!{python}
+import json, os, sys
+args = sys.argv[1:]
+new, out = args[args.index("-n") + 1], args[args.index("-o") + 1]
+with open(out, "wb") as f:
+    f.write(b"delta" * (os.path.getsize(new) // 50))
+with open(os.path.splitext(out)[0] + ".json", "w") as f:
+    json.dump({{"installed-digest": "abc"}}, f)
+"""
+
+
+def _fake_delta_tool(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    tool = bin_dir / delta_tool.MANIFEST_DELTA_TOOL
+    tool.write_text(FAKE_DELTA_TOOL.format(python=sys.executable))
+    tool.chmod(0o755)
+    monkeypatch.setenv(
+        "PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"])
+    )
+
+
+def _images(tmp_path):
+    old = tmp_path / "old.bin"
+    new = tmp_path / "new.bin"
+    old.write_bytes(os.urandom(1000))
+    new.write_bytes(os.urandom(2000))
+    return str(old), str(new)
+
+
+def test_json_delta_manifest_is_not_overwritten(tmp_path, monkeypatch):
+    _fake_delta_tool(tmp_path, monkeypatch)
+    old, new = _images(tmp_path)
+    cache = DeltaCache(str(tmp_path / "cache"), max_workers=1)
+
+    delta = cache.delta(old, new)
+    assert not delta["cached"]
+    with open(delta["delta_manifest"]) as f:
+        assert json.load(f) == {"installed-digest": "abc"}
+    assert delta["delta_size"] == os.path.getsize(delta["delta"])
+
+    cached = DeltaCache(str(tmp_path / "cache")).delta(old, new)
+    assert cached["cached"]
+    assert cached["delta_manifest"] == delta["delta_manifest"]
+
+
+def test_invalid_cache_entry_is_rebuilt(tmp_path, monkeypatch):
+    _fake_delta_tool(tmp_path, monkeypatch)
+    old, new = _images(tmp_path)
+    cache = DeltaCache(str(tmp_path / "cache"), max_workers=1)
+    entry_dir = cache._entry_dir(old, new)
+    os.makedirs(entry_dir)
+    with open(os.path.join(entry_dir, delta_tool.STATS_FILE), "w") as f:
+        f.write("{partial")
+
+    delta = cache.delta(old, new)
+    assert delta is not None and not delta["cached"]
+    assert delta_tool._load_entry(entry_dir) is not None
@@ -0,0 +1,129 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+from client_test_lib.helpers import event_store
+from client_test_lib.helpers.event_store import (
+    AsyncResponseStore,
+    EventStore,
+    RetentionPolicy,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Fake monotonic clock of the stores, set now[0] to move the time
+    """
+    now = [0.0]
+    monkeypatch.setattr(event_store, "monotonic", lambda: now[0])
+    return now
+
+
+def _event(ep, path=None, value=None):
+    event = {"ep": ep, "value": value}
+    if path is not None:
+        event["path"] = path
+    return event
+
+
+def test_index_lookups():
+    store = EventStore()
+    store.append(_event("dev-1", "/3/0/0", "a"))
+    store.append(_event("dev-2", "/3/0/0", "b"))
+    store.append(_event("dev-1", "/3/0/1", "c"))
+    store.append(_event("dev-1"))
+
+    assert store.find("dev-1", "/3/0/1")["value"] == "c"
+    assert store.find("dev-2", "/3/0/1") is None
+    assert [e["value"] for e in store.find_all("dev-1")] == ["a", "c", None]
+    assert [
+        e["value"] for e in store.find_all("dev-1", ["/3/0/1", "/3/0/0"])
+    ] == ["a", "c"]
+    assert store.find("dev-1", match=lambda e: e["value"] == "c")
+
+
+def test_sequence_tailing():
+    store = EventStore()
+    store.append(_event("dev-1", "/3/0/0", "old"))
+    store.append(_event("dev-2", "/3/0/0", "other"))
+    min_seq = store.next_seq
+    store.append(_event("dev-1", "/3/0/0", "new"))
+    store.append(_event("dev-2", "/3/0/0", "newer"))
+
+    assert store.find("dev-1", "/3/0/0")["value"] == "old"
+    assert store.find("dev-1", "/3/0/0", min_seq=min_seq)["value"] == "new"
+    assert [
+        e["value"]
+        for e in store.find_all("dev-1", ["/3/0/0"], min_seq=min_seq)
+    ] == ["new"]
+    assert [e["value"] for e in store.to_list(min_seq)] == ["new", "newer"]
+    assert [
+        e["value"] for e in store.to_list(min_seq, endpoints=["dev-2"])
+    ] == ["newer"]
+    assert store.to_list(store.next_seq) == []
+    assert len(store.to_list(0)) == len(store) == 4
+
+
+def test_max_entries_eviction():
+    store = EventStore(RetentionPolicy(max_entries=2))
+    store.append(_event("dev-1", "/3/0/0", "a"))
+    store.append(_event("dev-2", "/3/0/0", "b"))
+    store.append(_event("dev-1", "/3/0/0", "c"))
+
+    assert len(store) == 2 and store.evicted == 1
+    assert [e["value"] for e in store] == ["b", "c"]
+    assert [e["value"] for e in store.find_all("dev-1")] == ["c"]
+
+    store.append(_event("dev-1", "/3/0/1", "d"))
+    assert store.find("dev-2") is None
+    assert "dev-2" not in store._by_endpoint
+    assert ("dev-2", "/3/0/0") not in store._by_path
+
+
+def test_max_age_eviction(clock):
+    store = EventStore(RetentionPolicy(max_age=10))
+    store.append(_event("dev-1", "/3/0/0", "a"))
+    clock[0] = 5
+    store.append(_event("dev-1", "/3/0/0", "b"))
+
+    clock[0] = 12
+    assert [e["value"] for e in store.find_all("dev-1")] == ["b"]
+    clock[0] = 16
+    assert store.find("dev-1", "/3/0/0") is None
+    assert store.to_list() == [] and store.evicted == 2
+
+
+def test_async_responses(clock):
+    responses = AsyncResponseStore(
+        RetentionPolicy(max_entries=2, max_age=10, drop_after_consumed=True)
+    )
+    responses["a"] = {"status": 200}
+    responses["b"] = {"status": 200}
+    responses["c"] = {"status": 404}
+    assert "a" not in responses and responses.evicted == 1
+
+    assert responses.consume("b") == {"status": 200}
+    assert "b" not in responses and responses.consumed == 1
+    assert responses.consume("b") is None
+
+    clock[0] = 11
+    assert responses.get("c") is None and responses.evicted == 2
+
+
+def test_consumed_async_responses_are_kept_by_default():
+    responses = AsyncResponseStore()
+    responses["a"] = {"status": 200}
+    assert responses.consume("a") == {"status": 200}
+    assert responses["a"] == {"status": 200} and responses.consumed == 0
@@ -0,0 +1,77 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import sys
+from client_test_lib.tools import manifest_tool
+from client_test_lib.tools.manifest_tool import ManifestWorkerPool
+
+FAKE_DEV_TOOL = """#!{python}
+import sys
+args = sys.argv[1:]
+if "fail" in args[args.index("-u") + 1]:
+    print("signing key not found", file=sys.stderr)
+    sys.exit(2)
+with open(args[args.index("-o") + 1], "w") as f:
+    f.write("manifest " + " ".join(args))
+"""
+
+
+def _fake_dev_tool(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    tool = bin_dir / manifest_tool.MANIFEST_DEV_TOOL
+    tool.write_text(FAKE_DEV_TOOL.format(python=sys.executable))
+    tool.chmod(0o755)
+    monkeypatch.setenv(
+        "PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"])
+    )
+
+
+def test_manifests_get_unique_files(tmp_path, monkeypatch):
+    _fake_dev_tool(tmp_path, monkeypatch)
+    with ManifestWorkerPool(
+        str(tmp_path), max_workers=2, in_process=False
+    ) as pool:
+        files = pool.create_manifests(
+            [
+                {
+                    "firmware_url": "https://fw/{}".format(i),
+                    "update_image_path": "update.bin",
+                }
+                for i in range(4)
+            ]
+        )
+    assert all(files)
+    assert len(set(files)) == 4
+    for i, manifest_file in enumerate(files):
+        with open(manifest_file) as f:
+            assert "https://fw/{}".format(i) in f.read()
+
+
+def test_failed_manifest_logs_tool_output(tmp_path, monkeypatch, caplog):
+    _fake_dev_tool(tmp_path, monkeypatch)
+    # stale file from an earlier run must not be returned
+    (tmp_path / "stale.manifest").write_text("stale")
+    with ManifestWorkerPool(
+        str(tmp_path), max_workers=1, in_process=False
+    ) as pool:
+        with caplog.at_level(logging.ERROR, logger=manifest_tool.__name__):
+            manifest_file = pool.submit(
+                "https://fw/fail", "update.bin", output="stale.manifest"
+            ).result()
+    assert manifest_file is None
+    assert "signing key not found" in caplog.text
+    assert "exit code 2" in caplog.text
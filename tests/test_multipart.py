@@ -0,0 +1,83 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from email.parser import BytesParser
+import os
+import pytest
+from client_test_lib.cloud.libraries.rest_api.multipart import (
+    MultipartFileEncoder,
+)
+
+
+def _read_all(body, size):
+    data = b""
+    while True:
+        chunk = body.read(size)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def _parts(body, data):
+    message = BytesParser().parsebytes(
+        "Content-Type: {}\r\n\r\n".format(body.content_type).encode() + data
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part
+        for part in message.get_payload()
+    }
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "update.bin"
+    path.write_bytes(os.urandom(10000))
+    return str(path)
+
+
+def test_length_and_content(image):
+    progress = []
+    with MultipartFileEncoder(
+        "datafile",
+        image,
+        fields={"name": "fw"},
+        chunk_size=1024,
+        progress=lambda sent, total: progress.append((sent, total)),
+    ) as body:
+        chunks = list(body)
+
+    data = b"".join(chunks)
+    assert len(data) == len(body) == body.tell()
+    assert max(len(chunk) for chunk in chunks) <= 1024
+    assert progress[-1] == (len(body), len(body))
+    parts = _parts(body, data)
+    assert parts["name"].get_payload() == "fw"
+    assert parts["datafile"].get_filename() == "update.bin"
+    with open(image, "rb") as f:
+        assert parts["datafile"].get_payload(decode=True) == f.read()
+    assert body.stats()["bytes"] == len(body)
+
+
+def test_seek_to_start_rereads_body(image):
+    with MultipartFileEncoder("datafile", image, chunk_size=4096) as body:
+        first = body.read(100) + body.read(5000)
+        body.seek(0)
+        assert body.tell() == 0
+        data = _read_all(body, 777)
+        assert data.startswith(first)
+        body.seek(0)
+        assert _read_all(body, -1) == data
+        assert len(data) == len(body)
+        with pytest.raises(OSError):
+            body.seek(10)
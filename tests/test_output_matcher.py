@@ -0,0 +1,52 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+from client_test_lib.tools.output_matcher import OutputMatcher
+
+
+def test_compiled_pattern_flags_are_kept():
+    matcher = OutputMatcher(
+        {
+            "registered": re.compile(r"registered id: (?P<id>\w+)", re.I),
+            "ready": re.compile("ready"),
+        },
+        ignore_case=False,
+    )
+    result = matcher.match("Client REGISTERED ID: 0123abc")
+    assert result.name == "registered"
+    assert result.fields == {"id": "0123abc"}
+    # flags of one pattern don't apply to the others
+    assert matcher.match("READY") is None
+    assert matcher.match("ready").name == "ready"
+
+
+def test_inline_flags_in_combined_pattern():
+    matcher = OutputMatcher(
+        {
+            "ready": re.compile("ready"),
+            "registered": re.compile(r"(?i)registered id: (?P<id>\w+)"),
+            "bootstrap": re.compile(
+                r"""(?x)
+                bootstrap \s+ (?P<state>done)  # bootstrap finished
+                """
+            ),
+        },
+        errors=[re.compile("(?s)fail.*error")],
+        ignore_case=False,
+    )
+    assert matcher.match("REGISTERED ID: 42").fields == {"id": "42"}
+    assert matcher.match("bootstrap   done").fields == {"state": "done"}
+    assert matcher.match("READY") is None
+    assert matcher.match("fail\nerror").is_error
@@ -0,0 +1,105 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from email.utils import formatdate
+from types import SimpleNamespace
+import pytest
+from client_test_lib.helpers import poller
+from client_test_lib.helpers.poller import Poller, server_delay
+
+EPOCH = 1700000000.0
+
+
+class FakeResponse:
+    def __init__(self, status_code, value=None, headers=None):
+        self.status_code = status_code
+        self.value = value
+        self.text = str(value)
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Fake clocks of the poller advanced by its sleeps
+    """
+    fake = SimpleNamespace(now=0.0, sleeps=[])
+
+    def sleep(delay):
+        fake.sleeps.append(delay)
+        fake.now += delay
+
+    monkeypatch.setattr(poller, "monotonic", lambda: fake.now)
+    monkeypatch.setattr(poller, "time", lambda: EPOCH + fake.now)
+    monkeypatch.setattr(poller, "sleep", sleep)
+    return fake
+
+
+def test_server_delay(clock):
+    assert server_delay(FakeResponse(200)) is None
+    assert server_delay(FakeResponse(429, headers={"Retry-After": "3"})) == 3
+    http_date = formatdate(EPOCH + 30, usegmt=True)
+    assert (
+        server_delay(FakeResponse(503, headers={"Retry-After": http_date}))
+        == 30
+    )
+    assert (
+        server_delay(FakeResponse(503, headers={"Retry-After": "x"})) is None
+    )
+    limited = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "4"}
+    assert server_delay(FakeResponse(200, headers=limited)) == 4
+    limited["X-RateLimit-Reset"] = str(EPOCH + 6)
+    assert server_delay(FakeResponse(200, headers=limited)) == 6
+
+
+def test_retry_after_backoff(clock):
+    responses = iter(
+        [
+            FakeResponse(503, headers={"Retry-After": "7"}),
+            FakeResponse(
+                200,
+                "running",
+                {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "5"},
+            ),
+            FakeResponse(200, "running"),
+            FakeResponse(429),
+            FakeResponse(200, "done"),
+        ]
+    )
+    watcher = Poller(initial_delay=1, max_delay=10)
+    watcher.watch(
+        "campaign",
+        lambda: next(responses),
+        lambda r: (r.value == "done", r.value),
+    )
+
+    assert watcher.run(60) == {"campaign": "done"}
+    # Retry-After and rate limit reset extend the interval, unchanged value
+    # backs off by 1.5 and 429 doubles the interval
+    assert clock.sleeps == [7, 5, 1.5, 3]
+    assert watcher.polls == 5 and watcher.pending() == []
+
+
+def test_timeout_polls_once_more(clock):
+    watcher = Poller(initial_delay=1, max_delay=2)
+    watcher.watch(
+        "campaign",
+        lambda: FakeResponse(200, "running"),
+        lambda r: (False, r.value),
+    )
+
+    assert watcher.run(5) == {}
+    assert watcher.pending() == ["campaign"]
+    assert watcher.values == {"campaign": "running"}
+    assert sum(clock.sleeps) == 5
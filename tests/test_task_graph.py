@@ -0,0 +1,69 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import threading
+from time import sleep
+import pytest
+from client_test_lib.tools.task_graph import TaskGraph
+
+
+def test_results_are_passed_to_dependents():
+    graph = TaskGraph()
+    graph.add("image", lambda: "image-id")
+    graph.add("device", lambda: "device-id")
+    graph.add("manifest", lambda image: image + "-manifest", "image")
+    graph.add(
+        "campaign",
+        lambda manifest, device: (manifest, device),
+        "manifest",
+        "device",
+    )
+
+    results = graph.run()
+    assert results["campaign"] == ("image-id-manifest", "device-id")
+    assert set(graph.timings) == {"image", "device", "manifest", "campaign"}
+    assert graph.critical_path()[-1] == "campaign"
+
+
+def test_unknown_dependency():
+    graph = TaskGraph()
+    with pytest.raises(AssertionError):
+        graph.add("manifest", lambda image: image, "image")
+
+
+def test_failure_stops_dependent_steps():
+    failed = threading.Event()
+    ran = []
+
+    def fail():
+        failed.set()
+        raise ValueError("upload failed")
+
+    def slow():
+        # still running when the other step fails
+        assert failed.wait(10)
+        sleep(0.2)
+        return "device-id"
+
+    graph = TaskGraph(max_workers=2)
+    graph.add("image", fail)
+    graph.add("device", slow)
+    graph.add("manifest", lambda image: ran.append("manifest"), "image")
+    graph.add("ready", lambda device: ran.append("ready"), "device")
+
+    with pytest.raises(ValueError, match="upload failed"):
+        graph.run()
+    assert ran == []
+    assert graph.results == {"device": "device-id"}
+    assert set(graph.timings) == {"image", "device"}
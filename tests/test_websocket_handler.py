@@ -0,0 +1,105 @@
+"""
+Copyright (c) 2024 Izuma Networks
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+    http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+from client_test_lib.helpers.websocket_handler import (
+    BaseWebSocketRunner,
+    WebSocketHandler,
+)
+
+
+class FakeRunner(BaseWebSocketRunner):
+    """
+    Runner fed directly with messages, waits don't block
+    """
+
+    def wait_for(self, keys, check, timeout):
+        return check() or False
+
+    def _wake_waiters(self, key):
+        pass
+
+
+def _notification(device_id, path, value):
+    return {
+        "ep": device_id,
+        "path": path,
+        "payload": base64.b64encode(value.encode()).decode(),
+    }
+
+
+def test_views_share_channel_and_are_isolated():
+    ws = FakeRunner()
+    channel = WebSocketHandler(ws)
+    ws._handle_message(
+        {
+            "registrations": [{"ep": "dev-a"}],
+            "notifications": [_notification("dev-a", "/1/0/1", "old")],
+        }
+    )
+
+    view_a = channel.view(device_ids=["dev-a"])
+    view_b = channel.view(device_ids=["dev-b"])
+    assert not view_a.check_registration("dev-a")
+    assert view_a.get_notifications() == []
+
+    ws._handle_message(
+        {
+            "registrations": [{"ep": "dev-a"}, {"ep": "dev-b"}],
+            "notifications": [
+                _notification("dev-a", "/1/0/1", "new"),
+                _notification("dev-b", "/1/0/1", "other"),
+            ],
+        }
+    )
+
+    # Both views see their own device's events stored after view creation
+    assert view_a.check_registration("dev-a")
+    assert view_b.check_registration("dev-b")
+    assert view_a.wait_for_registration("dev-a", timeout=0)
+    assert view_a.wait_for_notification("dev-a", "/1/0/1", "new", timeout=0)
+    assert not view_a.wait_for_notification(
+        "dev-a", "/1/0/1", "old", timeout=0
+    )
+    assert [n["decoded_payload"] for n in view_a.get_notifications()] == [
+        "new"
+    ]
+    assert [n["decoded_payload"] for n in view_b.get_notifications()] == [
+        "other"
+    ]
+
+    # Other views' devices are not visible
+    assert not view_a.check_registration("dev-b")
+    assert not view_b.check_registration("dev-a")
+    assert not view_b.wait_for_notification(
+        "dev-a", "/1/0/1", "new", timeout=0
+    )
+
+    # The channel itself sees everything
+    assert len(channel.get_notifications()) == 3
+    assert channel.wait_for_notification("dev-a", "/1/0/1", "old", timeout=0)
+
+
+def test_view_created_later_skips_earlier_events():
+    ws = FakeRunner()
+    channel = WebSocketHandler(ws)
+    first = channel.view()
+    ws._handle_message({"reg-updates": [{"ep": "dev-a"}]})
+    second = channel.view()
+    ws._handle_message({"de-registrations": ["dev-a"]})
+
+    assert first.check_registration_updates("dev-a")
+    assert not second.check_registration_updates("dev-a")
+    assert first.check_deregistration("dev-a")
+    assert second.check_deregistration("dev-a")